@@ -39,20 +39,416 @@ License:
 """
 from typing import List, Set, Dict, Tuple, Optional, Union
 from numpy.typing import NDArray
+from collections import defaultdict
+from contextlib import nullcontext
+from multiprocessing.pool import Pool
 import os
+import json
+import threading
+import time
 import numpy as np
 
 from gwbench import network
 from gwbench.basic_relations import f_isco_Msolar
+import gwbench.antenna_pattern_np as ant_pat_np
+import gwbench.basic_functions as bfs
+import gwbench.detector_class as dc
+import gwbench.detector_response_derivatives as drd
+import gwbench.err_deriv_handling as edh
+import gwbench.fisher_analysis_tools as fat
+import gwbench.snr as snr_mod
+import gwbench.wf_class as wfc
 
 from useful_functions import (
-    without_rows_w_nan,
     parallel_map,
+    flatten_list,
     HiddenPrints,
     PassEnterExit,
 )
-from generate_injections import filter_bool_for_injection, fisco_obs_from_Mc_eta
+from generate_injections import (
+    filter_bool_for_injection,
+    plan_injections,
+    non_uniform_frequency_grid,
+    grid_rtol_for_wf_model,
+)
 from network_subclass import NetworkExtended
+from results_store import (
+    LEGACY_RESULTS_COLUMNS,
+    results_row_length,
+    results_row_slices,
+    pack_upper_triangle,
+    results_store_path,
+    save_results_store,
+)
+
+# order of the injection parameters in each row of the injections data
+VARIED_KEYS = [
+    "Mc",
+    "eta",
+    "chi1x",
+    "chi1y",
+    "chi1z",
+    "chi2x",
+    "chi2y",
+    "chi2z",
+    "DL",
+    "iota",
+    "ra",
+    "dec",
+    "psi",
+    "z",
+]
+# minimum frequency [Hz] of the injections' frequency grids
+FMIN = 5.0
+# waveform models that evaluate on any frequency array, the lal models use lalsimulation's frequency sequences
+NON_UNIFORM_GRID_WF_MODELS = ("tf2", "tf2_tidal", "lal_bbh", "lal_bns")
+
+
+def frequency_grid_bounds_for_injection(
+    inj: NDArray[np.float64],
+    wf_dict: Dict[str, Union[str, Optional[Dict[str, str]], bool, int]],
+    deriv_dict: Dict[
+        str,
+        Union[
+            str,
+            Tuple[str, ...],
+            List[Set[str]],
+            bool,
+            Optional[Dict[str, Union[float, str, int]]],
+        ],
+    ],
+    misc_settings_dict: Dict[str, Optional[int]],
+    debug: bool = False,
+) -> Optional[Tuple[float, float, float]]:
+    """Returns the minimum frequency, maximum frequency, and frequency spacing of the grid to benchmark a single injection on.
+
+    Args:
+        inj: Injection parameters, 14 long.
+        wf_dict: Waveform dictionary of model name and options, also contains the science case string.
+        deriv_dict: Derivative options dictionary.
+        misc_settings_dict: Options for gwbench, e.g. whether to account for Earth's rotation about its axis.
+        debug: Whether to debug.
+
+    Returns:
+        Optional[Tuple[float, float, float]]: (fmin, fmax, df) or None if the injection is filtered out.
+    """
+    plan = frequency_grid_plan_for_injections(
+        inj[np.newaxis], wf_dict, deriv_dict, misc_settings_dict
+    )
+    if not plan["valid"][0]:
+        if debug:
+            # prints the reason
+            filter_bool_for_injection(
+                inj,
+                misc_settings_dict["redshifted"],
+                wf_dict["coeff_fisco"],
+                wf_dict["science_case"],
+                aLIGO_or_Vplus_used=aLIGO_or_Vplus_used(deriv_dict),
+                debug=debug,
+            )
+        return None
+    return FMIN, float(plan["fmax"][0]), float(plan["df"][0])
+
+
+def aLIGO_or_Vplus_used(
+    deriv_dict: Dict[
+        str,
+        Union[
+            str,
+            Tuple[str, ...],
+            List[Set[str]],
+            bool,
+            Optional[Dict[str, Union[float, str, int]]],
+        ],
+    ],
+) -> bool:
+    """Returns whether aLIGO or V+ is in any network, then f is truncated for V+ for all networks (since f is shared between them).
+
+    Args:
+        deriv_dict: Derivative options dictionary.
+    """
+    # TODO: figure out how common this is
+    return ("aLIGO" in deriv_dict["unique_tecs"]) or ("V+" in deriv_dict["unique_tecs"])
+
+
+def frequency_grid_plan_for_injections(
+    inj_data: NDArray[NDArray[np.float64]],
+    wf_dict: Dict[str, Union[str, Optional[Dict[str, str]], bool, int]],
+    deriv_dict: Dict[
+        str,
+        Union[
+            str,
+            Tuple[str, ...],
+            List[Set[str]],
+            bool,
+            Optional[Dict[str, Union[float, str, int]]],
+        ],
+    ],
+    misc_settings_dict: Dict[str, Optional[int]],
+) -> Dict[str, NDArray]:
+    """Returns the validity and uniform frequency grid of each injection for the networks being benchmarked, see plan_injections in generate_injections.py.
+
+    fmax is clamped to [11, 1024] Hz if aLIGO or V+ is used and [6, 1024] Hz otherwise, and df linearly transitions from 1/16 Hz (fine from B&S2022) to 10 Hz (coarse to save computation time) over that range.
+
+    Args:
+        inj_data: Injection parameters, each row 14 long.
+        wf_dict: Waveform dictionary of model name and options, also contains the science case string.
+        deriv_dict: Derivative options dictionary.
+        misc_settings_dict: Options for gwbench, e.g. whether to account for Earth's rotation about its axis.
+
+    Returns:
+        Dict[str, NDArray]: Arrays "valid", "fisco_obs", "fmax", "df", "num_points", and "grid_key" of the same length as inj_data.
+    """
+    return plan_injections(
+        inj_data,
+        misc_settings_dict["redshifted"],
+        wf_dict["coeff_fisco"],
+        wf_dict["science_case"],
+        aLIGO_or_Vplus_used=aLIGO_or_Vplus_used(deriv_dict),
+        fmin=FMIN,
+    )
+
+
+def frequency_grid_for_injection(
+    fmin: float,
+    fmax: float,
+    df: float,
+    wf_dict: Dict[str, Union[str, Optional[Dict[str, str]], bool, int]],
+    deriv_dict: Dict[
+        str,
+        Union[
+            str,
+            Tuple[str, ...],
+            List[Set[str]],
+            bool,
+            Optional[Dict[str, Union[float, str, int]]],
+        ],
+    ],
+    misc_settings_dict: Dict[str, Optional[int]],
+) -> NDArray[np.float64]:
+    """Returns the frequency grid to benchmark an injection on given the bounds from frequency_grid_bounds_for_injection.
+
+    If misc_settings_dict["grid_rtol"] is set and the waveform model accepts arbitrary frequencies, then the grid is non_uniform_frequency_grid with that target accuracy, tightened for some waveform models by grid_rtol_for_wf_model. Otherwise, the grid is uniform with spacing df. Either way, the SNR and Fisher inner products integrate over the grid with Simpson's rule for irregular spacing.
+
+    The non-uniform grid only converges power-law proxies of the SNR and Fisher integrands, so the benchmark is less accurate than its target. For 40 BBH injections with lal_bbh (IMRPhenomHM) in the BS2022_SIX networks, the median (90th percentile) relative deviations from a uniform grid with df = 1/32 Hz were, at grid_rtol=1e-2 and so rtol=1e-3: 0.02% (0.2%) in the SNR, 0.2% (1%) in the errors of log(Mc) and eta, 0.2% (3%) in the error of iota, and 0.3% (4%) in the error of log(DL). For comparison, those of a uniform grid with df = 1/8 Hz were 0.02% (0.1%), 0.3% (1%), 0.2% (1%), and 0.2% (2%), and without the tightened rtol the errors deviated by about 1% (5%). The grid can miss features of the waveform of a few injections: one of the 40 had its errors of log(Mc) and eta off by a factor of two in every network. The errors of log(DL) and iota of the injections near their degeneracy differ by tens of percent even between the uniform grids.
+
+    Args:
+        fmin: Minimum frequency [Hz].
+        fmax: Maximum frequency [Hz].
+        df: Frequency spacing [Hz] of the uniform grid.
+        wf_dict: Waveform dictionary of model name and options, also contains the science case string.
+        deriv_dict: Derivative options dictionary.
+        misc_settings_dict: Options for gwbench, e.g. whether to account for Earth's rotation about its axis.
+
+    Returns:
+        NDArray[np.float64]: Frequency grid [Hz].
+    """
+    grid_rtol = misc_settings_dict.get("grid_rtol")
+    if grid_rtol is None or wf_dict["wf_model_name"] not in NON_UNIFORM_GRID_WF_MODELS:
+        return np.arange(fmin, fmax + df, df)
+    return non_uniform_frequency_grid(
+        fmin,
+        fmax,
+        tuple(sorted(deriv_dict["unique_tecs"])),
+        rtol=grid_rtol_for_wf_model(grid_rtol, wf_dict["wf_model_name"]),
+    )[0]
+
+
+def analytic_derivs_used(
+    wf_dict: Dict[str, Union[str, Optional[Dict[str, str]], bool, int]],
+    deriv_dict: Dict[
+        str,
+        Union[
+            str,
+            Tuple[str, ...],
+            List[Set[str]],
+            bool,
+            Optional[Dict[str, Union[float, str, int]]],
+        ],
+    ],
+) -> bool:
+    """Returns whether the detector response derivatives are evaluated analytically instead of from the lambdified sympy functions.
+
+    This is the default for symbolic derivatives of waveform models with analytic derivatives (e.g. tf2 and tf2_tidal), deriv_dict["analytic_derivs"] = False restores the lambdified functions.
+
+    Args:
+        wf_dict: Waveform dictionary of model name and options, also contains the science case string.
+        deriv_dict: Derivative options dictionary.
+
+    Returns:
+        bool: Whether to use the analytic derivatives.
+    """
+    return (
+        not deriv_dict["numerical_over_symbolic_derivs"]
+        and wf_dict["wf_model_name"] in drd.analytic_wf_models
+        and deriv_dict.get("analytic_derivs", True)
+    )
+
+
+def loc_pool_used(
+    wf_dict: Dict[str, Union[str, Optional[Dict[str, str]], bool, int]],
+    deriv_dict: Dict[
+        str,
+        Union[
+            str,
+            Tuple[str, ...],
+            List[Set[str]],
+            bool,
+            Optional[Dict[str, Union[float, str, int]]],
+        ],
+    ],
+) -> bool:
+    """Returns whether the detector responses of each location are evaluated in a pool of workers, i.e. with lambdified (symbolic) or per-location numerical derivatives, and not with analytic or factorised derivatives which evaluate the locations in this process.
+
+    Args:
+        wf_dict: Waveform dictionary of model name and options, also contains the science case string.
+        deriv_dict: Derivative options dictionary.
+    """
+    return not analytic_derivs_used(wf_dict, deriv_dict) and not deriv_dict.get(
+        "factorised_derivs", False
+    )
+
+
+def converted_deriv_variables(
+    deriv_dict: Dict[
+        str,
+        Union[
+            str,
+            Tuple[str, ...],
+            List[Set[str]],
+            bool,
+            Optional[Dict[str, Union[float, str, int]]],
+        ],
+    ],
+) -> List[str]:
+    """Returns the derivative variables after the conversions to cos and log, i.e. the order of the rows and columns of the Fisher and covariance matrices.
+
+    Args:
+        deriv_dict: Derivative options dictionary.
+    """
+    return [
+        (
+            f"cos_{key}"
+            if key in deriv_dict["conv_cos"]
+            else (f"log_{key}" if key in deriv_dict["conv_log"] else key)
+        )
+        for key in deriv_dict["deriv_symbs_string"].split(" ")
+    ]
+
+
+def network_results_row_length(
+    network_spec: List[str],
+    deriv_dict: Dict[
+        str,
+        Union[
+            str,
+            Tuple[str, ...],
+            List[Set[str]],
+            bool,
+            Optional[Dict[str, Union[float, str, int]]],
+        ],
+    ],
+    misc_settings_dict: Dict[str, Optional[int]],
+) -> int:
+    """Returns the length of a network's results for an injection, seven or, with misc_settings_dict["full_results"], a full row as in results_store.results_row_slices.
+
+    Args:
+        network_spec: Network specification, e.g. ['A+_H', 'A+_L', 'V+_V', 'K+_K', 'A+_I'].
+        deriv_dict: Derivative options dictionary.
+        misc_settings_dict: Options for gwbench, e.g. whether to account for Earth's rotation about its axis.
+    """
+    if misc_settings_dict.get("full_results", False):
+        return results_row_length(
+            len(network_spec), len(deriv_dict["deriv_symbs_string"].split(" "))
+        )
+    return len(LEGACY_RESULTS_COLUMNS)
+
+
+def failed_multi_network_results(
+    network_specs: List[List[str]],
+    deriv_dict: Dict[
+        str,
+        Union[
+            str,
+            Tuple[str, ...],
+            List[Set[str]],
+            bool,
+            Optional[Dict[str, Union[float, str, int]]],
+        ],
+    ],
+    misc_settings_dict: Dict[str, Optional[int]],
+) -> Dict[str, Tuple[float, ...]]:
+    """Returns the results of an injection that failed, a tuple of np.nan's for each network.
+
+    Args:
+        network_specs: Networks to pass to gwbench's multi-network pipeline.
+        deriv_dict: Derivative options dictionary.
+        misc_settings_dict: Options for gwbench, e.g. whether to account for Earth's rotation about its axis.
+    """
+    return dict(
+        (
+            repr(network_spec),
+            (np.nan,)
+            * network_results_row_length(network_spec, deriv_dict, misc_settings_dict),
+        )
+        for network_spec in network_specs
+    )
+
+
+def full_results_extension(
+    cond_num: float,
+    det_snrs: List[float],
+    cov: NDArray[np.float64],
+    fisher: NDArray[np.float64],
+) -> Tuple[float, ...]:
+    """Returns the columns of a full row of results after the seven legacy columns, see results_store.results_row_slices.
+
+    Args:
+        cond_num: Condition number of the network's Fisher matrix.
+        det_snrs: SNR of each detector in the network.
+        cov: Covariance matrix of the network.
+        fisher: Fisher matrix of the network.
+    """
+    return (
+        cond_num,
+        *det_snrs,
+        *pack_upper_triangle(cov),
+        *pack_upper_triangle(fisher),
+    )
+
+
+def detector_fishers_and_snr_sqs(
+    network_specs: List[List[str]],
+    unique_loc_net: network.Network,
+    unique_tec_net: network.Network,
+) -> Tuple[Dict[str, NDArray[np.float64]], Dict[str, float], List[str]]:
+    """Returns the Fisher matrix and SNR squared of each unique detector in the networks for a single injection.
+
+    Detectors such as CE2-40-CBO_C appear in several networks of a set, so each (tec, loc) detector is evaluated once and the networks' results are sums over these.
+
+    Args:
+        network_specs: Networks to pass to gwbench's multi-network pipeline.
+        unique_loc_net: Network of the unique locations with the detector responses and their derivatives, e.g. from network.unique_locs_det_responses.
+        unique_tec_net: Network of the unique technologies with the PSDs, e.g. from network.unique_tecs.
+
+    Returns:
+        Tuple[Dict[str, NDArray[np.float64]], Dict[str, float], List[str]]: Fisher matrices and SNRs squared keyed by det_key (e.g. "CE2-40-CBO_C"), and the derivative variables that index the Fisher matrices.
+    """
+    unique_det_keys = list(
+        dict.fromkeys(
+            det_key for network_spec in network_specs for det_key in network_spec
+        )
+    )
+    # a network of all the unique detectors, the same as each network in the set but without duplicates
+    det_net = network.Network(unique_det_keys)
+    det_net.get_det_responses_psds_from_locs_tecs(unique_loc_net, unique_tec_net)
+    det_fishers, det_snr_sqs = dict(), dict()
+    for det in det_net.detectors:
+        det_snr_sqs[det.det_key] = det.calc_snrs(only_net=True, df=None)
+        det_fishers[det.det_key] = det.calc_fisher_cov_matrices(
+            only_net=True, df=None, cond_sup=None
+        )
+    return det_fishers, det_snr_sqs, det_net.deriv_variables
 
 
 def multi_network_results_for_injection(
@@ -72,10 +468,12 @@ def multi_network_results_for_injection(
     ],
     misc_settings_dict: Dict[str, Optional[int]],
     debug: bool = False,
+    loc_pool: Optional[Pool] = None,
 ) -> Dict[str, Tuple[float, ...]]:
     """Returns the benchmark as a dict of tuples for a single injection using the inj and base_params and the settings dicts through the networks in network_specs.
 
     If a single network fails an injection, then the unified results will save it as a np.nan in all networks so that the universe of injections is the same between each network. TODO: check that this doesn't bias the results away from loud sources that we care about.
+    With deriv_dict["factorised_derivs"], the polarizations are differentiated once per injection (numerically or with the lambdified functions) and combined with the analytic derivatives of each location's antenna patterns by the product rule, instead of differentiating the whole detector response once per location.
 
     Args:
         network_specs: Networks to pass to gwbench's multi-network pipeline.
@@ -85,65 +483,27 @@ def multi_network_results_for_injection(
         deriv_dict: Derivative options dictionary.
         misc_settings_dict: Options for gwbench, e.g. whether to account for Earth's rotation about its axis.
         debug: Whether to debug.
+        loc_pool: Long-lived pool to evaluate the detector responses of the unique locations in parallel, e.g. from network.loc_pool. Otherwise, a pool of misc_settings_dict["num_loc_cores"] workers is created for this injection if given or the locations are evaluated in series.
 
     Returns:
-        Dict[str, Tuple[float]]: Keys are repr(network_spec). Each value is (redshift, SNR, logMc err, logDL err, eta err, iota err, 90%-credible sky-area in sqr degrees) or a tuple of seven np.nan's if the injection failed in any network.
+        Dict[str, Tuple[float]]: Keys are repr(network_spec). Each value is (redshift, SNR, logMc err, logDL err, eta err, iota err, 90%-credible sky-area in sqr degrees), followed by the condition number, detector SNRs, and packed covariance and Fisher matrices if misc_settings_dict["full_results"] (see results_store.results_row_slices), or a tuple of np.nan's of the same length if the injection failed in any network.
     """
-    output_if_injection_fails = dict(
-        (
-            (repr(network_spec), tuple(np.nan for _ in range(7)))
-            for network_spec in network_specs
-        )
+    output_if_injection_fails = failed_multi_network_results(
+        network_specs, deriv_dict, misc_settings_dict
     )
-    varied_keys = [
-        "Mc",
-        "eta",
-        "chi1x",
-        "chi1y",
-        "chi1z",
-        "chi2x",
-        "chi2y",
-        "chi2z",
-        "DL",
-        "iota",
-        "ra",
-        "dec",
-        "psi",
-        "z",
-    ]
-    varied_params = dict(zip(varied_keys, inj))
+    varied_params = dict(zip(VARIED_KEYS, inj))
     z = varied_params.pop("z")
     inj_params = dict(**base_params, **varied_params)
 
-    # subtlety, if V+ (or aLIGO) is present in any network, then f is truncated for V+ for all networks (since f is shared below). TODO: figure out how common this is
-    aLIGO_or_Vplus_used = ("aLIGO" in deriv_dict["unique_tecs"]) or (
-        "V+" in deriv_dict["unique_tecs"]
+    grid_bounds = frequency_grid_bounds_for_injection(
+        inj, wf_dict, deriv_dict, misc_settings_dict, debug=debug
     )
-    if not filter_bool_for_injection(
-        inj,
-        misc_settings_dict["redshifted"],
-        wf_dict["coeff_fisco"],
-        wf_dict["science_case"],
-        aLIGO_or_Vplus_used=aLIGO_or_Vplus_used,
-        debug=debug,
-    ):
+    if grid_bounds is None:
         return output_if_injection_fails
-    fmin, fmax = 5.0, wf_dict["coeff_fisco"] * fisco_obs_from_Mc_eta(
-        inj_params["Mc"],
-        inj_params["eta"],
-        redshifted=misc_settings_dict["redshifted"],
-        z=z,
+    fmin, fmax, df = grid_bounds
+    f = frequency_grid_for_injection(
+        fmin, fmax, df, wf_dict, deriv_dict, misc_settings_dict
     )
-    if aLIGO_or_Vplus_used:
-        fmax_bounds = (11, 1024)
-    else:
-        fmax_bounds = (6, 1024)
-    fmax = float(max(min(fmax, fmax_bounds[1]), fmax_bounds[0]))
-    # df linearly transitions from 1/16 Hz (fine from B&S2022) to 10 Hz (coarse to save computation time)
-    df = ((fmax - fmax_bounds[0]) / (fmax_bounds[1] - fmax_bounds[0])) * 10 + (
-        (fmax_bounds[1] - fmax) / (fmax_bounds[1] - fmax_bounds[0])
-    ) * 1 / 16
-    f = np.arange(fmin, fmax + df, df)
 
     # passing parameters to gwbench, hide stdout (i.e. prints) if not debugging, stderr should still show up
     if not debug:
@@ -163,10 +523,16 @@ def multi_network_results_for_injection(
             deriv_dict["conv_cos"],
             deriv_dict["conv_log"],
             misc_settings_dict["use_rot"],
-            misc_settings_dict["num_cores"],
+            # not misc_settings_dict["num_cores"] which is used for the injections, workers of a pool can't have children
+            misc_settings_dict.get("num_loc_cores"),
         )
         if not deriv_dict["numerical_over_symbolic_derivs"]:
-            unique_loc_net = network.unique_locs_det_responses(*loc_net_args)
+            unique_loc_net = network.unique_locs_det_responses(
+                *loc_net_args,
+                pool=loc_pool,
+                ana_derivs=analytic_derivs_used(wf_dict, deriv_dict),
+                fact_derivs=deriv_dict.get("factorised_derivs", False),
+            )
         else:
             # update eta if too close to its maximum value for current step size, https://en.wikipedia.org/wiki/Chirp_mass#Definition_from_component_masses
             eta_max = 0.25
@@ -180,55 +546,559 @@ def multi_network_results_for_injection(
                 deriv_dict["numerical_deriv_settings"]["method"],
                 deriv_dict["numerical_deriv_settings"]["order"],
                 deriv_dict["numerical_deriv_settings"]["n"],
+                pool=loc_pool,
+                fact_derivs=deriv_dict.get("factorised_derivs", False),
             )
         # get the unique PSDs for the various detector technologies
         unique_tec_net = network.unique_tecs(network_specs, f)
 
-        # perform the analysis of each network from the unique components
+        # Fisher matrices and SNRs squared of each unique detector, shared by all the networks that contain it
+        det_fishers, det_snr_sqs, deriv_variables = detector_fishers_and_snr_sqs(
+            network_specs, unique_loc_net, unique_tec_net
+        )
+        inj_params = unique_loc_net.inj_params
+
+        # perform the analysis of each network from the unique components: a sum over its detectors and one inversion
         multi_network_results_dict = dict()
-        for i, network_spec in enumerate(network_specs):
-            # if net only exists here, then the subclass is pointless. re-factor to justify using subclass
-            net = network.Network(network_spec)
-            # get the correct network from the unique components calculated above. this avoids the need to .set_net_vars, .set_wf_vars, .setup_ant_pat_lpf_psds, .calc_det_responses, .calc_det_responses_derivs_num/sym,
-            net.get_det_responses_psds_from_locs_tecs(unique_loc_net, unique_tec_net)
-            # calculate the network SNRs
-            net.calc_snrs(only_net=misc_settings_dict["only_net"])
-            # calculate the Fisher and covariance matrices, then error estimates
-            net.calc_errors(only_net=misc_settings_dict["only_net"])
-            # calculate the 90%-credible sky area (in [deg]^2)
-            net.calc_sky_area_90(only_net=misc_settings_dict["only_net"])
+        for network_spec in network_specs:
+            fisher = sum(det_fishers[det_key] for det_key in network_spec)
+            snr = np.sqrt(sum(det_snr_sqs[det_key] for det_key in network_spec))
+            # calculate the covariance matrix, then error estimates, if the Fisher matrix is well-conditioned
+            wc_fisher, cond_num = fat.check_well_conditioned(fisher, 1e15)
 
             # TODO: if using gwbench 0.7, still introduce a limit on net.cond_num based on machine precision errors that mpmath is blind to
             # if the FIM is zero, then the condition number is NaN and matrix is ill-conditioned (according to gwbench). TODO: try catching this by converting warnings to errors following <https://stackoverflow.com/questions/5644836/in-python-how-does-one-catch-warnings-as-if-they-were-exceptions#30368735> --> 54 and 154 converged in a second run
-            if not net.wc_fisher:
+            if not wc_fisher:
                 # unified injection rejection so that cosmological resampling can be uniform across networks, this now means that the number of injections is equal to that of the weakest network in the set but leads to a better comparison
                 if debug:
                     print(
-                        f"Rejected injection for {network_spec} and, therefore, all networks in the multi-network because of ill-conditioned FIM ({net.fisher}) with condition number ({net.cond_num}) greater than 1e15"
+                        f"Rejected injection for {network_spec} and, therefore, all networks in the multi-network because of ill-conditioned FIM ({fisher}) with condition number ({cond_num}) greater than 1e15"
                     )
-                return dict(
-                    (repr(network_spec_2), tuple(np.nan for _ in range(7)))
-                    for network_spec_2 in network_specs
-                )
-            #                 multi_network_results_dict[repr(network_spec)] = tuple(
-            #                     np.nan for _ in range(7)
-            #                 )
+                return output_if_injection_fails
             else:
+                cov = fat.calc_cov_from_fisher(fisher, wc_fisher)
+                errs = fat.get_errs_from_cov(cov, deriv_variables)
+                # calculate the 90%-credible sky area (in [deg]^2)
+                dec_str = "cos_dec" if "cos_dec" in deriv_variables else "dec"
+                sky_area_90 = edh.sky_area_90(
+                    errs["ra"],
+                    errs[dec_str],
+                    cov[deriv_variables.index("ra"), deriv_variables.index(dec_str)],
+                    inj_params["dec"],
+                    dec_str == "cos_dec",
+                )
                 # convert sigma_cos(iota) into sigma_iota
-                abs_err_iota = abs(net.errs["cos_iota"] / np.sin(inj_params["iota"]))
+                abs_err_iota = abs(errs["cos_iota"] / np.sin(inj_params["iota"]))
                 multi_network_results_dict[repr(network_spec)] = (
                     z,
-                    net.snr,
-                    net.errs["log_Mc"],
-                    net.errs["log_DL"],
-                    net.errs["eta"],
+                    snr,
+                    errs["log_Mc"],
+                    errs["log_DL"],
+                    errs["eta"],
                     abs_err_iota,
-                    net.errs["sky_area_90"],
+                    sky_area_90,
                 )
+                if misc_settings_dict.get("full_results", False):
+                    multi_network_results_dict[
+                        repr(network_spec)
+                    ] += full_results_extension(
+                        cond_num,
+                        [np.sqrt(det_snr_sqs[det_key]) for det_key in network_spec],
+                        cov,
+                        fisher,
+                    )
 
     return multi_network_results_dict
 
 
+def stacked_multi_network_results_for_grid(
+    network_specs: List[List[str]],
+    injs: NDArray[NDArray[np.float64]],
+    f: NDArray[np.float64],
+    base_params: Dict[str, Union[int, float]],
+    wf_dict: Dict[str, Union[str, Optional[Dict[str, str]], bool, int]],
+    deriv_dict: Dict[
+        str,
+        Union[
+            str,
+            Tuple[str, ...],
+            List[Set[str]],
+            bool,
+            Optional[Dict[str, Union[float, str, int]]],
+        ],
+    ],
+    misc_settings_dict: Dict[str, Optional[int]],
+    cond_sup: float = 1e15,
+    debug: bool = False,
+) -> List[Dict[str, Tuple[float, ...]]]:
+    """Returns the benchmark for injections that share a frequency grid using stacked (injection, parameter, frequency) arrays.
+
+    The analytic or lambdified detector response derivatives broadcast over the injections, so each location is evaluated once for the whole stack. The Fisher matrices and SNRs of each unique detector are then reduced to stacks of (injection, parameter, parameter) and (injection,) arrays before the locations' derivatives are discarded, which keeps the memory to one location at a time. Requires analytic or symbolic derivatives.
+
+    Args:
+        network_specs: Networks to pass to gwbench's multi-network pipeline.
+        injs: Injection parameters for each injection, all with the frequency grid f.
+        f: Frequency grid shared by the injections.
+        base_params: Common parameters among injections, e.g. time of coalesence.
+        wf_dict: Waveform dictionary of model name and options, also contains the science case string.
+        deriv_dict: Derivative options dictionary.
+        misc_settings_dict: Options for gwbench, e.g. whether to account for Earth's rotation about its axis.
+        cond_sup: Maximum condition number of a well-conditioned Fisher matrix, as in gwbench.
+        debug: Whether to debug.
+
+    Returns:
+        List[Dict[str, Tuple[float]]]: Results of multi_network_results_for_injection for each injection in injs.
+    """
+    num_injs = len(injs)
+    # column vectors broadcast against the frequency array in the waveform and lambdified functions
+    inj_params = dict(
+        **base_params,
+        **dict(
+            (key, injs[:, i][:, np.newaxis])
+            for i, key in enumerate(VARIED_KEYS)
+            if key != "z"
+        ),
+    )
+    use_rot = misc_settings_dict["use_rot"]
+    wf = wfc.Waveform(wf_dict["wf_model_name"], wf_dict["wf_other_var_dic"])
+    ana_derivs = analytic_derivs_used(wf_dict, deriv_dict)
+    fact_derivs = ana_derivs or deriv_dict.get("factorised_derivs", False)
+    if fact_derivs:
+        # polarizations and their derivatives shared by all the locations
+        if ana_derivs:
+            hfpc_derivs = drd.calc_wf_polarizations_derivs_ana(
+                wf, deriv_dict["deriv_symbs_string"], f, inj_params
+            )
+        else:
+            hfpc_derivs = drd.calc_wf_polarizations_derivs_sym(
+                wf, deriv_dict["deriv_symbs_string"], f, inj_params
+            )
+        hfp, hfc = hfpc_derivs[:2]
+    else:
+        hfp, hfc = wf.eval_np_func(f, bfs.get_sub_dict(inj_params, wf.wf_symbs_string))
+    hfp, hfc = (np.broadcast_to(hfpc, (num_injs, len(f))) for hfpc in (hfp, hfc))
+
+    # get the unique PSDs for the various detector technologies
+    tec_net = network.unique_tecs(network_specs, f)
+    unique_det_keys = list(
+        dict.fromkeys(
+            det_key for network_spec in network_specs for det_key in network_spec
+        )
+    )
+
+    # unique detectors' Fisher matrices and SNRs squared, calculated one location at a time
+    det_fisher, det_snr_sq = dict(), dict()
+    deriv_variables = deriv_dict["deriv_symbs_string"].split(" ")
+    for loc in dict.fromkeys(det_key.split("_")[1] for det_key in unique_det_keys):
+        if fact_derivs:
+            del_hf = drd.calc_det_responses_derivs_fact(
+                loc,
+                deriv_dict["deriv_symbs_string"],
+                f,
+                inj_params,
+                hfpc_derivs,
+                use_rot,
+                "hf",
+            )
+        else:
+            del_hf_expr = drd.load_det_responses_derivs_sym(
+                loc, wf.wf_model_name, deriv_dict["deriv_symbs_string"]
+            )
+            del_hf = drd.eval_det_responses_derivs_sym(del_hf_expr, f, inj_params)
+        del_hf = dict(
+            (deriv, np.broadcast_to(del_hf[deriv], (num_injs, len(f))))
+            for deriv in del_hf
+        )
+        del_hf, c_quants = dc.get_conv_del_eval_dic(
+            del_hf,
+            inj_params,
+            deriv_dict["conv_cos"],
+            deriv_dict["conv_log"],
+            deriv_dict["deriv_symbs_string"],
+        )
+        _, deriv_variables = dc.get_conv_inj_params_deriv_variables(
+            c_quants, dict(inj_params), deriv_dict["deriv_symbs_string"].split(" ")
+        )
+        # (injection, parameter, frequency)
+        del_hf_arr = np.stack(list(del_hf.values()), axis=1)
+        del del_hf
+
+        # antenna patterns for the stack of sky positions, shape (injection, frequency)
+        Fp, Fc, Flp = ant_pat_np.antenna_pattern_and_loc_phase_fac(
+            f,
+            inj_params["Mc"] if use_rot else None,
+            inj_params["tc"] if use_rot else None,
+            inj_params["ra"],
+            inj_params["dec"],
+            inj_params["psi"],
+            inj_params["gmst0"],
+            loc,
+            use_rot,
+        )
+        hf = Flp * (hfp * Fp + hfc * Fc)
+
+        for det_key in unique_det_keys:
+            tec, det_loc = det_key.split("_")
+            if det_loc != loc:
+                continue
+            tec_det = tec_net.get_detector(tec + "_loc")
+            ids_net_f = np.logical_and(f >= tec_det.f[0], f <= tec_det.f[-1])
+            # quadrature weights and 1/PSD shared by the SNR and Fisher inner products
+            weights = snr_mod.inner_prod_weights(tec_det.psd, tec_det.f)
+            det_snr_sq[det_key] = snr_mod.snr_sq_weighted(hf[:, ids_net_f], weights)
+            det_fisher[det_key] = fat.calc_fisher_matrix_weighted(
+                del_hf_arr[:, :, ids_net_f], weights
+            )
+
+    if "cos_dec" in deriv_variables:
+        dec_str = "cos_dec"
+    else:
+        dec_str = "dec"
+    ra_id, dec_id = deriv_variables.index("ra"), deriv_variables.index(dec_str)
+    err_ids = [
+        deriv_variables.index(key) for key in ("log_Mc", "log_DL", "eta", "cos_iota")
+    ]
+    z = injs[:, -1]
+    iota, dec = inj_params["iota"][:, 0], inj_params["dec"][:, 0]
+
+    # unified injection rejection: an injection fails in every network if its FIM is ill-conditioned in any network
+    injection_succeeds = np.ones(num_injs, dtype=bool)
+    network_results = dict()
+    for network_spec in network_specs:
+        fisher = sum(det_fisher[det_key] for det_key in network_spec)
+        snr = np.sqrt(sum(det_snr_sq[det_key] for det_key in network_spec))
+        cond_num = fat.calc_cond_numbers_stacked(fisher)
+        wc_fisher = cond_num < cond_sup
+        if debug and not np.all(wc_fisher):
+            print(
+                f"Rejected injections {np.flatnonzero(~wc_fisher)} for {network_spec} and, therefore, all networks in the multi-network because of ill-conditioned FIMs with condition number greater than {cond_sup}"
+            )
+        injection_succeeds &= wc_fisher
+        cov = np.full_like(fisher, np.nan)
+        cov[wc_fisher] = np.linalg.inv(fisher[wc_fisher])
+        errs = np.sqrt(np.abs(np.diagonal(cov, axis1=1, axis2=2)))
+        network_results[repr(network_spec)] = (snr, errs, cov, fisher, cond_num)
+
+    multi_network_results_dict_list = []
+    for i in range(num_injs):
+        if not injection_succeeds[i]:
+            multi_network_results_dict_list.append(
+                failed_multi_network_results(
+                    network_specs, deriv_dict, misc_settings_dict
+                )
+            )
+            continue
+        multi_network_results_dict = dict()
+        for network_spec in network_specs:
+            snr, errs, cov, fisher, cond_num = network_results[repr(network_spec)]
+            err_logMc, err_logDL, err_eta, err_cos_iota = errs[i, err_ids]
+            multi_network_results_dict[repr(network_spec)] = (
+                z[i],
+                snr[i],
+                err_logMc,
+                err_logDL,
+                err_eta,
+                abs(err_cos_iota / np.sin(iota[i])),
+                edh.sky_area_90(
+                    errs[i, ra_id],
+                    errs[i, dec_id],
+                    cov[i, ra_id, dec_id],
+                    dec[i],
+                    dec_str == "cos_dec",
+                ),
+            )
+            if misc_settings_dict.get("full_results", False):
+                multi_network_results_dict[
+                    repr(network_spec)
+                ] += full_results_extension(
+                    cond_num[i],
+                    [np.sqrt(det_snr_sq[det_key][i]) for det_key in network_spec],
+                    cov[i],
+                    fisher[i],
+                )
+        multi_network_results_dict_list.append(multi_network_results_dict)
+    return multi_network_results_dict_list
+
+
+def multi_network_results_for_injection_batch(
+    network_specs: List[List[str]],
+    inj_batch: NDArray[NDArray[np.float64]],
+    base_params: Dict[str, Union[int, float]],
+    wf_dict: Dict[str, Union[str, Optional[Dict[str, str]], bool, int]],
+    deriv_dict: Dict[
+        str,
+        Union[
+            str,
+            Tuple[str, ...],
+            List[Set[str]],
+            bool,
+            Optional[Dict[str, Union[float, str, int]]],
+        ],
+    ],
+    misc_settings_dict: Dict[str, Optional[int]],
+    max_batch_size: int = 16,
+    debug: bool = False,
+    loc_pool: Optional[Pool] = None,
+) -> List[Dict[str, Tuple[float, ...]]]:
+    """Returns the benchmark for a block of injections as a list of the dicts that multi_network_results_for_injection returns.
+
+    Injections are grouped by their frequency grid (fmin, fmax, df), e.g. BNS injections whose fmax is truncated to 1024 Hz, and each group is benchmarked in stacks of up to max_batch_size injections by stacked_multi_network_results_for_grid. This replaces the per-injection Python overhead (constructing networks and detectors, loading the lambdified functions) with NumPy operations over the stack.
+    Only symbolic derivatives broadcast over injections, numerical derivatives (e.g. lal_bbh with lalsimulation) fall back to multi_network_results_for_injection for each injection.
+
+    Args:
+        network_specs: Networks to pass to gwbench's multi-network pipeline.
+        inj_batch: Injection parameters for each injection, e.g. the rows of a task file.
+        base_params: Common parameters among injections, e.g. time of coalesence.
+        wf_dict: Waveform dictionary of model name and options, also contains the science case string.
+        deriv_dict: Derivative options dictionary.
+        misc_settings_dict: Options for gwbench, e.g. whether to account for Earth's rotation about its axis.
+        max_batch_size: Maximum number of injections to stack, the memory of the stacked derivatives scales with it.
+        debug: Whether to debug.
+        loc_pool: Long-lived pool for the locations of the injections that fall back to multi_network_results_for_injection.
+
+    Returns:
+        List[Dict[str, Tuple[float]]]: Results of multi_network_results_for_injection for each injection in inj_batch in order.
+    """
+    if deriv_dict["numerical_over_symbolic_derivs"]:
+        return [
+            multi_network_results_for_injection(
+                network_specs,
+                inj,
+                base_params,
+                wf_dict,
+                deriv_dict,
+                misc_settings_dict,
+                debug=debug,
+                loc_pool=loc_pool,
+            )
+            for inj in inj_batch
+        ]
+
+    multi_network_results_dict_list = [
+        failed_multi_network_results(network_specs, deriv_dict, misc_settings_dict)
+        for _ in range(len(inj_batch))
+    ]
+    # group the surviving injections by frequency grid, dict(grid_key=[index1, index2, ...], ...)
+    plan = frequency_grid_plan_for_injections(
+        inj_batch, wf_dict, deriv_dict, misc_settings_dict
+    )
+    if debug and not np.all(plan["valid"]):
+        print(f"Rejected injections {np.flatnonzero(~plan['valid'])}")
+    grid_groups: Dict[int, List[int]] = defaultdict(list)
+    for i in np.flatnonzero(plan["valid"]):
+        grid_groups[plan["grid_key"][i]].append(i)
+
+    if not debug:
+        entry_class = HiddenPrints
+    else:
+        entry_class = PassEnterExit
+    with entry_class():
+        for inds in grid_groups.values():
+            f = frequency_grid_for_injection(
+                FMIN,
+                plan["fmax"][inds[0]],
+                plan["df"][inds[0]],
+                wf_dict,
+                deriv_dict,
+                misc_settings_dict,
+            )
+            for j in range(0, len(inds), max_batch_size):
+                stack_inds = inds[j : j + max_batch_size]
+                for i, multi_network_results_dict in zip(
+                    stack_inds,
+                    stacked_multi_network_results_for_grid(
+                        network_specs,
+                        inj_batch[stack_inds],
+                        f,
+                        base_params,
+                        wf_dict,
+                        deriv_dict,
+                        misc_settings_dict,
+                        debug=debug,
+                    ),
+                ):
+                    multi_network_results_dict_list[i] = multi_network_results_dict
+    return multi_network_results_dict_list
+
+
+def multi_network_results_for_injections(
+    network_specs: List[List[str]],
+    inj_data: NDArray[NDArray[np.float64]],
+    base_params: Dict[str, Union[int, float]],
+    wf_dict: Dict[str, Union[str, Optional[Dict[str, str]], bool, int]],
+    deriv_dict: Dict[
+        str,
+        Union[
+            str,
+            Tuple[str, ...],
+            List[Set[str]],
+            bool,
+            Optional[Dict[str, Union[float, str, int]]],
+        ],
+    ],
+    misc_settings_dict: Dict[str, Optional[int]],
+    debug: bool = False,
+    loc_pool: Optional[Pool] = None,
+) -> List[Dict[str, Tuple[float, ...]]]:
+    """Returns the benchmark for each injection in inj_data, in parallel if misc_settings_dict["num_cores"] is not None.
+
+    Parallelism is either over injections (misc_settings_dict["num_cores"]) or over the locations of each injection (loc_pool), never both, since the workers of a pool can't have children and nesting them would oversubscribe the cores.
+
+    Args:
+        network_specs: Networks to pass to gwbench's multi-network pipeline.
+        inj_data: Injection parameters for each injection.
+        base_params: Common parameters among injections, e.g. time of coalesence.
+        wf_dict: Waveform dictionary of model name and options, also contains the science case string.
+        deriv_dict: Derivative options dictionary.
+        misc_settings_dict: Options for gwbench, e.g. whether to account for Earth's rotation about its axis and how many injections to stack with injs_per_batch.
+        debug: Whether to debug.
+        loc_pool: Long-lived pool to evaluate the locations of each injection in parallel, the injections are then processed in series.
+
+    Raises:
+        ValueError: If both loc_pool and misc_settings_dict["num_cores"] are given.
+
+    Returns:
+        List[Dict[str, Tuple[float]]]: Results of multi_network_results_for_injection for each injection in inj_data in order.
+    """
+    if loc_pool is not None and misc_settings_dict["num_cores"] is not None:
+        raise ValueError(
+            "Parallelise either over injections (num_cores) or over locations (loc_pool), not both."
+        )
+    injs_per_batch = misc_settings_dict.get("injs_per_batch")
+    if injs_per_batch is None:
+        return parallel_map(
+            lambda inj: multi_network_results_for_injection(
+                network_specs,
+                inj,
+                base_params,
+                wf_dict,
+                deriv_dict,
+                misc_settings_dict,
+                debug=debug,
+                loc_pool=loc_pool,
+            ),
+            inj_data,
+            parallel=misc_settings_dict["num_cores"] is not None,
+            num_cpus=misc_settings_dict["num_cores"],
+        )
+    else:
+        # one contiguous block of injections per core, each block is grouped by frequency grid and stacked
+        num_blocks = (
+            1
+            if misc_settings_dict["num_cores"] is None
+            else min(misc_settings_dict["num_cores"], len(inj_data))
+        )
+        return flatten_list(
+            parallel_map(
+                lambda inj_block: multi_network_results_for_injection_batch(
+                    network_specs,
+                    inj_block,
+                    base_params,
+                    wf_dict,
+                    deriv_dict,
+                    misc_settings_dict,
+                    max_batch_size=injs_per_batch,
+                    debug=debug,
+                    loc_pool=loc_pool,
+                ),
+                np.array_split(inj_data, max(num_blocks, 1)),
+                parallel=misc_settings_dict["num_cores"] is not None,
+                num_cpus=misc_settings_dict["num_cores"],
+            )
+        )
+
+
+def save_npy_atomically(file_name: str, data: NDArray) -> None:
+    """Saves data as a .npy file by writing to a temporary file and renaming it, so that the file is never partially written.
+
+    Args:
+        file_name: Output .npy filename with path.
+        data: Array to save.
+    """
+    tmp_file_name = f"{file_name}.{os.getpid()}.tmp"
+    with open(tmp_file_name, "wb") as file:
+        np.save(file, data)
+    os.replace(tmp_file_name, file_name)
+
+
+def partial_results_file_name(results_file_name_with_path: str) -> str:
+    """Returns the filename (with path) of the checkpoint file for a network's results file.
+
+    The "partial_" prefix keeps checkpoints out of the merging pattern "results_NET_*_TASK_*.npy".
+
+    Args:
+        results_file_name_with_path: Results .npy filename with path.
+    """
+    path, file = os.path.split(results_file_name_with_path)
+    return os.path.join(path, "partial_" + file)
+
+
+def unprocessed_record_file_name(results_file_name: str, data_path: str) -> str:
+    """Returns the filename (with path) of the record of unprocessed injections for a task.
+
+    Args:
+        results_file_name: Output .npy filename template for the task, e.g. f"SLURM_TASK_{task_id}".
+        data_path: Path to the output processed data files for the task.
+    """
+    return os.path.join(data_path, f"unprocessed_{results_file_name}.json")
+
+
+def final_results_exist(
+    results_file_name_with_path: str, misc_settings_dict: Dict[str, Optional[int]]
+) -> bool:
+    """Returns whether a network's results have been saved, i.e. its results file and, if misc_settings_dict["full_results"], its results store.
+
+    Args:
+        results_file_name_with_path: Results .npy filename with path.
+        misc_settings_dict: Options for gwbench, see multi_network_results_for_injections_file.
+    """
+    return os.path.isfile(results_file_name_with_path) and (
+        not misc_settings_dict.get("full_results", False)
+        or os.path.isdir(results_store_path(results_file_name_with_path))
+    )
+
+
+def remove_checkpoints(
+    partial_file_name_list: List[str], results_file_name: str, data_path: str
+) -> None:
+    """Removes the checkpoints of a task and any record of its unprocessed injections from a previous run.
+
+    Args:
+        partial_file_name_list: Checkpoint filenames with path, see partial_results_file_name.
+        results_file_name: Output .npy filename template for the task, e.g. f"SLURM_TASK_{task_id}".
+        data_path: Path to the output processed data files for the task.
+    """
+    for file_name in partial_file_name_list + [
+        unprocessed_record_file_name(results_file_name, data_path)
+    ]:
+        if os.path.isfile(file_name):
+            os.remove(file_name)
+
+
+def full_results_columns(
+    rows: NDArray[NDArray[np.float64]],
+    inj_data: NDArray[NDArray[np.float64]],
+    inj_index: NDArray[np.int_],
+    num_dets: int,
+    num_params: int,
+) -> Dict[str, NDArray]:
+    """Returns the columns of a results store from the full rows of results of a network.
+
+    Args:
+        rows: Full rows of results of the injections, see results_store.results_row_slices.
+        inj_data: Injection parameters of the rows.
+        inj_index: Row of each injection in its injections file.
+        num_dets: Number of detectors in the network.
+        num_params: Number of derivative variables.
+    """
+    columns = dict(inj_index=np.asarray(inj_index, dtype=np.int64), inj_params=inj_data)
+    for key, column_slice in results_row_slices(num_dets, num_params).items():
+        columns[key] = rows[:, column_slice]
+        if key in LEGACY_RESULTS_COLUMNS + ("cond_num",):
+            columns[key] = columns[key][:, 0]
+    return columns
+
+
 def multi_network_results_for_injections_file(
     results_file_name: str,
     network_specs: List[List[str]],
@@ -250,11 +1120,21 @@ def multi_network_results_for_injections_file(
     misc_settings_dict: Dict[str, Optional[int]],
     data_path: str = "./data_processed_injections/task_files/",
     debug: int = False,
-) -> None:
+    checkpoint_every: Optional[int] = None,
+    wall_time_budget: Optional[float] = None,
+    inj_range: Optional[Tuple[int, int]] = None,
+    stop_event: Optional[threading.Event] = None,
+) -> bool:
     """Runs the injections in the given file through the given set of networks and saves them as a .npy file.
 
     Benchmarks the first process_injs_per_task number of injections from injections_file + base_params for each of the networks in network_specs for the science_case and other settings in the three dict.'s provided, saves the results as a .npy file in results_file_name at data_path in the form (number of surviving injections, 7) with the columns of (redshift, SNR, logMc err, logDL err, eta err, iota err, 90%-credible sky-area in sqr degrees).
 
+    If misc_settings_dict["full_results"], then the injection index and parameters, the detector SNRs, the condition number, and the packed covariance and Fisher matrices are also saved in a results store (see results_store.py) next to each network's results file.
+
+    Networks whose results were already saved, e.g. by a run that was pre-empted while saving the results of each network, are skipped and the rest are resumed, so a task can always be rerun to completion.
+
+    If checkpoint_every is given, then the results (including failed injections as rows of np.nan) are appended to a "partial_" file for each network every checkpoint_every injections. If these exist, e.g. from a task that timed out or was pre-empted, then processing resumes after the last completed injection. If wall_time_budget is given and the next checkpoint is not expected to finish within it, then the task stops cleanly, keeps the checkpoints, and records the unprocessed range of injection indices in a .json file next to the results to requeue. If stop_event is set, e.g. when a work queue worker loses the lease of its chunk to another worker (see work_queue.py), then the task stops before it saves anything else and leaves the checkpoints to whoever resumes it.
+
     Args:
         results_file_name: Output .npy filename template for each of the network results. Of the form f"SLURM_TASK_{task_id}" if to be generated automatically later. TODO: check whether this works without the task_id format.
         network_specs: Set of networks to analyse.
@@ -267,17 +1147,24 @@ def multi_network_results_for_injections_file(
         misc_settings_dict: Options for gwbench, e.g. whether to account for Earth's rotation about its axis.
         data_path: Path to the output processed data file for the task.
         debug: Whether to debug.
+        checkpoint_every: Number of injections between checkpoints, only checkpoints once all are processed if None.
+        wall_time_budget: Seconds since the call after which no new checkpoint is started, e.g. a margin below Slurm's time limit. No limit if None.
+        inj_range: Range (start, stop) of the rows of injections_file to take the injections from, e.g. a chunk claimed from a work queue (see work_queue.py). All rows if None.
+        stop_event: Event checked before and after each checkpoint that stops the task without saving once set. Never stops if None.
 
-    Raises:
-        Exception: If any of the target results files already exist.
+    Returns:
+        bool: Whether all injections were processed and the results files saved.
     """
-    inj_data: NDArray[NDArray[np.float64]] = np.load(injections_file)
+    start_time = time.monotonic()
+    # memory-mapped to only read the rows in inj_range of a large injections file
+    inj_data: NDArray[NDArray[np.float64]] = np.load(injections_file, mmap_mode="r")
+    if inj_range is not None:
+        inj_data = inj_data[inj_range[0] : inj_range[1]]
     if process_injs_per_task is None:
         process_injs_per_task = len(inj_data)
     # only process the first process_injs_per_task of inj_data
-    process_inj_data = inj_data[:process_injs_per_task]
+    process_inj_data = np.array(inj_data[:process_injs_per_task])
 
-    # check if results files already exist
     # can't pass net_copy because of memory constraints, want to stay low (200 MB), to do: test if this actually affects scheduling
     results_file_name_list = []
     for network_spec in network_specs:
@@ -292,40 +1179,173 @@ def multi_network_results_for_injections_file(
         )
         # includes path, injs-per-zbin is num_injs_per_redshift_bin input to generate_injections (e.g. will be 250k)
         results_file_name_list.append(net.file_name_with_path)
-        if net.results_file_exists:
-            raise Exception("Some results file/s already exist, aborting process.")
+    all_partial_file_name_list = [
+        partial_results_file_name(file_name) for file_name in results_file_name_list
+    ]
 
-    # list of multi_network_results_dict's from each injection
-    multi_network_results_dict_list = parallel_map(
-        lambda inj: multi_network_results_for_injection(
-            network_specs,
-            inj,
-            base_params,
-            wf_dict,
-            deriv_dict,
-            misc_settings_dict,
-            debug=debug,
-        ),
-        process_inj_data,
-        parallel=misc_settings_dict["num_cores"] is not None,
-        num_cpus=misc_settings_dict["num_cores"],
-    )
+    # networks whose results file (and store) were already saved are done, e.g. if a run was pre-empted while saving the results of each network, only the rest are (re)calculated
+    todo = [
+        i
+        for i, file_name in enumerate(results_file_name_list)
+        if not final_results_exist(file_name, misc_settings_dict)
+    ]
+    if len(todo) < len(network_specs):
+        print(
+            f"Results already saved for {len(network_specs) - len(todo)} of {len(network_specs)} networks."
+        )
+    if len(todo) == 0:
+        remove_checkpoints(all_partial_file_name_list, results_file_name, data_path)
+        return True
+    network_specs = [network_specs[i] for i in todo]
+    results_file_name_list = [results_file_name_list[i] for i in todo]
+
+    # resume from the checkpoints of a previous run with the same row lengths, the last completed injection is that of the shortest checkpoint
+    row_lengths = [
+        network_results_row_length(network_spec, deriv_dict, misc_settings_dict)
+        for network_spec in network_specs
+    ]
+    partial_file_name_list = [all_partial_file_name_list[i] for i in todo]
+    if all(os.path.isfile(file_name) for file_name in partial_file_name_list):
+        partial_results_list = [
+            np.load(file_name) for file_name in partial_file_name_list
+        ]
+    else:
+        partial_results_list = None
+    if partial_results_list is not None and all(
+        partial_results.shape[1] == row_length
+        for partial_results, row_length in zip(partial_results_list, row_lengths)
+    ):
+        num_done = min(len(partial_results) for partial_results in partial_results_list)
+        partial_results_list = [
+            partial_results[:num_done] for partial_results in partial_results_list
+        ]
+        print(f"Resuming from injection {num_done} of {len(process_inj_data)}.")
+    else:
+        partial_results_list = [np.empty((0, row_length)) for row_length in row_lengths]
+        num_done = 0
+
+    if checkpoint_every is None:
+        checkpoint_every = max(len(process_inj_data) - num_done, 1)
+    # long-lived pool for the locations of each injection, created once per task with the lambdified functions preloaded
+    # analytic and factorised derivatives evaluate the locations in this process, a pool would only sit idle
+    if misc_settings_dict.get("num_loc_cores") is not None and loc_pool_used(
+        wf_dict, deriv_dict
+    ):
+        loc_pool_context = network.loc_pool(
+            misc_settings_dict["num_loc_cores"],
+            deriv_dict["unique_locs"],
+            wf_dict["wf_model_name"],
+            deriv_dict["deriv_symbs_string"],
+            wf_dict["wf_other_var_dic"],
+            not deriv_dict["numerical_over_symbolic_derivs"],
+        )
+    else:
+        loc_pool_context = nullcontext()
+    with loc_pool_context as loc_pool:
+        max_checkpoint_duration = 0.0
+        for start in range(num_done, len(process_inj_data), checkpoint_every):
+            # stop cleanly if the next checkpoint is not expected to finish within the budget
+            elapsed_time = time.monotonic() - start_time
+            if (
+                wall_time_budget is not None
+                and elapsed_time + max_checkpoint_duration > wall_time_budget
+            ):
+                unprocessed_record = dict(
+                    injections_file=injections_file,
+                    inj_range=inj_range,
+                    start=start,
+                    stop=len(process_inj_data),
+                    elapsed_time=elapsed_time,
+                )
+                with open(
+                    unprocessed_record_file_name(results_file_name, data_path), "w"
+                ) as file:
+                    json.dump(unprocessed_record, file)
+                print(
+                    f"Stopping before the wall time budget of {wall_time_budget} s, injections {start} to {len(process_inj_data)} are unprocessed."
+                )
+                return False
+            if stop_event is not None and stop_event.is_set():
+                print(f"Stopped before injection {start} of {len(process_inj_data)}.")
+                return False
+
+            checkpoint_start_time = time.monotonic()
+            # list of multi_network_results_dict's from each injection
+            multi_network_results_dict_list = multi_network_results_for_injections(
+                network_specs,
+                process_inj_data[start : start + checkpoint_every],
+                base_params,
+                wf_dict,
+                deriv_dict,
+                misc_settings_dict,
+                debug=debug,
+                loc_pool=loc_pool,
+            )
+            # the checkpoints may no longer be this task's to write
+            if stop_event is not None and stop_event.is_set():
+                print(
+                    f"Stopped before saving injections {start} to {start + len(multi_network_results_dict_list)} of {len(process_inj_data)}."
+                )
+                return False
+            # append the results for each network, keeping the failed injections as rows of np.nan to track the index
+            for i, network_spec in enumerate(network_specs):
+                results = np.array(
+                    [
+                        multi_network_results_dict[repr(network_spec)]
+                        for multi_network_results_dict in multi_network_results_dict_list
+                    ],
+                    dtype=np.float64,
+                ).reshape(-1, row_lengths[i])
+                partial_results_list[i] = np.concatenate(
+                    (partial_results_list[i], results)
+                )
+                save_npy_atomically(partial_file_name_list[i], partial_results_list[i])
+            max_checkpoint_duration = max(
+                max_checkpoint_duration, time.monotonic() - checkpoint_start_time
+            )
 
     # convert results into numpy arrays for each network,
     for i, network_spec in enumerate(network_specs):
-        results = np.array(
-            [
-                multi_network_results_dict[repr(network_spec)]
-                for multi_network_results_dict in multi_network_results_dict_list
-            ]
+        # failed injections are rows of np.nan in the seven legacy columns
+        succeeded = ~np.any(
+            np.isnan(partial_results_list[i][:, : len(LEGACY_RESULTS_COLUMNS)]),
+            axis=1,
         )
-        results = without_rows_w_nan(results)
+        results = partial_results_list[i][succeeded, : len(LEGACY_RESULTS_COLUMNS)]
         if len(results) == 0:
             print(
                 "All calculated values are NaN (might not be this network's fault however). Saving empty array with shape=(0, 7).",
                 results_file_name_list[i],
-                multi_network_results_dict_list,
             )
             # now just saving an empty array if all results are NaN, some saved injs have high losses, one could have all failures
         #             raise ValueError("All calculated values are NaN.")
-        np.save(results_file_name_list[i], results)
+        save_npy_atomically(results_file_name_list[i], results)
+        if misc_settings_dict.get("full_results", False):
+            save_results_store(
+                results_store_path(results_file_name_list[i]),
+                full_results_columns(
+                    partial_results_list[i][succeeded],
+                    process_inj_data[succeeded],
+                    np.flatnonzero(succeeded)
+                    + (0 if inj_range is None else inj_range[0]),
+                    len(network_spec),
+                    len(converted_deriv_variables(deriv_dict)),
+                ),
+                dict(
+                    network_spec=network_spec,
+                    science_case=wf_dict["science_case"],
+                    wf_model_name=wf_dict["wf_model_name"],
+                    wf_other_var_dic=wf_dict["wf_other_var_dic"],
+                    num_injs_per_redshift_bin=num_injs_per_redshift_bin,
+                    deriv_variables=converted_deriv_variables(deriv_dict),
+                    injections_file=os.path.abspath(injections_file),
+                    inj_params_keys=VARIED_KEYS,
+                    base_params=dict(
+                        (key, float(value)) for key, value in base_params.items()
+                    ),
+                    results_file=os.path.basename(results_file_name_list[i]),
+                ),
+            )
+
+    remove_checkpoints(all_partial_file_name_list, results_file_name, data_path)
+    return True
@@ -49,7 +49,7 @@ import numpy as np
 from scipy.stats import gmean
 from scipy.stats import rv_discrete
 
-from useful_functions import flatten_list, parallel_map
+from useful_functions import flatten_list
 from merger_and_detection_rates import *
 from results_class import InjectionResults
 
@@ -78,15 +78,13 @@ def cosmological_redshift_sample(
         num_subzbin: Number of sub-bins in redshift to construct.
         norm_tag: Which survey to which to normalise merger rates.
         observation_time_in_years: Number of years for which to construct cosmological model.
-        parallel: Whether to parallelise.
+        parallel: Unused, kept for compatibility since the merger rates are evaluated on all the sub-bins at once.
         seed: Random seed for re-sampling from distribution.
         debug: Whether to debug.
 
     Raises:
         ValueError: If science case is not recognised.
     """
-    normalisations = merger_rate_normalisations_from_gwtc_norm_tag(norm_tag)
-
     subzbin = list(
         zip(
             np.geomspace(zmin, zmax, num_subzbin + 1)[:-1],
@@ -94,24 +92,13 @@ def cosmological_redshift_sample(
         )
     )
     # using geometric mean to find the log-centre of each bin
-    subzbin_centres = [gmean(zbin) for zbin in subzbin]
+    subzbin_centres = np.array([gmean(zbin) for zbin in subzbin])
     subzbin_widths = np.array([zbin[1] - zbin[0] for zbin in subzbin])
 
     # R_obs(z) in B&S2022, using the merger rate in the observer's frame like when calculating detection rate (this isn't clear in Section 4A of B&S2022)
-    if science_case == "BNS":
-        merger_rate = lambda z: merger_rate_in_obs_frame(
-            merger_rate_bns, z, normalisation=normalisations[0]
-        )
-    elif science_case == "BBH":
-        merger_rate = lambda z: merger_rate_in_obs_frame(
-            merger_rate_bbh, z, normalisation=normalisations[1]
-        )
-    else:
-        raise ValueError("Science case not recognised.")
-    # R_i in B&S2022
-    subzbin_merger_rate = np.array(
-        parallel_map(merger_rate, subzbin_centres, parallel=parallel)
-    )
+    merger_rate = merger_rate_for_science_case(science_case, norm_tag)
+    # R_i in B&S2022, the merger rates are vectorised over the sub-bins with the cosmology looked up in a spline table
+    subzbin_merger_rate = merger_rate_in_obs_frame(merger_rate, subzbin_centres)
     # q_i by James instead of p_i from B&S2022, weighting by width of each bin to estimate the actual number of mergers: n_i will approximate the integral of R_obs(z) over the bin
     subzbin_weighted_probs = (
         subzbin_merger_rate
@@ -120,7 +107,11 @@ def cosmological_redshift_sample(
     )
 
     # "the desired [total, cosmological] number" of mergers over 10 years, integrating the merger rate in the *source* frame over the redshift range
-    num_draws = int(observation_time_in_years * quad(merger_rate, zmin, zmax)[0])
+    num_draws = int(
+        total_merger_count(
+            science_case, zmin, zmax, norm_tag, observation_time_in_years
+        )
+    )
     drawn_indicies = rv_discrete(
         values=(range(num_subzbin), subzbin_weighted_probs), seed=seed
     ).rvs(size=num_draws)
@@ -136,9 +127,7 @@ def cosmological_redshift_sample(
             drawn_indicies,
         )
     # n_i in B&S2022: sample i with probability p_i "up to the desired [total, cosmological] number" of mergers over 10 years
-    subzbin_num_samples = np.array(
-        [np.sum(drawn_indicies == i) for i in range(num_subzbin)]
-    )
+    subzbin_num_samples = np.bincount(drawn_indicies, minlength=num_subzbin)
 
     return subzbin, subzbin_num_samples
 
@@ -33,7 +33,11 @@ License:
     OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 """
 from typing import List, Set, Dict, Tuple, Optional, Union
+from collections import defaultdict
 import glob
+import json
+import os
+import time
 import numpy as np
 
 
@@ -241,3 +245,133 @@ def find_files_given_networks(
         if print_progress:
             print(f"Found {len(found_files)} file/s:", *found_files, sep="\n")
         return list(found_files)
+
+
+def task_file_tag_and_id(file_name: str) -> Tuple[str, int]:
+    """Returns the tag and task ID of a task file, where the tag is the file name up to the number of injections (or the task ID if there is none).
+
+    For example, ("results_NET_A+_H..A+_L_SCI-CASE_BNS_WF_tf2_tidal", 12) for "results_NET_A+_H..A+_L_SCI-CASE_BNS_WF_tf2_tidal_INJS-PER-ZBIN_250000_TASK_12.npy" and ("injections_SCI-CASE_BNS", 12) for "injections_SCI-CASE_BNS_INJS-PER-ZBIN_250000_TASK_12.npy".
+
+    Args:
+        file_name: Filename of task file with or without path.
+    """
+    file_name_without_task_id, task_id = (
+        os.path.basename(file_name).replace(".npy", "").rsplit("_TASK_", 1)
+    )
+    return file_name_without_task_id.split("_INJS-PER-ZBIN_")[0], int(task_id)
+
+
+def task_files_manifest_file_name(data_path: str) -> str:
+    """Returns the filename with path of the manifest of the task files in a directory, the manifest is saved next to the directory since writing in it would change its modification time.
+
+    Args:
+        data_path: Path to the task files, e.g. "./data_processed_injections/task_files/".
+    """
+    return os.path.normpath(data_path) + "_manifest.json"
+
+
+def task_files_index(
+    data_path: str, use_manifest: bool = True, manifest_min_age_s: float = 2
+) -> Dict[str, List[Tuple[int, str]]]:
+    """Returns the task IDs and file names (without path) of the .npy task files in a directory grouped by tag (see task_file_tag_and_id) and sorted by task ID.
+
+    The file names are parsed in a single pass over the directory listing. The index is saved as a manifest (see task_files_manifest_file_name) together with the modification time of the directory, which changes whenever a file is added, removed, or renamed in it, and the number of entries in it, and is reused as long as neither has changed. This spares repeated merges and lookups from parsing ~10k file names again. Since directory modification times are coarse (e.g. 1 s on Lustre), a file added in the same tick as the listing would leave the time unchanged, so the manifest is not saved while the directory was modified within manifest_min_age_s of the listing.
+
+    Args:
+        data_path: Path to the task files.
+        use_manifest: Whether to read and save the manifest.
+        manifest_min_age_s: Minimum time in seconds between the last modification of the directory and the listing for the manifest to be saved.
+    """
+    manifest_file = task_files_manifest_file_name(data_path)
+    scan_time_ns = time.time_ns()
+    dir_mtime_ns = os.stat(data_path).st_mtime_ns
+    if use_manifest and os.path.isfile(manifest_file):
+        try:
+            with open(manifest_file, "r") as file:
+                manifest = json.load(file)
+            if manifest["dir_mtime_ns"] == dir_mtime_ns and manifest[
+                "num_entries"
+            ] == sum(1 for _ in os.scandir(data_path)):
+                return dict(
+                    (tag, [(task_id, file_name) for task_id, file_name in entries])
+                    for tag, entries in manifest["index"].items()
+                )
+        except (OSError, ValueError, KeyError):
+            pass
+
+    index: Dict[str, List[Tuple[int, str]]] = defaultdict(list)
+    file_names = os.listdir(data_path)
+    for file_name in file_names:
+        if file_name.endswith(".npy") and "_TASK_" in file_name:
+            tag, task_id = task_file_tag_and_id(file_name)
+            index[tag].append((task_id, file_name))
+    for entries in index.values():
+        entries.sort()
+    index = dict(index)
+
+    if use_manifest and dir_mtime_ns < scan_time_ns - manifest_min_age_s * 1e9:
+        try:
+            # write to a temporary file and rename so that concurrent processes never read a partial manifest
+            tmp_file = f"{manifest_file}.{os.getpid()}.tmp"
+            with open(tmp_file, "w") as file:
+                json.dump(
+                    dict(
+                        dir_mtime_ns=dir_mtime_ns,
+                        num_entries=len(file_names),
+                        index=index,
+                    ),
+                    file,
+                )
+            os.replace(tmp_file, manifest_file)
+        except OSError:
+            pass
+    return index
+
+
+def task_id_gaps(
+    task_ids: List[int], expected_task_ids: Optional[List[int]] = None
+) -> List[Tuple[int, int]]:
+    """Returns the inclusive ranges of missing task IDs.
+
+    Args:
+        task_ids: Task IDs found.
+        expected_task_ids: Task IDs expected, e.g. those of the injections task files of the science case. Defaults to all from the least to the greatest found.
+    """
+    if expected_task_ids is None:
+        if len(task_ids) == 0:
+            return []
+        expected_task_ids = range(min(task_ids), max(task_ids) + 1)
+    missing = sorted(set(expected_task_ids) - set(task_ids))
+    gaps: List[Tuple[int, int]] = []
+    for task_id in missing:
+        if gaps and gaps[-1][1] == task_id - 1:
+            gaps[-1] = (gaps[-1][0], task_id)
+        else:
+            gaps.append((task_id, task_id))
+    return gaps
+
+
+def find_task_file(data_path: str, task_id: int, tag: Optional[str] = None) -> str:
+    """Returns the file name with path of the task file with the given task ID using task_files_index.
+
+    Args:
+        data_path: Path to the task files, e.g. "./data_raw_injections/task_files/".
+        task_id: Task ID.
+        tag: Tag to look in, e.g. "injections_SCI-CASE_BNS", if task IDs are not unique across tags.
+
+    Raises:
+        ValueError: If there are no matching or more than one matching task files.
+    """
+    index = task_files_index(data_path)
+    tags = index.keys() if tag is None else [tag]
+    matches = [
+        file_name
+        for tag in tags
+        for entry_task_id, file_name in index.get(tag, [])
+        if entry_task_id == task_id
+    ]
+    if len(matches) != 1:
+        raise ValueError(
+            f"Number of task files in {data_path} with task ID {task_id} is not one: {len(matches)}"
+        )
+    return os.path.join(data_path, matches[0])
@@ -40,11 +40,15 @@ License:
 """
 from typing import List, Set, Dict, Tuple, Optional, Union
 from numpy.typing import NDArray
+from functools import lru_cache
 import numpy as np
+from scipy.optimize import nnls
 import glob
 
 from gwbench.basic_relations import f_isco_Msolar, m1_m2_of_Mc_eta, M_of_Mc_eta
 from gwbench import injections
+import gwbench.psd as gwbench_psd
+import gwbench.snr as snr_mod
 
 
 def fisco_obs_from_Mc_eta(
@@ -152,6 +156,231 @@ def filter_bool_for_injection(
     return True
 
 
+def plan_injections(
+    inj_data: NDArray[NDArray[np.float64]],
+    redshifted: bool,
+    coeff_fisco: int,
+    science_case: str,
+    aLIGO_or_Vplus_used: bool = False,
+    fmin: float = 5.0,
+) -> Dict[str, NDArray]:
+    """Returns the validity and the uniform frequency grid of each injection, computed for the whole array at once.
+
+    Vectorised filter_bool_for_injection followed by the grid bounds used to benchmark each injection, so that the processing stage can group, sort, and estimate the cost of injections without a scalar loop over them.
+
+    Args:
+        inj_data: Injection parameters, each row 14 long.
+        redshifted: Whether masses are already redshifted.
+        coeff_fisco: Co-efficient of frequency of ISCO.
+        science_case: Science case.
+        aLIGO_or_Vplus_used: Whether aLIGO or V+ is being analysed, which raises the minimum fmax.
+        fmin: Minimum frequency [Hz].
+
+    Returns:
+        Dict[str, NDArray]: Arrays of the same length as inj_data: "valid" whether to keep the injection, "fisco_obs" frequency of the ISCO in the observer's frame, "fmax" maximum frequency clamped to the bounds, "df" frequency spacing, "num_points" length of the uniform grid np.arange(fmin, fmax + df, df), and "grid_key" index of the injection's unique (fmax, df) pair (-1 if not valid).
+    """
+    inj_data = np.atleast_2d(inj_data)
+    Mc, eta, z = inj_data[:, 0], inj_data[:, 1], inj_data[:, -1]
+    # eta > 0.25 is a domain error of m1 and m2
+    with np.errstate(invalid="ignore"):
+        m1, m2 = m1_m2_of_Mc_eta(Mc, eta)
+    valid = (m1 > 0) & (m2 > 0) & (Mc > 0) & (eta <= 0.25)
+
+    fisco_obs = fisco_obs_from_Mc_eta(Mc, eta, redshifted=redshifted, z=z)
+    fmax = coeff_fisco * fisco_obs
+    if science_case == "BBH":
+        valid &= fmax >= (12 if aLIGO_or_Vplus_used else 7)
+
+    # see frequency_grid_bounds_for_injection in calculate_unified_injections.py
+    if aLIGO_or_Vplus_used:
+        fmax_bounds = (11, 1024)
+    else:
+        fmax_bounds = (6, 1024)
+    fmax = np.clip(fmax, *fmax_bounds)
+    df = ((fmax - fmax_bounds[0]) / (fmax_bounds[1] - fmax_bounds[0])) * 10 + (
+        (fmax_bounds[1] - fmax) / (fmax_bounds[1] - fmax_bounds[0])
+    ) * 1 / 16
+    num_points = np.ceil((fmax + df - fmin) / df).astype(int)
+
+    grid_key = np.full(len(inj_data), -1)
+    if np.any(valid):
+        grid_key[valid] = np.unique(
+            np.stack((fmax[valid], df[valid]), axis=1), axis=0, return_inverse=True
+        )[1].ravel()
+    return dict(
+        valid=valid,
+        fisco_obs=fisco_obs,
+        fmax=fmax,
+        df=df,
+        num_points=num_points,
+        grid_key=grid_key,
+    )
+
+
+def injection_plan_file_name(injection_file_name: str) -> str:
+    """Returns the file name of the plan saved next to the injections data file, both with or without path.
+
+    The plan is a .npz file of the arrays from plan_injections for aLIGO_or_Vplus_used False and, with the suffix "_aLIGO_or_Vplus", True.
+
+    Args:
+        injection_file_name: Injections data file name, e.g. from injection_file_name.
+    """
+    return injection_file_name.replace(".npy", "_PLAN.npz")
+
+
+def save_injection_plan(
+    file_name: str,
+    inj_data: NDArray[NDArray[np.float64]],
+    redshifted: bool,
+    coeff_fisco: int,
+    science_case: str,
+) -> None:
+    """Saves the plan of the injections next to their data file.
+
+    Args:
+        file_name: Injections data file name with path.
+        inj_data: Injection parameters, each row 14 long.
+        redshifted: Whether masses are already redshifted.
+        coeff_fisco: Co-efficient of frequency of ISCO.
+        science_case: Science case.
+    """
+    plan = plan_injections(inj_data, redshifted, coeff_fisco, science_case)
+    for key, value in plan_injections(
+        inj_data, redshifted, coeff_fisco, science_case, aLIGO_or_Vplus_used=True
+    ).items():
+        if key != "fisco_obs":
+            plan[key + "_aLIGO_or_Vplus"] = value
+    np.savez(injection_plan_file_name(file_name), **plan)
+
+
+def load_injection_plan(
+    file_name: str, aLIGO_or_Vplus_used: bool = False
+) -> Optional[Dict[str, NDArray]]:
+    """Returns the plan saved next to an injections data file, as from plan_injections, or None if there isn't one.
+
+    Args:
+        file_name: Injections data file name with path.
+        aLIGO_or_Vplus_used: Whether aLIGO or V+ is being analysed.
+    """
+    try:
+        with np.load(injection_plan_file_name(file_name)) as plan_file:
+            suffix = "_aLIGO_or_Vplus" if aLIGO_or_Vplus_used else ""
+            return dict(
+                (key, plan_file[key + suffix] if key != "fisco_obs" else plan_file[key])
+                for key in (
+                    "valid",
+                    "fisco_obs",
+                    "fmax",
+                    "df",
+                    "num_points",
+                    "grid_key",
+                )
+            )
+    except FileNotFoundError:
+        return None
+
+
+@lru_cache(maxsize=256)
+def non_uniform_frequency_grid(
+    fmin: float,
+    fmax: float,
+    tecs: Tuple[str, ...],
+    rtol: float = 1e-2,
+    f_pivot: float = 20.0,
+    f_linear: float = 300.0,
+    min_num_points: int = 17,
+    max_num_points: int = 4097,
+) -> Tuple[NDArray[np.float64], NDArray[np.float64]]:
+    """Returns a frequency grid from fmin to fmax that is non-uniform to resolve the low-frequency inspiral and its quadrature weights.
+
+    The points are uniform in x(f) = ln(f) - 3/5 f_pivot^(5/3) f^(-5/3) + f/f_linear, i.e. the spacing is uniform in f^(-5/3) (the phase evolution of the inspiral) below f_pivot, uniform in ln(f) above it where the integrands are smooth power laws over the PSD, and uniform in f above f_linear where the Fisher integrands of the time of coalescence rise with f^2. The point nearest to each edge of a PSD's band inside (fmin, fmax), e.g. 10 Hz for V+, is moved onto it so that the truncated integrals start there. The number of points is doubled from min_num_points until the Simpson's rule of the SNR and Fisher integrands summed over tecs, f^(-7/3) * f^p / PSD(f) for p in (-10/3, 0, 2), changes by less than rtol in two successive doublings.
+
+    Args:
+        fmin: Minimum frequency [Hz].
+        fmax: Maximum frequency [Hz].
+        tecs: Detector technologies whose PSDs the integrands are weighted by, e.g. deriv_dict["unique_tecs"] sorted.
+        rtol: Target relative accuracy of the power-law integrals, the benchmark of a waveform is less accurate (see frequency_grid_for_injection in calculate_unified_injections.py).
+        f_pivot: Frequency [Hz] where the spacing transitions from uniform in f^(-5/3) to uniform in ln(f).
+        f_linear: Frequency [Hz] where the spacing transitions from uniform in ln(f) to uniform in f.
+        min_num_points: Initial number of points, should be odd for Simpson's rule.
+        max_num_points: Maximum number of points, the grid is returned at this size if rtol is not yet reached.
+
+    Returns:
+        Tuple[NDArray[np.float64], NDArray[np.float64]]: (f, weights) where sum(weights*y) integrates y over f with the same irregular Simpson's rule that snr_mod.inner_prod_weights uses, both read-only since they are cached.
+    """
+    # map x(f) is monotonic and inverted by interpolating a dense table, the exact position of the points is irrelevant since the weights follow the actual grid
+    f_table = np.geomspace(fmin, fmax, 8193)
+    x_table = (
+        np.log(f_table)
+        - 0.6 * f_pivot ** (5 / 3) * f_table ** (-5 / 3)
+        + f_table / f_linear
+    )
+    # band edges to within the spacing of the dense table
+    band_edges = set()
+    for tec in tecs:
+        f_tec = gwbench_psd.psd(tec, f_table)[1]
+        band_edges.update(edge for edge in (f_tec[0], f_tec[-1]) if fmin < edge < fmax)
+
+    def grid_of_size(num_points: int) -> NDArray[np.float64]:
+        f = np.interp(
+            np.linspace(x_table[0], x_table[-1], num_points), x_table, f_table
+        )
+        f[0], f[-1] = fmin, fmax
+        for edge in band_edges:
+            i = np.argmin(np.abs(f - edge))
+            if 0 < i < num_points - 1:
+                f[i] = edge
+        return f
+
+    def integrals(f: NDArray[np.float64]) -> NDArray[np.float64]:
+        result = np.zeros(3)
+        for tec in tecs:
+            psd, f_tec = gwbench_psd.psd(tec, f)
+            if len(f_tec) < 3:
+                continue
+            weights = snr_mod.simps_weights(f_tec) / psd
+            for j, p in enumerate((-10 / 3, 0, 2)):
+                result[j] += np.sum(weights * f_tec ** (-7 / 3 + p))
+        return result
+
+    # the tabulated PSDs are interpolated linearly and have narrow lines, so the integrals can agree by chance between two refinements, require two in a row
+    num_points = min_num_points
+    f = grid_of_size(num_points)
+    old_integrals, old_converged = integrals(f), False
+    while num_points < max_num_points:
+        num_points = min(2 * num_points - 1, max_num_points)
+        f = grid_of_size(num_points)
+        new_integrals = integrals(f)
+        converged = np.all(
+            np.abs(new_integrals - old_integrals) <= rtol * np.abs(new_integrals)
+        )
+        if converged and old_converged:
+            break
+        old_integrals, old_converged = new_integrals, converged
+    weights = snr_mod.simps_weights(f)
+    f.flags.writeable = False
+    weights.flags.writeable = False
+    return f, weights
+
+
+# factor that grid_rtol is tightened by for the waveform models whose integrands are resolved worse than the power laws that non_uniform_frequency_grid converges, e.g. the interference between the higher modes of IMRPhenomHM oscillates with the phase difference of the modes
+GRID_RTOL_FACTORS: Dict[str, float] = dict(lal_bbh=0.1)
+
+
+def grid_rtol_for_wf_model(
+    grid_rtol: Optional[float], wf_model_name: str
+) -> Optional[float]:
+    """Returns the target accuracy of non_uniform_frequency_grid for a waveform model, see GRID_RTOL_FACTORS.
+
+    Args:
+        grid_rtol: misc_settings_dict["grid_rtol"], None for the uniform grid.
+        wf_model_name: Name of the waveform model, e.g. "lal_bbh".
+    """
+    if grid_rtol is None:
+        return None
+    return grid_rtol * GRID_RTOL_FACTORS.get(wf_model_name, 1.0)
+
+
 def generate_injections(
     num_injs_per_redshift_bin: int,
     redshift_bins: Tuple[Tuple[float, float, float], ...],
@@ -196,14 +425,7 @@ def generate_injections(
     # still have to additionally filter for V+ and aLIGO+ later
     inj_data_len_0 = len(inj_data)
     inj_data = inj_data[
-        list(
-            map(
-                lambda inj: filter_bool_for_injection(
-                    inj, redshifted, coeff_fisco, science_case
-                ),
-                inj_data,
-            )
-        )
+        plan_injections(inj_data, redshifted, coeff_fisco, science_case)["valid"]
     ]
     if len(inj_data) < inj_data_len_0:
         print(
@@ -212,6 +434,9 @@ def generate_injections(
 
     inj_file_name = injection_file_name(science_case, num_injs_per_redshift_bin)
     np.save(inj_data_path + inj_file_name, inj_data)
+    save_injection_plan(
+        inj_data_path + inj_file_name, inj_data, redshifted, coeff_fisco, science_case
+    )
 
 
 def inj_params_for_science_case(
@@ -274,48 +499,296 @@ def inj_params_for_science_case(
     return mass_dict, spin_dict, redshift_bins, coeff_fisco
 
 
+# predicted wall time [s] of an injection as (overhead per stack, overhead per injection, per injection and frequency point of its grid) for each (science case, derivative mode), see predicted_injection_costs
+# calibrated with calibrate_injection_cost_model from the wall times of stacks of 1-16 BNS injections on grids of 129-4097 points and of single BBH injections on their grids of 65-513 points (numerical derivatives aren't stacked), measured for the BS2022_SIX networks on one core of a 1-CPU Linux VM (Python 3.11, NumPy 1.26) with the settings of run_calculate_unified_injections_as_task.py: injs_per_batch=16, grid_rtol=1e-2, use_rot=True, only_net=True, and factorised_derivs=True, and analytic_derivs=False for the symbolic derivatives
+INJECTION_COST_MODEL: Dict[Tuple[str, str], Tuple[float, float, float]] = {
+    ("BNS", "analytic"): (1.2e-2, 0.0, 1.8e-5),
+    ("BNS", "symbolic"): (8.8e-3, 0.0, 1.4e-5),
+    ("BBH", "numerical"): (0.0, 3.3e-2, 4.7e-5),
+}
+# waveform model of each science case in run_calculate_unified_injections_as_task.py and its derivative mode
+DEFAULT_WF_MODEL_NAMES: Dict[str, str] = dict(BNS="tf2_tidal", BBH="lal_bbh")
+DEFAULT_DERIV_MODES: Dict[str, str] = dict(BNS="analytic", BBH="numerical")
+
+
+def calibrate_injection_cost_model(
+    num_points: NDArray[np.int_],
+    timings: NDArray[np.float64],
+    stack_sizes: Optional[NDArray[np.int_]] = None,
+) -> Tuple[float, float, float]:
+    """Returns the (overhead per stack, overhead per injection, per injection and frequency point) of the linear cost model fitted to measured timings, e.g. to update INJECTION_COST_MODEL.
+
+    The wall time of a stack of b injections on a grid of n points is modelled as per_stack + b * (per_injection + per_point * n). The coefficients are non-negative and fitted in relative error, so that the single injections on coarse grids count as much as the large stacks. If the injections are timed one at a time, then the two overheads can't be told apart and are returned as per injection.
+
+    Args:
+        num_points: Lengths of the frequency grids of the timed stacks.
+        timings: Wall times [s] of the stacks.
+        stack_sizes: Numbers of injections in the timed stacks. Defaults to one each.
+    """
+    num_points = np.asarray(num_points, dtype=float)
+    timings = np.asarray(timings, dtype=float)
+    if stack_sizes is None:
+        stack_sizes = np.ones_like(num_points)
+    stack_sizes = np.asarray(stack_sizes, dtype=float)
+    columns = [stack_sizes, stack_sizes * num_points]
+    stacked = np.any(stack_sizes != 1)
+    if stacked:
+        columns.insert(0, np.ones_like(num_points))
+    coeffs = nnls(np.stack(columns, axis=1) / timings[:, None], np.ones_like(timings))[
+        0
+    ]
+    if not stacked:
+        coeffs = np.concatenate(([0.0], coeffs))
+    per_stack, per_injection, per_point = coeffs
+    return per_stack, per_injection, per_point
+
+
+def predicted_frequency_grid_sizes(
+    plan: Dict[str, NDArray],
+    tecs: Optional[Tuple[str, ...]] = None,
+    grid_rtol: Optional[float] = None,
+    fmin: float = 5.0,
+    log_fmax_spacing: float = 1e-2,
+) -> NDArray[np.int_]:
+    """Returns the number of points of the frequency grid that each injection in a plan is benchmarked on, see frequency_grid_for_injection in calculate_unified_injections.py.
+
+    Without grid_rtol, this is the length of the uniform grid, plan["num_points"]. Otherwise, it is the size of non_uniform_frequency_grid, which varies irregularly with fmax due to the lines of the PSDs. Since each grid takes milliseconds to build, the injections are binned by ln(fmax) and each bin is given the size of the grid at its largest fmax, which is exact for the injections whose fmax is truncated to the maximum.
+
+    Args:
+        plan: Plan of the injections from plan_injections.
+        tecs: Detector technologies of the networks being benchmarked, required with grid_rtol.
+        grid_rtol: Target accuracy of the non-uniform grid, grid_rtol_for_wf_model of misc_settings_dict["grid_rtol"] for the waveform models in NON_UNIFORM_GRID_WF_MODELS. None for the uniform grid.
+        fmin: Minimum frequency [Hz].
+        log_fmax_spacing: Width of the bins in ln(fmax).
+
+    Raises:
+        ValueError: If grid_rtol is given without tecs.
+    """
+    if grid_rtol is None:
+        return plan["num_points"]
+    if tecs is None:
+        raise ValueError("The non-uniform grid depends on the PSDs, tecs is required.")
+    num_points = np.zeros(len(plan["valid"]), dtype=int)
+    fmax = plan["fmax"][plan["valid"]]
+    if len(fmax) == 0:
+        return num_points
+    bin_inds = np.unique(
+        np.floor(np.log(fmax) / log_fmax_spacing), return_inverse=True
+    )[1].ravel()
+    bin_fmax = np.zeros(bin_inds.max() + 1)
+    np.maximum.at(bin_fmax, bin_inds, fmax)
+    bin_num_points = np.array(
+        [
+            len(
+                non_uniform_frequency_grid(
+                    fmin, fmax_of_bin, tuple(sorted(tecs)), rtol=grid_rtol
+                )[0]
+            )
+            for fmax_of_bin in bin_fmax
+        ]
+    )
+    num_points[plan["valid"]] = bin_num_points[bin_inds]
+    return num_points
+
+
+def predicted_stack_sizes(
+    plan: Dict[str, NDArray], injs_per_batch: Optional[int] = None
+) -> NDArray[np.int_]:
+    """Returns the number of injections in the stack that each injection in a plan is benchmarked in, see multi_network_results_for_injection_batch in calculate_unified_injections.py.
+
+    The injections that share a frequency grid are stacked up to injs_per_batch at a time. This is approximated by the number of valid injections in the plan with the same grid_key capped at injs_per_batch, i.e. it ignores the partial stacks where the injections of a grid are split between tasks.
+
+    Args:
+        plan: Plan of the injections from plan_injections.
+        injs_per_batch: misc_settings_dict["injs_per_batch"], None if the injections are benchmarked one at a time.
+    """
+    stack_sizes = np.ones(len(plan["valid"]), dtype=int)
+    if injs_per_batch is None or not np.any(plan["valid"]):
+        return stack_sizes
+    grid_key = plan["grid_key"][plan["valid"]]
+    stack_sizes[plan["valid"]] = np.minimum(
+        np.bincount(grid_key)[grid_key], injs_per_batch
+    )
+    return stack_sizes
+
+
+def predicted_injection_costs(
+    plan: Dict[str, NDArray],
+    science_case: str,
+    deriv_mode: Optional[str] = None,
+    num_points: Optional[NDArray[np.int_]] = None,
+    injs_per_batch: Optional[int] = None,
+) -> NDArray[np.float64]:
+    """Returns the predicted wall time [s] of each injection in a plan from INJECTION_COST_MODEL, zero for invalid injections.
+
+    The overhead of each stack is shared between its injections, see predicted_stack_sizes. Numerical derivatives aren't stacked.
+
+    Args:
+        plan: Plan of the injections from plan_injections.
+        science_case: Science case.
+        deriv_mode: Derivative mode, "analytic", "symbolic", or "numerical". Defaults to DEFAULT_DERIV_MODES of the science case.
+        num_points: Number of points of the frequency grid of each injection, see predicted_frequency_grid_sizes. Defaults to the uniform grid, plan["num_points"].
+        injs_per_batch: misc_settings_dict["injs_per_batch"], None if the injections are benchmarked one at a time.
+
+    Raises:
+        ValueError: If the cost model isn't calibrated for the science case and derivative mode.
+    """
+    if deriv_mode is None:
+        deriv_mode = DEFAULT_DERIV_MODES.get(science_case)
+    if (science_case, deriv_mode) not in INJECTION_COST_MODEL:
+        raise ValueError(
+            f"Cost model not calibrated for science case {science_case} with {deriv_mode} derivatives."
+        )
+    if num_points is None:
+        num_points = plan["num_points"]
+    if deriv_mode == "numerical":
+        injs_per_batch = None
+    per_stack, per_injection, per_point = INJECTION_COST_MODEL[
+        (science_case, deriv_mode)
+    ]
+    return np.where(
+        plan["valid"],
+        per_stack / predicted_stack_sizes(plan, injs_per_batch)
+        + per_injection
+        + per_point * num_points,
+        0.0,
+    )
+
+
+def balanced_chop_inds(
+    costs: NDArray[np.float64], num_tasks: int
+) -> List[Tuple[int, int]]:
+    """Returns the (start, stop) indices of contiguous chunks of the injections with roughly equal total predicted cost for each task.
+
+    Each chunk ends at the injection whose cumulative cost is nearest to its share of the total. Chunks are non-empty if there are at least as many injections as tasks.
+
+    Args:
+        costs: Predicted cost of each injection.
+        num_tasks: Number of tasks to split the injections between.
+    """
+    num_injs = len(costs)
+    # cumulative cost at the middle of each injection
+    cum_costs = np.cumsum(costs) - 0.5 * np.asarray(costs)
+    ks = np.arange(1, num_tasks)
+    bounds = np.searchsorted(cum_costs, np.sum(costs) * ks / num_tasks)
+    if num_injs >= num_tasks:
+        # at least one injection in each task
+        bounds = ks + np.maximum.accumulate(
+            np.clip(bounds - ks, 0, num_injs - num_tasks)
+        )
+    else:
+        bounds = np.minimum(bounds, num_injs)
+    bounds = np.concatenate(([0], bounds, [num_injs]))
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def tasks_per_science_case(total_costs: List[float], job_array_size: int) -> List[int]:
+    """Returns the number of tasks for each science case, proportional to its total predicted cost (by largest remainder) and at least one each.
+
+    Args:
+        total_costs: Total predicted cost of the injections of each science case.
+        job_array_size: Number of tasks in slurm job array.
+    """
+    total_costs = np.asarray(total_costs, dtype=float)
+    num_science_cases = len(total_costs)
+    if np.sum(total_costs) <= 0:
+        shares = np.full(num_science_cases, job_array_size / num_science_cases)
+    else:
+        shares = (job_array_size - num_science_cases) * total_costs / np.sum(
+            total_costs
+        ) + 1
+    num_tasks = np.floor(shares).astype(int)
+    remainders = np.argsort(num_tasks - shares)[: job_array_size - np.sum(num_tasks)]
+    num_tasks[remainders] += 1
+    return list(num_tasks)
+
+
 def chop_injections_data_for_processing(
     job_array_size: int = 2048,
     inj_data_path: str = "./data_raw_injections/",
     output_data_path: str = "./data_raw_injections/task_files/",
+    deriv_modes: Optional[Dict[str, str]] = None,
+    tecs: Optional[Tuple[str, ...]] = None,
+    grid_rtol: Optional[float] = None,
+    injs_per_batch: Optional[int] = None,
+    wf_model_names: Optional[Dict[str, str]] = None,
 ) -> None:
     """Splits (chops) the saved injections data into different files for each of the parallel tasks later to run over.
 
-    Given 2048 tasks in the job array (the maximum), split the task as evenly as possible between each task and science case.
+    Given 2048 tasks in the job array (the maximum), the tasks are allocated to the science cases in proportion to their total predicted wall time and the injections of each science case are split into contiguous chunks of roughly equal predicted wall time, see INJECTION_COST_MODEL. The costs are predicted for the frequency grids and stacks that the injections will be benchmarked on, so tecs, grid_rtol, and injs_per_batch should match the settings of run_calculate_unified_injections_as_task.py. Without a saved plan of the injections, each injection is given the same cost.
 
     Args:
         job_array_size: Number of tasks in slurm job array.
         inj_data_path: Path to input injections data.
         output_data_path: Path to output (chopped) injections data.
+        deriv_modes: Derivative mode of each science case, see predicted_injection_costs. Defaults to DEFAULT_DERIV_MODES.
+        tecs: Detector technologies of the networks to be benchmarked, which set the frequency bounds and the non-uniform grid. None assumes neither aLIGO nor V+ and requires grid_rtol to be None.
+        grid_rtol: misc_settings_dict["grid_rtol"] of the non-uniform frequency grid, see predicted_frequency_grid_sizes. None for the uniform grid.
+        injs_per_batch: Maximum number of injections to stack, see predicted_stack_sizes. None if the injections are benchmarked one at a time.
+        wf_model_names: Waveform model of each science case, which can tighten grid_rtol, see grid_rtol_for_wf_model. Defaults to DEFAULT_WF_MODEL_NAMES.
     """
-    files = [file for file in glob.glob(inj_data_path + "*.npy")]
-    num_science_cases = len(files)
-    # TODO: more efficiently allocate the tasks, currently is 1464 in each task and more in the last of each science case to pick up the remainder
-    tasks_per_sc = job_array_size // num_science_cases
-    for j, file in enumerate(files):
+    if deriv_modes is None:
+        deriv_modes = DEFAULT_DERIV_MODES
+    if wf_model_names is None:
+        wf_model_names = DEFAULT_WF_MODEL_NAMES
+    files = sorted(glob.glob(inj_data_path + "*.npy"))
+    # (science case, number of injections per redshift bin, injections data, plan, predicted costs) of each file
+    science_case_data = []
+    for file in files:
         # absolute path included
         science_case, num_injs_per_redshift_bin_str = (
             file.replace("_INJS-PER-ZBIN_", "_SCI-CASE_")
             .replace(".npy", "_SCI-CASE_")
             .split("_SCI-CASE_")[1:3]
         )
-        num_injs_per_redshift_bin = int(num_injs_per_redshift_bin_str)
         inj_data = np.load(file)
-        injs_per_task = len(inj_data) // tasks_per_sc
-        chop_inds = [
-            (i * injs_per_task, (i + 1) * injs_per_task) for i in range(tasks_per_sc)
-        ]
-        # extend last task to cover any remainder after // above
-        chop_inds[-1] = (chop_inds[-1][0], -1)
-        for i in range(tasks_per_sc):
-            task_id = j * tasks_per_sc + i + 1
+        try:
+            with np.load(injection_plan_file_name(file)) as plan_file:
+                plan = dict(plan_file)
+            # the plan of the frequency bounds that the pipeline will use, see aLIGO_or_Vplus_used in calculate_unified_injections.py
+            benchmarked_plan = load_injection_plan(
+                file,
+                aLIGO_or_Vplus_used=tecs is not None
+                and ("aLIGO" in tecs or "V+" in tecs),
+            )
+            cost = predicted_injection_costs(
+                benchmarked_plan,
+                science_case,
+                deriv_modes.get(science_case),
+                num_points=predicted_frequency_grid_sizes(
+                    benchmarked_plan,
+                    tecs,
+                    grid_rtol_for_wf_model(grid_rtol, wf_model_names.get(science_case)),
+                ),
+                injs_per_batch=injs_per_batch,
+            )
+        except FileNotFoundError:
+            plan = None
+            cost = np.ones(len(inj_data))
+        science_case_data.append(
+            (science_case, int(num_injs_per_redshift_bin_str), inj_data, plan, cost)
+        )
+
+    num_tasks = tasks_per_science_case(
+        [np.sum(cost) for *_, cost in science_case_data], job_array_size
+    )
+    task_id_offsets = np.cumsum([0] + num_tasks[:-1])
+    for j, (science_case, num_injs_per_redshift_bin, inj_data, plan, cost) in enumerate(
+        science_case_data
+    ):
+        chop_inds = balanced_chop_inds(cost, num_tasks[j])
+        for i, (start, stop) in enumerate(chop_inds):
+            task_id = task_id_offsets[j] + i + 1
             task_file_name = injection_file_name(
                 science_case, num_injs_per_redshift_bin, task_id=task_id
             )
-            np.save(
-                output_data_path + task_file_name,
-                inj_data[chop_inds[i][0] : chop_inds[i][1]],
-            )
+            np.save(output_data_path + task_file_name, inj_data[start:stop])
+            # the plan of the task's injections goes next to them
+            if plan is not None:
+                np.savez(
+                    output_data_path + injection_plan_file_name(task_file_name),
+                    **dict((key, value[start:stop]) for key, value in plan.items()),
+                )
 
 
 if __name__ == "__main__":
@@ -338,4 +811,9 @@ if __name__ == "__main__":
             science_case,
         )
 
-    chop_injections_data_for_processing()
+    # the detector technologies of the BS2022_SIX networks, and the frequency grid and stacking of run_calculate_unified_injections_as_task.py
+    chop_injections_data_for_processing(
+        tecs=("A+", "V+", "K+", "Voyager-CBO", "ET", "CE2-40-CBO"),
+        grid_rtol=1e-2,
+        injs_per_batch=16,
+    )
@@ -2,7 +2,7 @@
 """Generate symbolic derivatives as lambdified functions for gwbench.
 
 When run as a script: generate all symbolic derivatives for tf2_tidal at all standard locations ahead of benchmarking.
-Slurm gets upset when multiple tasks try to create the derivatives if there aren't any there already, so run in series.
+Only missing or outdated files are generated, in parallel over the locations, and concurrent tasks wait for a single writer of each file.
 
 Usage:
     $ python3 generate_symbolic_derivatives.py
@@ -40,7 +40,6 @@ License:
     OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 """
 from typing import List, Set, Dict, Tuple, Optional, Union
-import os
 
 from gwbench import wf_class as wfc
 from gwbench import detector_response_derivatives as drd
@@ -54,10 +53,13 @@ def generate_symbolic_derivatives(
     use_rot: bool,
     output_path: Optional[str] = None,
     print_progress: bool = True,
+    num_cores: Optional[int] = None,
+    cse: bool = True,
 ) -> None:
     """Generate symbolic derivatives, from generate_lambdified_functions.py from gwbench.
 
     Use network's wf_model_name, wf_other_var_dic, deriv_symbs_string, and use_rot.
+    Only the files that are missing or whose inputs (settings and sympy source code) changed are generated, e.g. adding a location costs that location's generation time. Each file is written under a file lock and renamed into place, so concurrent tasks wait for one writer instead of racing.
     Will print 'Done.' when finished unless all files already exist in which it will print as such.
 
     Args:
@@ -68,6 +70,8 @@ def generate_symbolic_derivatives(
         use_rot: Whether to account for Earth's rotation.
         output_path: Output file path.
         print_progress: Whether to print progress.
+        num_cores: Number of processes to generate the missing files of different locations in parallel, None generates them in series.
+        cse: Whether to store one function per file that evaluates all derivatives from their common subexpressions, several times faster to evaluate than one function per derivative.
     """
     # # how to print settings as a sanity check
     # print('wf_model_name = \'{}\''.format(wf.wf_model_name))
@@ -75,47 +79,20 @@ def generate_symbolic_derivatives(
     # print('deriv_symbs_string = \'{}\''.format(deriv_symbs_string))
     # print('use_rot = %i'%use_rot)
 
-    # skip if derivatives already exist
-    file_names = [
-        "par_deriv_WFM_"
-        + wf_model_name
-        + "_VAR_"
-        + deriv_symbs_string.replace(" ", "_")
-        + "_DET_"
-        + key
-        + ".dat"
-        for key in locs
-    ]
-    file_names.append(
-        "par_deriv_WFM_"
-        + wf_model_name
-        + "_VAR_"
-        + deriv_symbs_string.replace(" ra", "")
-        .replace(" dec", "")
-        .replace(" psi", "")
-        .replace(" ", "_")
-        + "_DET_"
-        + "pl_cr"
-        + ".dat"
+    # waveform
+    wf = wfc.Waveform(wf_model_name, wf_other_var_dic)
+    # lambidified detector reponses and derivatives, skipping the files that are up to date
+    generated_keys = drd.generate_det_responses_derivs_sym(
+        wf,
+        deriv_symbs_string,
+        locs=locs,
+        use_rot=use_rot,
+        user_lambdified_functions_path=output_path,
+        num_cores=num_cores,
+        only_missing=True,
+        cse=cse,
     )
-    path = "lambdified_functions/"
-    file_names_existing = [
-        file_name for file_name in file_names if os.path.isfile(path + file_name)
-    ]
-    if len(file_names_existing) < len(file_names):
-        # if a file doesn't exist, generate them all again
-        # TODO: make this more efficient and just generate the missing files, or, do it in parallel
-        # waveform
-        wf = wfc.Waveform(wf_model_name, wf_other_var_dic)
-        # lambidified detector reponses and derivatives
-        drd.generate_det_responses_derivs_sym(
-            wf,
-            deriv_symbs_string,
-            locs=locs,
-            use_rot=use_rot,
-            user_lambdified_functions_path=output_path,
-        )
-    elif print_progress:
+    if print_progress and not generated_keys:
         print("All lambdified derivatives already exist.")
 
 
@@ -135,4 +112,5 @@ if __name__ == "__main__":
         locs,
         use_rot,
         print_progress=False,
+        num_cores=len(locs),
     )
@@ -60,15 +60,19 @@ def antenna_pattern_and_loc_phase_fac(f,Mc,tc,ra,dec,psi,gmst0,loc,use_rot):
     #           ra      right ascencsion [rad]
     #           psi     polarization angle [rad]
     #           gmst0   GreenwichMeanSiderialTime according to LAL
-    #           loc     location (and implied orientation) of a detector
+    #           loc     location (and implied orientation) of a detector, or a sequence of locations
     #           use_rot  use frequency dependent time due to rotation of earth and SPA
     #
-    # output:   Fp, Fc
+    # output:   Fp, Fc, Flp   broadcast over f and the (stacked) sky positions, with a leading axis for
+    #                         the detectors if loc is a sequence of locations
 
     half_period = 4.32e4
     R = REarth
 
-    D, d = det_ten_and_loc_vec(loc, R)
+    if isinstance(loc, str):
+        D, d = det_ten_and_loc_vec(loc, R)
+    else:
+        D, d = stacked_det_ten_and_loc_vec(loc, R)
 
     if use_rot:
         tf = tc - (5./256.)*(time_fac*Mc)**(-5./3.)*(PI*f)**(-8./3.)
@@ -76,25 +80,107 @@ def antenna_pattern_and_loc_phase_fac(f,Mc,tc,ra,dec,psi,gmst0,loc,use_rot):
         tf = 0
 
     gra = (gmst0 + tf*PI/half_period) - ra
+    gra, dec, psi = np.broadcast_arrays(gra, dec, psi)
     theta = PI/2. - dec
 
-    if isinstance(gra, np.ndarray):
-        r = np.array((cos(gra) * sin(theta), sin(gra) * sin(theta), cos(theta) * np.ones(len(gra))))
-        XX = np.transpose(np.array([ -cos(psi)*sin(gra) - sin(psi)*cos(gra)*sin(dec), -cos(psi)*cos(gra) + sin(psi)*sin(gra)*sin(dec), sin(psi)*cos(dec) * np.ones(len(gra)) ]))
-        YY = np.transpose(np.array([  sin(psi)*sin(gra) - cos(psi)*cos(gra)*sin(dec),  sin(psi)*cos(gra) + cos(psi)*sin(gra)*sin(dec), cos(psi)*cos(dec) * np.ones(len(gra)) ]))
-        Fp = 0.5 * np.array([np.matmul(np.matmul(XX[i],D),XX[i]) - np.matmul(np.matmul(YY[i],D),YY[i]) for i in range(len(gra))])
-        Fc = 0.5 * np.array([np.matmul(np.matmul(XX[i],D),YY[i]) + np.matmul(np.matmul(YY[i],D),XX[i]) for i in range(len(gra))])
+    # unit vectors along the last axis: propagation direction r and polarisation basis XX, YY
+    r  = np.stack((cos(gra) * sin(theta), sin(gra) * sin(theta), cos(theta)), axis=-1)
+    XX = np.stack((-cos(psi)*sin(gra) - sin(psi)*cos(gra)*sin(dec), -cos(psi)*cos(gra) + sin(psi)*sin(gra)*sin(dec), sin(psi)*cos(dec)), axis=-1)
+    YY = np.stack(( sin(psi)*sin(gra) - cos(psi)*cos(gra)*sin(dec),  sin(psi)*cos(gra) + cos(psi)*sin(gra)*sin(dec), cos(psi)*cos(dec)), axis=-1)
+
+    if D.ndim == 2:
+        XD = np.einsum('...i,ij->...j', XX, D)
+        YD = np.einsum('...i,ij->...j', YY, D)
+        Fp = 0.5 * (np.einsum('...j,...j->...', XD, XX) - np.einsum('...j,...j->...', YD, YY))
+        Fc = 0.5 * (np.einsum('...j,...j->...', XD, YY) + np.einsum('...j,...j->...', YD, XX))
+        rd = np.einsum('...i,i->...', r, d)
+    else:
+        XD = np.einsum('...i,dij->d...j', XX, D)
+        YD = np.einsum('...i,dij->d...j', YY, D)
+        Fp = 0.5 * (np.einsum('d...j,...j->d...', XD, XX) - np.einsum('d...j,...j->d...', YD, YY))
+        Fc = 0.5 * (np.einsum('d...j,...j->d...', XD, YY) + np.einsum('d...j,...j->d...', YD, XX))
+        rd = np.einsum('...i,di->d...', r, d)
+
+    # [()] turns 0-d arrays back into scalars for scalar sky positions
+    return Fp[()], Fc[()], exp(1j * 2*PI * f * rd)
+
+def antenna_pattern_and_loc_phase_fac_derivs(f,Mc,tc,ra,dec,psi,gmst0,loc,use_rot):
+    # input:    as antenna_pattern_and_loc_phase_fac for a single location loc
+    #
+    # output:   Fp, Fc, Flp   as antenna_pattern_and_loc_phase_fac
+    #           del_ap        dict(x=(del_x_Fp, del_x_Fc, del_x_Flp)) of the analytic derivatives for x in Mc, tc, ra, dec, psi,
+    #                         Mc and tc only enter through the rotation of the earth
+
+    half_period = 4.32e4
+    R = REarth
+
+    D, d = det_ten_and_loc_vec(loc, R)
 
+    if use_rot:
+        tf = tc - (5./256.)*(time_fac*Mc)**(-5./3.)*(PI*f)**(-8./3.)
     else:
-        r = np.array((cos(gra) * sin(theta), sin(gra) * sin(theta), cos(theta)))
-        XX = np.transpose(np.array([ -cos(psi)*sin(gra) - sin(psi)*cos(gra)*sin(dec), -cos(psi)*cos(gra) + sin(psi)*sin(gra)*sin(dec), sin(psi)*cos(dec) ]))
-        YY = np.transpose(np.array([  sin(psi)*sin(gra) - cos(psi)*cos(gra)*sin(dec),  sin(psi)*cos(gra) + cos(psi)*sin(gra)*sin(dec), cos(psi)*cos(dec) ]))
-        Fp = 0.5 * (np.matmul(np.matmul(XX,D),XX) - np.matmul(np.matmul(YY,D),YY))
-        Fc = 0.5 * (np.matmul(np.matmul(XX,D),YY) + np.matmul(np.matmul(YY,D),XX))
+        tf = 0
+
+    gra = (gmst0 + tf*PI/half_period) - ra
+    gra, dec, psi = np.broadcast_arrays(gra, dec, psi)
+    theta = PI/2. - dec
+
+    cg, sg = cos(gra), sin(gra)
+    cd, sd = cos(dec), sin(dec)
+    cp, sp = cos(psi), sin(psi)
+    zero = np.zeros_like(gra)
+
+    # unit vectors along the last axis and their derivatives w.r.t. gra and dec, d/dpsi XX = YY and d/dpsi YY = -XX
+    r       = np.stack((cg * sin(theta), sg * sin(theta), cos(theta)), axis=-1)
+    r_gra   = np.stack((-sg * sin(theta), cg * sin(theta), zero), axis=-1)
+    r_dec   = np.stack((-cg * cos(theta), -sg * cos(theta), sin(theta)), axis=-1)
+    XX      = np.stack((-cp*sg - sp*cg*sd, -cp*cg + sp*sg*sd, sp*cd), axis=-1)
+    XX_gra  = np.stack((-cp*cg + sp*sg*sd,  cp*sg + sp*cg*sd, zero), axis=-1)
+    XX_dec  = np.stack((-sp*cg*cd, sp*sg*cd, -sp*sd), axis=-1)
+    YY      = np.stack(( sp*sg - cp*cg*sd,  sp*cg + cp*sg*sd, cp*cd), axis=-1)
+    YY_gra  = np.stack(( sp*cg + cp*sg*sd, -sp*sg + cp*cg*sd, zero), axis=-1)
+    YY_dec  = np.stack((-cp*cg*cd, cp*sg*cd, -cp*sd), axis=-1)
+
+    dot = lambda a, b: np.einsum('...j,...j->...', a, b)
+    XD = np.einsum('...i,ij->...j', XX, D)
+    YD = np.einsum('...i,ij->...j', YY, D)
+    Fp = 0.5 * (dot(XD, XX) - dot(YD, YY))
+    Fc = 0.5 * (dot(XD, YY) + dot(YD, XX))
+    Flp = exp(1j * 2*PI * f * np.einsum('...i,i->...', r, d))
+
+    # D is symmetric: d/dx Fp = XX D d/dx XX - YY D d/dx YY and d/dx Fc = YY D d/dx XX + XX D d/dx YY
+    del_gra = (dot(XD, XX_gra) - dot(YD, YY_gra), dot(YD, XX_gra) + dot(XD, YY_gra), 1j * 2*PI * f * np.einsum('...i,i->...', r_gra, d) * Flp)
+    del_dec = (dot(XD, XX_dec) - dot(YD, YY_dec), dot(YD, XX_dec) + dot(XD, YY_dec), 1j * 2*PI * f * np.einsum('...i,i->...', r_dec, d) * Flp)
+
+    del_ap = {}
+    if use_rot:
+        del_ap['Mc'] = tuple((PI/half_period) * (-5./3.) * (tf - tc)/Mc * el for el in del_gra)
+        del_ap['tc'] = tuple((PI/half_period) * el for el in del_gra)
+    else:
+        del_ap['Mc'] = (0., 0., 0.)
+        del_ap['tc'] = (0., 0., 0.)
+    del_ap['ra'] = tuple(-el for el in del_gra)
+    del_ap['dec'] = del_dec
+    del_ap['psi'] = (2. * Fc, -2. * Fp, 0.)
+
+    return Fp[()], Fc[()], Flp, del_ap
 
-    return Fp, Fc, exp(1j * 2*PI * f * np.matmul(d,r))
+#-----detector tensors and location vectors, cached per location-----
+det_ten_and_loc_vec_cache = {}
 
 def det_ten_and_loc_vec(loc, R):
+    if (loc, R) not in det_ten_and_loc_vec_cache:
+        D, d = calc_det_ten_and_loc_vec(loc, R)
+        D.flags.writeable = False
+        d.flags.writeable = False
+        det_ten_and_loc_vec_cache[(loc, R)] = (D, d)
+    return det_ten_and_loc_vec_cache[(loc, R)]
+
+def stacked_det_ten_and_loc_vec(locs, R):
+    Ds, ds = zip(*[det_ten_and_loc_vec(loc, R) for loc in locs])
+    return np.stack(Ds), np.stack(ds)
+
+def calc_det_ten_and_loc_vec(loc, R):
     i_vec = np.array((1,0,0))
     j_vec = np.array((0,1,0))
     k_vec = np.array((0,0,1))
@@ -0,0 +1,136 @@
+# Copyright (C) 2020  Ssohrab Borhanian
+# 
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+# 
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+
+import os
+from collections import OrderedDict
+from hashlib import sha1
+
+import astropy
+import astropy.cosmology as apcosm
+import numpy as np
+from scipy.interpolate import CubicSpline
+
+cosmology_tables_cache_path = os.path.join(os.path.dirname(os.path.abspath(__file__)),'cosmology_tables_cache')
+
+PI = np.pi
+
+###
+#-----cosmologies-----
+def get_cosmology(H0=None,Om0=None,Ode0=None):
+    if None in (H0,Om0,Ode0): return apcosm.Planck18
+    else:                     return apcosm.LambdaCDM(H0=H0, Om0=Om0, Ode0=Ode0)
+
+###
+#-----vectorised lookups, D_L in Mpc and V_c, dV_c/dz over the whole sky in Mpc^3-----
+def luminosity_distance(z, cosmo=apcosm.Planck18):
+    return loglog_eval(cosmology_table(cosmo)['DL'], z)
+
+def differential_comoving_volume(z, cosmo=apcosm.Planck18):
+    return loglog_eval(cosmology_table(cosmo)['dVc_dz'], z)
+
+def comoving_volume(z, cosmo=apcosm.Planck18):
+    return loglog_eval(cosmology_table(cosmo)['Vc'], z)
+
+def redshift_at_luminosity_distance(DL, cosmo=apcosm.Planck18):
+    return loglog_eval(cosmology_table(cosmo)['z_of_DL'], DL)
+
+def redshift_at_comoving_volume(Vc, cosmo=apcosm.Planck18):
+    return loglog_eval(cosmology_table(cosmo)['z_of_Vc'], Vc)
+
+def loglog_eval(spline, x):
+    # all tabulated functions vanish at 0 and are splined in log-log where they are close to power laws
+    x = np.asarray(x, dtype=float)
+    res = np.zeros(x.shape)
+    ids = x > 0
+    res[ids] = np.exp(spline(np.log(x[ids])))
+    if res.ndim == 0: return float(res)
+    return res
+
+###
+#-----spline tables-----
+# dense tables in log(z) from table_zmin to table_zmax, below table_zmin the splines are extrapolated along the
+# low-redshift power laws D_L ~ z, dV_c/dz ~ z^2, V_c ~ z^3
+table_zmin = 1e-6
+table_zmax = 1e3
+table_nzs  = 4001
+
+# dict(repr(cosmo)=dict(function name=CubicSpline)), astropy cosmologies are not hashable
+cosmology_table_cache = OrderedDict()
+cosmology_table_cache_maxsize = 8
+
+def cosmology_table(cosmo=apcosm.Planck18):
+    cache_key = repr(cosmo)
+    if cache_key in cosmology_table_cache:
+        cosmology_table_cache.move_to_end(cache_key)
+        return cosmology_table_cache[cache_key]
+
+    log_z, log_DL, log_dVc_dz, log_Vc = read_cosmology_table(cosmo)
+    table = {'DL':      CubicSpline(log_z, log_DL),
+             'dVc_dz':  CubicSpline(log_z, log_dVc_dz),
+             'Vc':      CubicSpline(log_z, log_Vc),
+             'z_of_DL': CubicSpline(log_DL, log_z),
+             'z_of_Vc': CubicSpline(log_Vc, log_z)}
+    cosmology_table_cache[cache_key] = table
+    if len(cosmology_table_cache) > cosmology_table_cache_maxsize: cosmology_table_cache.popitem(last=False)
+    return table
+
+def tabulate_cosmology(cosmo=apcosm.Planck18):
+    zs = np.geomspace(table_zmin, table_zmax, table_nzs)
+    return np.array([np.log(zs),
+                     np.log(cosmo.luminosity_distance(zs).value),
+                     np.log(4.*PI*cosmo.differential_comoving_volume(zs).value),
+                     np.log(cosmo.comoving_volume(zs).value)])
+
+def read_cosmology_table(cosmo=apcosm.Planck18):
+    # astropy integrates the distances for every redshift, keep the table in cosmology_tables_cache_path for later runs
+    table_id = f'{repr(cosmo)} {table_zmin} {table_zmax} {table_nzs} {astropy.__version__}'
+    cache_file = os.path.join(cosmology_tables_cache_path, sha1(table_id.encode()).hexdigest()[:16] + '.npy')
+    if os.path.isfile(cache_file):
+        try:
+            return np.load(cache_file)
+        except (OSError, ValueError):
+            pass
+
+    table = tabulate_cosmology(cosmo)
+    try:
+        os.makedirs(cosmology_tables_cache_path, exist_ok=True)
+        # write to a temporary file and rename so that concurrent processes never read a partial cache file
+        tmp_file = f'{cache_file}.{os.getpid()}.tmp'
+        with open(tmp_file, 'wb') as fi:
+            np.save(fi, table)
+        os.replace(tmp_file, cache_file)
+    except OSError:
+        pass
+    return table
+
+def clear_cosmology_caches():
+    cosmology_table_cache.clear()
+
+###
+#-----accuracy of the tables against astropy-----
+def max_rel_errors(cosmo=apcosm.Planck18, zmin=1e-4, zmax=100, nzs=10007, seed=None):
+    # off-grid redshifts, relative errors of the lookups and of the round trips through the inverses
+    rng = np.random.default_rng(seed)
+    zs = np.sort(np.exp(rng.uniform(np.log(zmin), np.log(zmax), nzs)))
+    DL = cosmo.luminosity_distance(zs).value
+    Vc = cosmo.comoving_volume(zs).value
+    rel_err = lambda a, b: np.max(np.abs(a/b - 1))
+    return {'DL':      rel_err(luminosity_distance(zs, cosmo), DL),
+            'dVc_dz':  rel_err(differential_comoving_volume(zs, cosmo), 4.*PI*cosmo.differential_comoving_volume(zs).value),
+            'Vc':      rel_err(comoving_volume(zs, cosmo), Vc),
+            'z_of_DL': rel_err(redshift_at_luminosity_distance(DL, cosmo), zs),
+            'z_of_Vc': rel_err(redshift_at_comoving_volume(Vc, cosmo), zs)}
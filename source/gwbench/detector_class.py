@@ -132,16 +132,20 @@ class Detector:
         self.del_hf, c_quants = get_conv_del_eval_dic(self.del_hf, inj_params, conv_cos, conv_log, deriv_symbs_string)
         inj_params, deriv_variables = get_conv_inj_params_deriv_variables(c_quants, inj_params, deriv_variables)
 
+    def calc_det_responses_derivs_ana(self, inj_params, deriv_variables, wf, deriv_symbs_string, conv_cos, conv_log, use_rot, hfpc_derivs=None):
+        print(' ',self.det_key)
+        self.calc_det_responses(wf,inj_params)
+        self.del_hf = drd.calc_det_responses_derivs_ana(self.loc,wf,deriv_symbs_string,self.f,inj_params,use_rot,'hf',hfpc_derivs)
+        self.del_hf, c_quants = get_conv_del_eval_dic(self.del_hf, inj_params, conv_cos, conv_log, deriv_symbs_string)
+        inj_params, deriv_variables = get_conv_inj_params_deriv_variables(c_quants, inj_params, deriv_variables)
+
     def load_det_responses_derivs_sym(self, wf_model_name, deriv_symbs_string, return_bin=0, user_lambdified_functions_path=None):
         self.del_hf_expr = drd.load_det_responses_derivs_sym(self.loc, wf_model_name, deriv_symbs_string, return_bin, user_lambdified_functions_path)
 
     def calc_det_responses_derivs_sym(self, wf, inj_params, deriv_variables, conv_cos, conv_log, deriv_symbs_string):
         print(' ',self.det_key)
         self.calc_det_responses(wf,inj_params)
-        self.del_hf = {}
-        for deriv in self.del_hf_expr:
-            if deriv in ('variables','deriv_variables'): continue
-            self.del_hf[deriv] = self.del_hf_expr[deriv](self.f, **bfs.get_sub_dict(inj_params, self.del_hf_expr['variables']))
+        self.del_hf = drd.eval_det_responses_derivs_sym(self.del_hf_expr, self.f, inj_params)
 
         self.del_hf, c_quants = get_conv_del_eval_dic(self.del_hf, inj_params, conv_cos, conv_log, deriv_symbs_string)
         inj_params, deriv_variables = get_conv_inj_params_deriv_variables(c_quants, inj_params, deriv_variables)
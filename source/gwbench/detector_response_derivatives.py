@@ -15,10 +15,15 @@
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
 
+from hashlib import sha1
+from multiprocessing import Pool
+import fcntl
+import inspect
 import os
 import sys
 
 import dill
+import sympy
 
 import gwbench.antenna_pattern_np as ant_pat_np
 import gwbench.antenna_pattern_sp as ant_pat_sp
@@ -28,6 +33,11 @@ import gwbench.wf_derivatives_sym as wfd_sym
 
 lambdified_functions_path = os.path.join(os.getcwd(),'lambdified_functions')
 ant_pat_symbs_string = 'f Mc tc ra dec psi gmst0'
+# waveform models whose numpy functions broadcast over stacked parameters, the perturbed points of their numerical
+# derivatives are evaluated in one call (the lal models call lalsimulation for one parameter point at a time)
+stackable_wf_models = ('tf2', 'tf2_tidal')
+# waveform models with analytic derivatives of their polarizations, see wf_class.select_wf_model_derivs_np
+analytic_wf_models = ('tf2', 'tf2_tidal')
 
 
 def calc_det_responses_derivs_num(loc, wf, deriv_symbs_string, f_arr, params_dic, use_rot=1, label='hf', step=1e-9, method='central', order=2, n=1):
@@ -49,7 +59,7 @@ def calc_det_responses_derivs_num(loc, wf, deriv_symbs_string, f_arr, params_dic
                 wf_list.append(wf_params_list[wf_symbs_list.index(el)])
             return wf.eval_np_func(f_arr, wf_list)
 
-        return wfd_num.part_deriv_hf_func(pc_func, wf_symbs_list, deriv_symbs_list, f_arr, params_dic, pl_cr=1, compl=1, label=label, step=step, method=method, order=order, n=n)
+        return wfd_num.part_deriv_hf_func(pc_func, wf_symbs_list, deriv_symbs_list, f_arr, params_dic, pl_cr=1, compl=1, label=label, step=step, method=method, order=order, n=n, stack_evals=wf.wf_model_name in stackable_wf_models)
 
     else:
         ap_symbs_list = ant_pat_symbs_string.split(' ')
@@ -73,16 +83,69 @@ def calc_det_responses_derivs_num(loc, wf, deriv_symbs_string, f_arr, params_dic
 
             return Flp * (hfp * Fp + hfc * Fc)
 
-        return wfd_num.part_deriv_hf_func(dr_func, dr_symbs_list, deriv_symbs_list, f_arr, params_dic, pl_cr=0, compl=1, label=label, step=step, method=method, order=order, n=n)
-
-
-
-def generate_det_responses_derivs_sym(wf,deriv_symbs_string,locs=None,use_rot=1,user_lambdified_functions_path=None):
-
-    hfpc = wf.get_sp_expr()
-
-    responses = {}
-    responses['pl_cr'] = hfpc
+        return wfd_num.part_deriv_hf_func(dr_func, dr_symbs_list, deriv_symbs_list, f_arr, params_dic, pl_cr=0, compl=1, label=label, step=step, method=method, order=order, n=n, stack_evals=wf.wf_model_name in stackable_wf_models)
+
+
+
+#-----factorised derivatives: the polarizations are differentiated once and combined with the antenna patterns of each location-----
+def calc_wf_polarizations_derivs_ana(wf, deriv_symbs_string, f_arr, params_dic):
+    # polarizations and their derivatives w.r.t. the waveform parameters in deriv_symbs_string, independent of the location
+    wf_deriv_symbs_string = bfs.remove_symbols(deriv_symbs_string,wf.wf_symbs_string)
+    return wf.eval_np_derivs(f_arr, bfs.get_sub_dict(params_dic,wf.wf_symbs_string), wf_deriv_symbs_string)
+
+def calc_wf_polarizations_derivs_num(wf, deriv_symbs_string, f_arr, params_dic, step=1e-9, method='central', order=2, n=1):
+    wf_deriv_symbs_string = bfs.remove_symbols(deriv_symbs_string,wf.wf_symbs_string)
+    hfp, hfc = wf.eval_np_func(f_arr, bfs.get_sub_dict(params_dic,wf.wf_symbs_string))
+    if not wf_deriv_symbs_string:
+        return hfp, hfc, {}
+    return hfp, hfc, calc_det_responses_derivs_num(None, wf, wf_deriv_symbs_string, f_arr, params_dic, label='hf', step=step, method=method, order=order, n=n)
+
+def calc_wf_polarizations_derivs_sym(wf, deriv_symbs_string, f_arr, params_dic, user_lambdified_functions_path=None):
+    # only needs the 'pl_cr' file of the lambdified functions
+    wf_deriv_symbs_string = bfs.remove_symbols(deriv_symbs_string,wf.wf_symbs_string)
+    hfp, hfc = wf.eval_np_func(f_arr, bfs.get_sub_dict(params_dic,wf.wf_symbs_string))
+    if not wf_deriv_symbs_string:
+        return hfp, hfc, {}
+    del_hfpc_expr = load_det_responses_derivs_sym('pl_cr', wf.wf_model_name, wf_deriv_symbs_string, user_lambdified_functions_path=user_lambdified_functions_path)
+    return hfp, hfc, eval_det_responses_derivs_sym(del_hfpc_expr, f_arr, params_dic)
+
+def calc_det_responses_derivs_fact(loc, deriv_symbs_string, f_arr, params_dic, hfpc_derivs, use_rot=1, label='hf'):
+    # product rule of the derivatives of the polarizations (hfpc_derivs from one of calc_wf_polarizations_derivs_ana/num/sym,
+    # shared between locations) and of the analytic derivatives of the antenna patterns and location phase factor
+    hfp, hfc, del_hfpc = hfpc_derivs
+
+    Fp, Fc, Flp, del_ap = ant_pat_np.antenna_pattern_and_loc_phase_fac_derivs(f_arr, params_dic['Mc'], params_dic['tc'], params_dic['ra'], params_dic['dec'],
+                                                                              params_dic['psi'], params_dic['gmst0'], loc, use_rot)
+    hf_pol = Fp * hfp + Fc * hfc
+
+    del_hf = {}
+    for name in deriv_symbs_string.split(' '):
+        if name == 'f': continue
+        if 'del_'+name+'_hfp' not in del_hfpc and name not in del_ap:
+            exit_str = ('!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!\n' +
+                       f'No factorised derivative of the detector response w.r.t.: {name}\n' +
+                        '!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!')
+            sys.exit(exit_str)
+        del_name = 0.
+        if 'del_'+name+'_hfp' in del_hfpc:
+            del_name = Flp * (Fp * del_hfpc['del_'+name+'_hfp'] + Fc * del_hfpc['del_'+name+'_hfc'])
+        if name in del_ap:
+            del_Fp, del_Fc, del_Flp = del_ap[name]
+            del_name = del_name + del_Flp * hf_pol + Flp * (del_Fp * hfp + del_Fc * hfc)
+        del_hf['del_'+name+'_'+label] = del_name
+
+    return del_hf
+
+def calc_det_responses_derivs_ana(loc, wf, deriv_symbs_string, f_arr, params_dic, use_rot=1, label='hf', hfpc_derivs=None):
+    if hfpc_derivs is None:
+        hfpc_derivs = calc_wf_polarizations_derivs_ana(wf, deriv_symbs_string, f_arr, params_dic)
+    return calc_det_responses_derivs_fact(loc, deriv_symbs_string, f_arr, params_dic, hfpc_derivs, use_rot, label)
+
+
+def generate_det_responses_derivs_sym(wf,deriv_symbs_string,locs=None,use_rot=1,user_lambdified_functions_path=None,num_cores=None,only_missing=0,cse=0):
+    # only_missing skips the files whose inputs hash matches, num_cores generates the files of several locations in parallel,
+    # cse stores one function per file that evaluates all derivatives from their common subexpressions (see eval_det_responses_derivs_sym),
+    # returns the list of keys ('pl_cr' and locations) that were generated
 
     if locs is None:
         locs = ant_pat_np.locs
@@ -93,47 +156,101 @@ def generate_det_responses_derivs_sym(wf,deriv_symbs_string,locs=None,use_rot=1,
                           f'Specified location not known in antenna pattern module: {loc}\n'+
                            '!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!')
                 sys.exit(exit_str) 
-                
-    for loc in locs:
-        responses[loc] = ant_pat_sp.detector_response_expr(hfpc[0],hfpc[1],loc,use_rot)
 
-    for key in responses.keys():
+    if user_lambdified_functions_path is None:
+        output_path = lambdified_functions_path
+    else:
+        output_path = os.path.join(user_lambdified_functions_path,'lambdified_functions')
+    os.makedirs(output_path, exist_ok=True)
+
+    keys = list(locs)
+    if bfs.remove_symbols(deriv_symbs_string,wf.wf_symbs_string):
+        keys.insert(0, 'pl_cr')
+    if only_missing:
+        keys = [key for key in keys if not lambdified_functions_up_to_date(wf,deriv_symbs_string,key,use_rot,output_path,cse=cse)]
+
+    arg_tuple_list = [(wf,deriv_symbs_string,key,use_rot,output_path,only_missing,cse) for key in keys]
+    if num_cores is None or len(keys) < 2:
+        generated = [generate_det_responses_derivs_sym_for_key(*arg_tuple) for arg_tuple in arg_tuple_list]
+    else:
+        with Pool(min(num_cores, len(keys))) as pool:
+            generated = pool.starmap(generate_det_responses_derivs_sym_for_key, arg_tuple_list)
+
+    # drop stale functions deserialised before the files were regenerated
+    clear_lambdified_functions_cache()
+    print('Done.')
+    return [key for key, gen in zip(keys, generated) if gen]
+
+def generate_det_responses_derivs_sym_for_key(wf,deriv_symbs_string,key,use_rot,output_path,only_missing=0,cse=0):
+    # one file, key is 'pl_cr' for the polarizations or a location, returns whether the file was (re-)generated
+    file_name = os.path.join(output_path, lambdified_functions_file_name(wf, deriv_symbs_string, key))
+    inputs_hash = lambdified_functions_inputs_hash(wf, deriv_symbs_string, key, use_rot, cse)
+
+    # concurrent tasks wait for the one writer and then find the file up to date
+    with open(file_name + '.lock', 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        if only_missing and lambdified_functions_up_to_date(wf, deriv_symbs_string, key, use_rot, output_path, inputs_hash, cse):
+            return False
+
+        hfpc = wf.get_sp_expr()
         if key == 'pl_cr':
             print('Calculating the derivatives of the plus/cross polarizations.')
             wf_deriv_symbs_string = bfs.remove_symbols(deriv_symbs_string,wf.wf_symbs_string)
-            if not wf_deriv_symbs_string: continue
-            deriv_dic = wfd_sym.part_deriv_hf_expr(responses[key],wf.wf_symbs_string,wf_deriv_symbs_string,pl_cr=1)
+            deriv_dic = wfd_sym.part_deriv_hf_expr(hfpc,wf.wf_symbs_string,wf_deriv_symbs_string,pl_cr=1,cse=cse)
             deriv_dic['variables'] = wf.wf_symbs_string
             deriv_dic['deriv_variables'] = wf_deriv_symbs_string
-
-            file_name = 'par_deriv_WFM_'+wf.wf_model_name+'_VAR_'+wf_deriv_symbs_string.replace(' ', '_')+'_DET_'+key+'.dat'
-
         else:
             print('Calculating the derivatives of the detector response for detector: ' + key)
+            response = ant_pat_sp.detector_response_expr(hfpc[0],hfpc[1],key,use_rot)
             symbols_string = bfs.reduce_symbols_strings(wf.wf_symbs_string,ant_pat_symbs_string)
-            deriv_dic = wfd_sym.part_deriv_hf_expr(responses[key],symbols_string,deriv_symbs_string)
+            deriv_dic = wfd_sym.part_deriv_hf_expr(response,symbols_string,deriv_symbs_string,cse=cse)
             deriv_dic['variables'] = symbols_string
             deriv_dic['deriv_variables'] = deriv_symbs_string
 
-            file_name = 'par_deriv_WFM_'+wf.wf_model_name+'_VAR_'+deriv_symbs_string.replace(' ', '_')+'_DET_'+key+'.dat'
-
-        if user_lambdified_functions_path is None:
-            output_path = lambdified_functions_path
-        else:
-            output_path = os.path.join(user_lambdified_functions_path,'lambdified_functions')
-
-        if not os.path.exists(output_path):
-            os.makedirs(output_path)
-
-        file_name = os.path.join(output_path,file_name)
-        with open(file_name, "wb") as fi:
+        # write to temporary files and rename so that readers never see a partial file, the hash last
+        tmp_file = f'{file_name}.{os.getpid()}.tmp'
+        with open(tmp_file, 'wb') as fi:
             dill.dump(deriv_dic, fi, recurse=True)
+        os.replace(tmp_file, file_name)
+        with open(tmp_file, 'w') as fi:
+            fi.write(inputs_hash)
+        os.replace(tmp_file, file_name + '.sha1')
+    return True
+
+def lambdified_functions_file_name(wf, deriv_symbs_string, key):
+    if key == 'pl_cr':
+        deriv_symbs_string = bfs.remove_symbols(deriv_symbs_string,wf.wf_symbs_string)
+    return 'par_deriv_WFM_'+wf.wf_model_name+'_VAR_'+deriv_symbs_string.replace(' ', '_')+'_DET_'+key+'.dat'
+
+def lambdified_functions_inputs_hash(wf, deriv_symbs_string, key, use_rot, cse=0):
+    # everything the expressions depend on: the settings (use_rot and cse are not part of the file name, cse=1 always stores
+    # the single function of wfd_sym.lambdify_cse), the source of the sympy modules and the sympy version that lambdifies them
+    inputs = [wf.wf_model_name, repr(wf.wf_other_var_dic), deriv_symbs_string, key, repr(int(use_rot)), sympy.__version__]
+    if cse:
+        inputs.append('cse')
+    for module in (sys.modules[wf.hfpc_sp.__module__], ant_pat_sp, wfd_sym):
+        inputs.append(inspect.getsource(module))
+    return sha1('\0'.join(inputs).encode()).hexdigest()
+
+def lambdified_functions_up_to_date(wf, deriv_symbs_string, key, use_rot, output_path, inputs_hash=None, cse=0):
+    file_name = os.path.join(output_path, lambdified_functions_file_name(wf, deriv_symbs_string, key))
+    if inputs_hash is None:
+        inputs_hash = lambdified_functions_inputs_hash(wf, deriv_symbs_string, key, use_rot, cse)
+    try:
+        with open(file_name + '.sha1') as fi:
+            return os.path.isfile(file_name) and fi.read() == inputs_hash
+    except FileNotFoundError:
+        return False
 
-    print('Done.')
-    return
 
+# deserialised lambdified functions, loaded once per process, dict((wf_model_name,deriv_symbs_string,det_name,path)=del_hf_expr)
+lambdified_functions_cache = {}
 
 def load_det_responses_derivs_sym(det_name, wf_model_name, deriv_symbs_string, return_bin=0, user_lambdified_functions_path=None):
+    cache_key = (wf_model_name, deriv_symbs_string, det_name, user_lambdified_functions_path)
+    if not return_bin and cache_key in lambdified_functions_cache:
+        return lambdified_functions_cache[cache_key]
+
     file_name = 'par_deriv_WFM_'+wf_model_name+'_VAR_'+deriv_symbs_string.replace(' ', '_')+'_DET_'+det_name+'.dat'
     if user_lambdified_functions_path is None:
         file_name = os.path.join(lambdified_functions_path,file_name)
@@ -145,9 +262,26 @@ def load_det_responses_derivs_sym(det_name, wf_model_name, deriv_symbs_string, r
             if return_bin:
                 return fi.read()
             else:
-                return dill.load(fi)
+                lambdified_functions_cache[cache_key] = dill.load(fi)
+                return lambdified_functions_cache[cache_key]
     except FileNotFoundError:
         exit_str = ('!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!\n' + 
                    f'Could not find the lambdified function file: {file_name}\n' +
                     '!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!')
         sys.exit(exit_str) 
+
+def preload_det_responses_derivs_sym(locs, wf_model_name, deriv_symbs_string, user_lambdified_functions_path=None):
+    # e.g. as the initializer of worker processes, so that each file is deserialised once per worker
+    for loc in locs:
+        load_det_responses_derivs_sym(loc, wf_model_name, deriv_symbs_string, user_lambdified_functions_path=user_lambdified_functions_path)
+
+def clear_lambdified_functions_cache():
+    lambdified_functions_cache.clear()
+
+def eval_det_responses_derivs_sym(del_hf_expr, f_arr, params_dic):
+    # evaluate the loaded lambdified functions, either one function per derivative or one function for all of them (cse)
+    params_dic = bfs.get_sub_dict(params_dic, del_hf_expr['variables'])
+    if 'all_derivs' in del_hf_expr:
+        return dict(zip(del_hf_expr['deriv_keys'], del_hf_expr['all_derivs'](f_arr, **params_dic)))
+    else:
+        return {deriv:del_hf_expr[deriv](f_arr, **params_dic) for deriv in del_hf_expr if deriv not in ('variables','deriv_variables')}
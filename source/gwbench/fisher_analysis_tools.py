@@ -20,20 +20,31 @@ import numpy as np
 import gwbench.snr as snr_mod
 
 def calc_fisher_cov_matrices(del_hf_list,psd,f,only_fisher=0,df=None,cond_sup=1e15):
-    n = len(del_hf_list)
-    fisher = np.zeros((n,n))
-
-    for i in np.arange(n):
-        fisher[i,i] = snr_mod.scalar_product_freq_array(del_hf_list[i],del_hf_list[i],psd,f,df)
-        for j in np.arange(i+1,n):
-           fisher[i,j] = snr_mod.scalar_product_freq_array(del_hf_list[i],del_hf_list[j],psd,f,df)
-           fisher[j,i] = fisher[i,j]
+    fisher = calc_fisher_matrix(del_hf_list,psd,f,df)
+    # skip the conditioning and inversion if only the Fisher matrix is wanted, e.g. for the detectors of a network
+    if only_fisher:
+        return fisher, None, None, None
 
     wc_fisher, cond_num = check_well_conditioned(fisher,cond_sup)
-    # return cov=None, if Fisher not well conditioned OR if we only fisher is wanted
-    cov = calc_cov_from_fisher(fisher,(wc_fisher and not only_fisher))
+    # return cov=None, if Fisher not well conditioned
+    cov = calc_cov_from_fisher(fisher,wc_fisher)
     return fisher, cov, wc_fisher, cond_num
 
+def calc_fisher_matrix(del_hf_list,psd,f,df=None):
+    # Gram matrix of the derivatives, shape (n_param, n_freq), under the weighted inner product: one BLAS call
+    del_hf_arr = np.asarray(del_hf_list)
+    return calc_fisher_matrix_weighted(del_hf_arr,snr_mod.inner_prod_weights(psd,f,df))
+
+def calc_fisher_matrix_weighted(del_hf_arr,weights):
+    # del_hf_arr has shape (..., n_param, n_freq), e.g. stacked over injections, returns shape (..., n_param, n_param)
+    fisher = 4. * np.real(np.matmul(del_hf_arr * weights, np.conj(np.swapaxes(del_hf_arr,-1,-2))))
+    # symmetric up to round-off, enforce it like the explicit loop over the upper triangle did
+    return 0.5 * (fisher + np.swapaxes(fisher,-1,-2))
+
+def calc_cond_numbers_stacked(fishers):
+    EWs = np.abs(np.linalg.eigvals(fishers))
+    return np.amax(EWs,axis=-1)/np.amin(EWs,axis=-1)
+
 def calc_cond_number(fisher):
     EWs,_ = np.linalg.eig(fisher)
     return np.amax(np.abs(EWs))/np.amin(np.abs(EWs))
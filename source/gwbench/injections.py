@@ -17,15 +17,16 @@
 
 import os
 import warnings
+from collections import OrderedDict
 from copy import copy
 
-import astropy.cosmology as apcosm
 import numpy as np
 from scipy.integrate import quad, simps
 from scipy.interpolate import interp1d
 from scipy.optimize import minimize_scalar
 
 import gwbench.basic_relations as brs
+import gwbench.cosmology as cosmology
 
 PI = np.pi
 
@@ -201,19 +202,11 @@ def mass_sampler(mass_dict,num_injs,seed):
         m1_m2 = 1
 
         nm1s = 5001
-        m1s = np.linspace(mmin,mmax,nm1s)
-        power_part = (1 - peak_frac) * power(m1s, -m1_alpha) / simps(power(m1s, -m1_alpha),m1s)
-        gauss_part = peak_frac * gaussian(m1s, peak_mean, peak_sigma) / simps(gaussian(m1s, peak_mean, peak_sigma),m1s)
-        m1_dist = (power_part + gauss_part) * smoothing(m1s,mmin,delta_m)
-        window_cdf = np.array([simps(m1_dist[:i],m1s[:i]) for i in range(1,len(m1s)+1)]) / simps(m1_dist,m1s)
-        inv_window_cdf = interp1d(window_cdf, m1s)
+        inv_window_cdf = power_peak_inverse_cdf(mmin,mmax,m1_alpha,peak_frac,peak_mean,peak_sigma,delta_m,nm1s)
         m1_vec = inv_window_cdf(rngs[0].random(num_injs))
 
         nqs = nm1s
-        qs = np.linspace(qmin,qmax,nqs)
-        q_dist = power(qs, q_beta) / simps(power(qs, q_beta),qs)
-        window_cdf = np.array([simps(q_dist[:i],qs[:i]) for i in range(1,len(qs)+1)]) / simps(q_dist,qs)
-        inv_window_cdf = interp1d(window_cdf, qs)
+        inv_window_cdf = inverse_cdf(('power',qmin,qmax,q_beta,nqs), qmin, qmax, nqs, lambda qs: power(qs, q_beta))
         q_vec = inv_window_cdf(rngs[1].random(num_injs))
 
         m2_vec = q_vec * m1_vec
@@ -229,12 +222,7 @@ def mass_sampler(mass_dict,num_injs,seed):
         m1_m2 = 1
 
         nm1s = 5001
-        m1s = np.linspace(mmin,mmax,nm1s)
-        power_part = (1 - peak_frac) * power(m1s, -m1_alpha) / simps(power(m1s, -m1_alpha),m1s)
-        gauss_part = peak_frac * gaussian(m1s, peak_mean, peak_sigma) / simps(gaussian(m1s, peak_mean, peak_sigma),m1s)
-        m1_dist = (power_part + gauss_part) * smoothing(m1s,mmin,delta_m)
-        window_cdf = np.array([simps(m1_dist[:i],m1s[:i]) for i in range(1,len(m1s)+1)]) / simps(m1_dist,m1s)
-        inv_window_cdf = interp1d(window_cdf, m1s)
+        inv_window_cdf = power_peak_inverse_cdf(mmin,mmax,m1_alpha,peak_frac,peak_mean,peak_sigma,delta_m,nm1s)
         m1_vec = inv_window_cdf(rngs[0].random(num_injs))
 
         m2_vec = rngs[1].uniform(mmin,m1_vec)
@@ -279,6 +267,13 @@ def make_m1_m2(m1,m2,vec=1):
             return m1, m2
 
 #-----power-peak helpers-----
+def power_peak_inverse_cdf(mmin, mmax, m1_alpha, peak_frac, peak_mean, peak_sigma, delta_m, nm1s=5001):
+    def m1_dist(m1s):
+        power_part = (1 - peak_frac) * power(m1s, -m1_alpha) / simps(power(m1s, -m1_alpha),m1s)
+        gauss_part = peak_frac * gaussian(m1s, peak_mean, peak_sigma) / simps(gaussian(m1s, peak_mean, peak_sigma),m1s)
+        return (power_part + gauss_part) * smoothing(m1s,mmin,delta_m)
+    return inverse_cdf(('power_peak',mmin,mmax,m1_alpha,peak_frac,peak_mean,peak_sigma,delta_m,nm1s), mmin, mmax, nm1s, m1_dist)
+
 def power(m, alpha):
     return m**(alpha)
 
@@ -303,18 +298,7 @@ def redshift_lum_distance_sampler(cosmo_dict,num_injs,seed):
     zmin    = cosmo_dict['zmin']
     zmax    = cosmo_dict['zmax']
 
-    keys = list(cosmo_dict.keys())
-    if 'Om0' in keys:  Om0 = cosmo_dict['Om0']
-    else:              Om0 = None
-    if 'Ode0' in keys: Ode0 = cosmo_dict['Ode0']
-    else:              Ode0 = None
-    if 'H0' in keys:   H0 = cosmo_dict['H0']
-    else:              H0 = None
-
-    if None in (Om0,Ode0,H0):
-        cosmo = apcosm.Planck18
-    else:
-        cosmo = apcosm.LambdaCDM(H0=H0, Om0=Om0, Ode0=Ode0)
+    cosmo = cosmology.get_cosmology(cosmo_dict.get('H0'),cosmo_dict.get('Om0'),cosmo_dict.get('Ode0'))
 
     if cosmo_dict['sampler'] == 'uniform':
         rng = np.random.default_rng(seed)
@@ -332,21 +316,19 @@ def redshift_lum_distance_sampler(cosmo_dict,num_injs,seed):
         nzs = None
         z_vec = bns_md_merger_rate_uniform_comoving_volume_redshift_inversion_sampler(zmin,zmax,cosmo,num_injs,seed,nzs)
 
-    return z_vec, cosmo.luminosity_distance(z_vec).value
+    return z_vec, cosmology.luminosity_distance(z_vec,cosmo)
 
 #-----redshift samplers-----
 def uniform_comoving_volume_redshift_inversion_sampler(zmin,zmax,cosmo,num_injs,seed=None,nzs=None):
     rng = np.random.default_rng(seed)
     if nzs is None: nzs = max(5001, 50 * int((zmax-zmin)) + 1)
-    zs = np.linspace(zmin,zmax,nzs)
-    dist = (lambda z: ((4.*PI*cosmo.differential_comoving_volume(z).value)/(1.+z)))(zs)
-    window_cdf = np.array([simps(dist[:i],zs[:i]) for i in range(1,nzs+1)]) / simps(dist,zs)
-    inv_window_cdf = interp1d(window_cdf, zs)
+    dist = lambda z: (cosmology.differential_comoving_volume(z,cosmo)/(1.+z))
+    inv_window_cdf = inverse_cdf(('uniform_comoving_volume',zmin,zmax,nzs,repr(cosmo)), zmin, zmax, nzs, dist)
     return inv_window_cdf(rng.random(num_injs))
 
 def uniform_comoving_volume_redshift_rejection_sampler(zmin,zmax,cosmo,num_injs,seed=None,nzs=None):
     rng = np.random.default_rng(seed)
-    dist = lambda z: ((4.*PI*cosmo.differential_comoving_volume(z).value)/(1.+z))
+    dist = lambda z: (cosmology.differential_comoving_volume(z,cosmo)/(1.+z))
     window_norm = quad(dist, zmin, zmax)[0]
     flip_window_pdf = lambda z: -dist(z) / window_norm
     window_pdf_max = -minimize_scalar(flip_window_pdf,bounds=[zmin,zmax],method='bounded').fun
@@ -378,21 +360,55 @@ def uniform_comoving_volume_redshift_rejection_sampler(zmin,zmax,cosmo,num_injs,
 def mdbn_merger_rate_uniform_comoving_volume_redshift_inversion_sampler(zmin,zmax,cosmo,num_injs,seed=None,nzs=None):
     rng = np.random.default_rng(seed)
     if nzs is None: nzs = max(5001, 50 * int((zmax-zmin)) + 1)
-    zs = np.linspace(zmin,zmax,nzs)
-    dist = (lambda z: ((mdbn_merger_rate(z)*4.*PI*cosmo.differential_comoving_volume(z).value)/(1.+z)))(zs)
-    window_cdf = np.array([simps(dist[:i],zs[:i]) for i in range(1,nzs+1)]) / simps(dist,zs)
-    inv_window_cdf = interp1d(window_cdf, zs)
+    dist = lambda z: ((mdbn_merger_rate(z)*cosmology.differential_comoving_volume(z,cosmo))/(1.+z))
+    inv_window_cdf = inverse_cdf(('mdbn_rate',zmin,zmax,nzs,repr(cosmo)), zmin, zmax, nzs, dist)
     return inv_window_cdf(rng.random(num_injs))
 
 def bns_md_merger_rate_uniform_comoving_volume_redshift_inversion_sampler(zmin,zmax,cosmo,num_injs,seed=None,nzs=None):
     rng = np.random.default_rng(seed)
     if nzs is None: nzs = max(5001, 50 * int((zmax-zmin)) + 1)
-    zs = np.linspace(zmin,zmax,nzs)
-    dist = (lambda z: ((bns_md_merger_rate(z)*4.*PI*cosmo.differential_comoving_volume(z).value)/(1.+z)))(zs)
-    window_cdf = np.array([simps(dist[:i],zs[:i]) for i in range(1,nzs+1)]) / simps(dist,zs)
-    inv_window_cdf = interp1d(window_cdf, zs)
+    dist = lambda z: ((bns_md_merger_rate(z)*cosmology.differential_comoving_volume(z,cosmo))/(1.+z))
+    inv_window_cdf = inverse_cdf(('bns_md_rate',zmin,zmax,nzs,repr(cosmo)), zmin, zmax, nzs, dist)
     return inv_window_cdf(rng.random(num_injs))
 
+#-----inverse CDFs of tabulated distributions-----
+# interpolants of the inverse CDFs, dict(distribution and its parameters=interp1d), so that further redshift bins and
+# science cases with the same distribution reuse them
+inverse_cdf_cache = OrderedDict()
+inverse_cdf_cache_maxsize = 64
+
+def inverse_cdf(cache_key, xmin, xmax, nxs, dist_func):
+    # dist_func is only evaluated on nxs points in [xmin,xmax] if cache_key is not cached yet, it needn't be normalised
+    if cache_key in inverse_cdf_cache:
+        inverse_cdf_cache.move_to_end(cache_key)
+        return inverse_cdf_cache[cache_key]
+
+    xs = np.linspace(xmin,xmax,nxs)
+    window_cdf = cumulative_simps(dist_func(xs),xs)
+    inv_window_cdf = interp1d(window_cdf / window_cdf[-1], xs)
+    inverse_cdf_cache[cache_key] = inv_window_cdf
+    if len(inverse_cdf_cache) > inverse_cdf_cache_maxsize: inverse_cdf_cache.popitem(last=False)
+    return inv_window_cdf
+
+def cumulative_simps(ys, xs):
+    # integral of ys from xs[0] to each of the uniformly spaced xs in O(n) instead of simps on each prefix,
+    # Simpson's rule over each pair of intervals and the quadratic through the pair's three points for its first interval
+    ys = np.asarray(ys, dtype=float)
+    n = len(ys)
+    res = np.zeros(n)
+    if n < 3:
+        res[1:] = 0.5 * (xs[1:] - xs[:-1]) * (ys[1:] + ys[:-1])
+        return res
+    h = (xs[-1] - xs[0]) / (n - 1)
+    m = (n - 1) // 2
+    pairs = h / 3 * (ys[0:2*m-1:2] + 4 * ys[1:2*m:2] + ys[2:2*m+1:2])
+    res[2:2*m+1:2] = np.cumsum(pairs)
+    res[1:2*m:2] = res[0:2*m-1:2] + h / 12 * (5 * ys[0:2*m-1:2] + 8 * ys[1:2*m:2] - ys[2:2*m+1:2])
+    if n % 2 == 0:
+        # last interval of an odd number of intervals
+        res[-1] = res[-2] + h / 12 * (-ys[-3] + 8 * ys[-2] + 5 * ys[-1])
+    return res
+
 #-----merger rate functions-----
 # 'Madau-Dickinson-Belczynski-Ng' field BBH merger rate (https://arxiv.org/pdf/2012.09876.pdf, Eq. (B1) with F-values from p4)
 def mdbn_merger_rate(z, a0=2.57, b0=5.83, c0=3.36, phi0=1):
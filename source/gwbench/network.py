@@ -251,10 +251,7 @@ class Network:
     def calc_wf_polarizations_derivs_sym(self):
         print('Evaluate polarizations.')
         self.calc_wf_polarizations()
-        self.del_hfpc = {}
-        for deriv in self.del_hfpc_expr:
-            if deriv in ('variables','deriv_variables'): continue
-            self.del_hfpc[deriv] = self.del_hfpc_expr[deriv](self.f, **bfs.get_sub_dict(self.inj_params, self.del_hfpc_expr['variables']))
+        self.del_hfpc = drd.eval_det_responses_derivs_sym(self.del_hfpc_expr, self.f, self.inj_params)
         self.del_hfpc, c_quants = dc.get_conv_del_eval_dic(self.del_hfpc, self.inj_params, self.conv_cos, self.conv_log, self.deriv_symbs_string)
         self.inj_params, self.deriv_variables = dc.get_conv_inj_params_deriv_variables(c_quants, self.inj_params, self.deriv_variables)
         print('Lambdified polarizations evaluated.')
@@ -273,6 +270,12 @@ class Network:
             det.calc_det_responses_derivs_num(self.inj_params, self.deriv_variables, self.wf, self.deriv_symbs_string, self.conv_cos, self.conv_log, self.use_rot, step, method, order, n)
         print('Numeric derivatives of detector responses calculated.')
 
+    def calc_det_responses_derivs_ana(self):
+        print('Calculate analytic derivatives of detector responses.')
+        for det in self.detectors:
+            det.calc_det_responses_derivs_ana(self.inj_params, self.deriv_variables, self.wf, self.deriv_symbs_string, self.conv_cos, self.conv_log, self.use_rot)
+        print('Analytic derivatives of detector responses calculated.')
+
     def load_det_responses_derivs_sym(self, return_bin=0, user_lambdified_functions_path=None):
         for det in self.detectors:
             det.load_det_responses_derivs_sym(self.wf.wf_model_name, self.deriv_symbs_string, return_bin, user_lambdified_functions_path)
@@ -488,7 +491,10 @@ def unique_tecs(network_labels,f,F_lo=-np.inf,F_hi=np.inf,psd_file_dict=None):
     return tec_net
 
 
-def unique_locs_det_responses(network_labels,f,inj_params,deriv_symbs_string,wf_model_name,wf_other_var_dic=None,conv_cos=None,conv_log=None,use_rot=1,num_cores=None,step=None,method=None,order=None,n=None, user_lambdified_functions_path=None):
+def unique_locs_det_responses(network_labels,f,inj_params,deriv_symbs_string,wf_model_name,wf_other_var_dic=None,conv_cos=None,conv_log=None,use_rot=1,num_cores=None,step=None,method=None,order=None,n=None, user_lambdified_functions_path=None, pool=None, ana_derivs=0, fact_derivs=0):
+    # ana_derivs uses the analytic derivatives of the waveform model (drd.analytic_wf_models) instead of the lambdified functions,
+    # fact_derivs differentiates the polarizations once (numerically if step is given, else with the 'pl_cr' lambdified functions)
+    # and combines them with the analytic derivatives of the antenna patterns of each location, ana_derivs is always factorised
     print('Evaluate lambdified detector responses for unique locations.')
 
     # initialize empty network
@@ -518,13 +524,27 @@ def unique_locs_det_responses(network_labels,f,inj_params,deriv_symbs_string,wf_
     loc_net.setup_ant_pat_lpf()
     loc_net.calc_det_responses()
 
-    if step is None:
+    if step is None and not (ana_derivs or fact_derivs):
         print('Loading the lamdified functions.')
-        loc_net.load_det_responses_derivs_sym(return_bin = 1, user_lambdified_functions_path=user_lambdified_functions_path)
+        # deserialised once per process, the workers of a pool load them from their own cache instead
+        loc_net.load_det_responses_derivs_sym(return_bin = 0, user_lambdified_functions_path=user_lambdified_functions_path)
         print('Loading done.')
 
     print('Starting evaluation.')
-    if num_cores is None:
+    if ana_derivs or fact_derivs:
+        # the polarizations and their derivatives are shared by all locations, the rest is cheap enough to stay in this process
+        if ana_derivs:
+            hfpc_derivs = drd.calc_wf_polarizations_derivs_ana(loc_net.wf,deriv_symbs_string,f,inj_params)
+        elif step is None:
+            hfpc_derivs = drd.calc_wf_polarizations_derivs_sym(loc_net.wf,deriv_symbs_string,f,inj_params,user_lambdified_functions_path)
+        else:
+            hfpc_derivs = drd.calc_wf_polarizations_derivs_num(loc_net.wf,deriv_symbs_string,f,inj_params,step,method,order,n)
+        for det in loc_net.detectors:
+            det.del_hf, c_quants = eval_loc_fact(det.loc,deriv_symbs_string,f,inj_params,conv_cos,conv_log,use_rot,hfpc_derivs)
+
+        loc_net.inj_params, loc_net.deriv_variables = dc.get_conv_inj_params_deriv_variables(c_quants, loc_net.inj_params, loc_net.deriv_variables)
+
+    elif num_cores is None and pool is None:
         if step is None:
             for det in loc_net.detectors:
                 det.del_hf, c_quants = eval_loc_sym(det.loc,det.del_hf_expr,deriv_symbs_string,f,inj_params,conv_cos,conv_log)
@@ -535,35 +555,51 @@ def unique_locs_det_responses(network_labels,f,inj_params,deriv_symbs_string,wf_
         loc_net.inj_params, loc_net.deriv_variables = dc.get_conv_inj_params_deriv_variables(c_quants, loc_net.inj_params, loc_net.deriv_variables)
 
     else:
-        pool = Pool(num_cores)
         if step is None:
-            arg_tuple_list = [(det.loc,det.del_hf_expr,deriv_symbs_string,f,inj_params,conv_cos,conv_log) for det in loc_net.detectors]
-            result = pool.starmap_async(eval_loc_sym, arg_tuple_list)
-            result.wait()
+            eval_loc = eval_loc_sym
+            arg_tuple_list = [(det.loc,None,deriv_symbs_string,f,inj_params,conv_cos,conv_log,wf_model_name,user_lambdified_functions_path) for det in loc_net.detectors]
         else:
+            eval_loc = eval_loc_num
             arg_tuple_list = [(det.loc,loc_net.wf,deriv_symbs_string,f,inj_params,conv_cos,conv_log,use_rot,step,method,order,n) for det in loc_net.detectors]
-            result = pool.starmap_async(eval_loc_num, arg_tuple_list)
-            result.wait()
 
-        for det, (del_hf,c_quants) in zip(loc_net.detectors, result.get()):
+        # use the long-lived pool if one is handed over, otherwise a pool for this call only
+        if pool is None:
+            with loc_pool(num_cores,[det.loc for det in loc_net.detectors],wf_model_name,deriv_symbs_string,wf_other_var_dic,step is None,user_lambdified_functions_path) as tmp_pool:
+                result = tmp_pool.starmap(eval_loc, arg_tuple_list)
+        else:
+            result = pool.starmap(eval_loc, arg_tuple_list)
+
+        for det, (del_hf,c_quants) in zip(loc_net.detectors, result):
             det.del_hf = del_hf
 
         loc_net.inj_params, loc_net.deriv_variables = dc.get_conv_inj_params_deriv_variables(c_quants, loc_net.inj_params, loc_net.deriv_variables)
 
-    if step is None:
-        for det in loc_net.detectors:
-            det.del_hf_expr = dill.loads(det.del_hf_expr)
-
     print('Lambdified detector responses for unique locations evaluated.')
     return loc_net
 
-def eval_loc_sym(loc,del_hf_expr,deriv_symbs_string,f,inj_params,conv_cos,conv_log):
+#-----long-lived pool for the location-level evaluations-----
+def loc_pool(num_cores,locs,wf_model_name,deriv_symbs_string,wf_other_var_dic=None,sym_derivs=1,user_lambdified_functions_path=None):
+    # create once per task and hand over to unique_locs_det_responses via pool, close (e.g. with a with statement) when done
+    return Pool(num_cores, initializer=init_loc_worker, initargs=(locs,wf_model_name,deriv_symbs_string,wf_other_var_dic,sym_derivs,user_lambdified_functions_path))
+
+def init_loc_worker(locs,wf_model_name,deriv_symbs_string,wf_other_var_dic=None,sym_derivs=1,user_lambdified_functions_path=None):
+    # import the waveform modules and deserialise the lambdified functions once per worker
+    wfc.Waveform(wf_model_name,wf_other_var_dic)
+    if sym_derivs:
+        drd.preload_det_responses_derivs_sym(locs,wf_model_name,deriv_symbs_string,user_lambdified_functions_path)
+
+def eval_loc_sym(loc,del_hf_expr,deriv_symbs_string,f,inj_params,conv_cos,conv_log,wf_model_name=None,user_lambdified_functions_path=None):
+    print(' ',loc)
+    if del_hf_expr is None:
+        del_hf_expr = drd.load_det_responses_derivs_sym(loc,wf_model_name,deriv_symbs_string,user_lambdified_functions_path=user_lambdified_functions_path)
+    elif isinstance(del_hf_expr, bytes):
+        del_hf_expr = dill.loads(del_hf_expr)
+    del_hf = drd.eval_det_responses_derivs_sym(del_hf_expr,f,inj_params)
+    return dc.get_conv_del_eval_dic(del_hf,inj_params,conv_cos,conv_log, deriv_symbs_string)
+
+def eval_loc_fact(loc,deriv_symbs_string,f,inj_params,conv_cos,conv_log,use_rot,hfpc_derivs):
     print(' ',loc)
-    del_hf = {}
-    del_hf_expr = dill.loads(del_hf_expr)
-    for deriv in del_hf_expr:
-        if deriv in ('variables','deriv_variables'): continue
-        del_hf[deriv] = del_hf_expr[deriv](f,**bfs.get_sub_dict(inj_params,del_hf_expr['variables']))
+    del_hf = drd.calc_det_responses_derivs_fact(loc,deriv_symbs_string,f,inj_params,hfpc_derivs,use_rot,'hf')
     return dc.get_conv_del_eval_dic(del_hf,inj_params,conv_cos,conv_log, deriv_symbs_string)
 
 def eval_loc_num(loc,wf,deriv_symbs_string,f,inj_params,conv_cos,conv_log,use_rot,step,method,order,n):
@@ -16,7 +16,10 @@
 
 
 import os
+from collections import OrderedDict
+from hashlib import sha1
 
+import numpy as np
 import scipy.interpolate as si
 from numpy import power, logical_and, inf, pi, exp, tanh, cos, sin, square
 from pandas import read_csv
@@ -24,6 +27,13 @@ from pandas import read_csv
 from gwbench.basic_constants import cLight
 
 noise_curves_path=os.path.join(os.path.dirname(os.path.abspath(__file__)),'noise_curves')
+noise_curves_cache_path=os.path.join(os.path.dirname(os.path.abspath(__file__)),'noise_curves_cache')
+
+# noise curves (frequency, PSD) loaded in this process, dict(filename=(psd_data, interpolant))
+noise_curve_registry = {}
+# PSDs already interpolated onto a frequency grid, least recently used entries are evicted beyond psd_cache_maxsize
+psd_cache = OrderedDict()
+psd_cache_maxsize = 32
 
 tecs = ('aLIGO', 'A+', 'V+', 'K+', 'ET', 'CEwb', 
         'Voyager-CBO', 'Voyager-PMO',
@@ -84,17 +94,58 @@ def psd(tec,f,F_lo=-inf,F_hi=inf,psd_file=None,is_asd=None):
             filename, asd = get_filename(tec)
             filename = os.path.join(noise_curves_path,filename)
 
-        psd_file = read_csv(filename, sep = None, header = None, engine = 'python', comment = '#')
-        psd_data = psd_file.to_numpy()
-        psd = si.interp1d(psd_data[:,0], psd_data[:,1]**(1+asd))
+        # many injections share the same frequency grid (e.g. BNS clamped to fmax=1024), re-use their PSDs
+        cache_key = (filename, asd, F_lo, F_hi, f.size, sha1(np.ascontiguousarray(f)).hexdigest())
+        if cache_key in psd_cache:
+            psd_cache.move_to_end(cache_key)
+            return psd_cache[cache_key]
+
+        psd_data, psd = load_noise_curve(filename, asd)
 
         # find correct limits: file vs user-set limits
         f_lo = max(psd_data[0,0],F_lo)
         f_hi = min(psd_data[-1,0],F_hi)
         check_f(tec,f,f_lo,f_hi)
 
-        # return the PSD and corresponding freq array
-        return psd(f[logical_and(f>=f_lo,f<=f_hi)]), f[logical_and(f>=f_lo,f<=f_hi)]
+        # return the PSD and corresponding freq array, read-only since they are shared between callers
+        f = f[logical_and(f>=f_lo,f<=f_hi)]
+        psd_f = (psd(f), f)
+        for arr in psd_f: arr.flags.writeable = False
+        psd_cache[cache_key] = psd_f
+        if len(psd_cache) > psd_cache_maxsize: psd_cache.popitem(last=False)
+        return psd_f
+
+#-----noise curve registry-----
+def load_noise_curve(filename, asd):
+    if (filename, asd) not in noise_curve_registry:
+        psd_data = read_noise_curve(filename)
+        noise_curve_registry[(filename, asd)] = (psd_data, si.interp1d(psd_data[:,0], psd_data[:,1]**(1+asd)))
+    return noise_curve_registry[(filename, asd)]
+
+def read_noise_curve(filename):
+    # parsing the ASCII files is slow, keep a binary copy in noise_curves_cache_path that is refreshed if the file changes
+    cache_file = os.path.join(noise_curves_cache_path, sha1(os.path.abspath(filename).encode()).hexdigest()[:16] + '_' + os.path.basename(filename) + '.npy')
+    if os.path.isfile(cache_file) and os.path.getmtime(cache_file) >= os.path.getmtime(filename):
+        try:
+            return np.load(cache_file)
+        except (OSError, ValueError):
+            pass
+
+    psd_data = read_csv(filename, sep = None, header = None, engine = 'python', comment = '#').to_numpy(dtype=np.float64)
+    try:
+        os.makedirs(noise_curves_cache_path, exist_ok=True)
+        # write to a temporary file and rename so that concurrent processes never read a partial cache file
+        tmp_file = f'{cache_file}.{os.getpid()}.tmp'
+        with open(tmp_file, 'wb') as fi:
+            np.save(fi, psd_data)
+        os.replace(tmp_file, cache_file)
+    except OSError:
+        pass
+    return psd_data
+
+def clear_psd_caches():
+    noise_curve_registry.clear()
+    psd_cache.clear()
 
 def psd_aLIGO(f):
     x = f/245.4
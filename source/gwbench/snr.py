@@ -15,8 +15,10 @@
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
 
+from collections import OrderedDict
+from hashlib import sha1
+
 import numpy as np
-from scipy.integrate import simps
 
 #-----overlap function-------
 def scalar_product_integrand(hf, gf, psd):
@@ -24,30 +26,74 @@ def scalar_product_integrand(hf, gf, psd):
     return 2*np.divide(temp+np.conj(temp),psd)
 
 def scalar_product_freq_array(hf, gf, psd, freqs, df=None):
-    if df is None:
-        return np.real(simps(scalar_product_integrand(hf, gf, psd),freqs))
-    else:
-        summ = 2.*np.real(((hf*np.conjugate(gf)+np.conjugate(hf)*gf)/psd).sum())*df
-        return summ
+    return 4.*np.real(np.sum(inner_prod_weights(psd, freqs, df) * hf * np.conj(gf)))
 
 #-----SNR function-------
 def snr_square_integrand(hf, psd):
     return 4.*np.divide(np.power(np.abs(hf),2),psd)
 
 def snr_square_freq_array(hf, psd, freqs):
-    return simps(snr_square_integrand(hf, psd),freqs)
+    return snr_sq_weighted(hf, inner_prod_weights(psd, freqs))
 
 def snr_freq_array(hf, psd, freqs):
     return np.sqrt(snr_square_freq_array(hf, psd, freqs))
 
 def snr_snr_sq_freq_array(hf, psd, freqs, df=None):
-    if df is None:
-        snr_sq = simps(snr_square_integrand(hf, psd),freqs)
-        return np.sqrt(snr_sq), snr_sq
+    snr_sq = snr_sq_weighted(hf, inner_prod_weights(psd, freqs, df))
+    return np.sqrt(snr_sq), snr_sq
+
+def snr_sq_weighted(hf, weights):
+    # hf has shape (..., len(freqs))
+    return 4. * np.sum(weights * (np.real(hf)**2 + np.imag(hf)**2), axis=-1)
+
+#-----quadrature weights over the PSD, shared by the SNR and Fisher inner products-----
+# weights w such that sum(w*y) reproduces simps(y/psd,freqs) with the even='avg' rule of scipy or sum(y/psd)*df
+inner_prod_weights_cache = OrderedDict()
+inner_prod_weights_cache_maxsize = 16
+
+def inner_prod_weights(psd, freqs, df=None):
+    psd = np.ascontiguousarray(psd)
+    freqs = np.ascontiguousarray(freqs)
+    cache_key = (len(freqs), df, sha1(freqs).hexdigest(), sha1(psd).hexdigest())
+    if cache_key in inner_prod_weights_cache:
+        inner_prod_weights_cache.move_to_end(cache_key)
+        return inner_prod_weights_cache[cache_key]
+
+    if df is None: weights = simps_weights(freqs) / psd
+    else:          weights = df / psd
+    weights.flags.writeable = False
+    inner_prod_weights_cache[cache_key] = weights
+    if len(inner_prod_weights_cache) > inner_prod_weights_cache_maxsize: inner_prod_weights_cache.popitem(last=False)
+    return weights
+
+def simps_weights(freqs):
+    n = len(freqs)
+    w = np.zeros(n)
+    if n == 1:
+        return w
+    if n == 2:
+        w += 0.5 * (freqs[1] - freqs[0])
+        return w
+    h = np.diff(freqs)
+    if n % 2:
+        add_basic_simps_weights(w, h, 0, n-2)
     else:
-        summ = 4.*(np.divide(np.power(np.abs(hf),2),psd)).sum()*df
-        summ = 2.*np.real(((hf*np.conjugate(hf)+np.conjugate(hf)*hf)/psd).sum())*df
-        return np.sqrt(summ), summ
+        add_basic_simps_weights(w, h, 0, n-3)
+        w[-1] += 0.5 * h[-1]
+        w[-2] += 0.5 * h[-1]
+        add_basic_simps_weights(w, h, 1, n-2)
+        w[1] += 0.5 * h[0]
+        w[0] += 0.5 * h[0]
+        w *= 0.5
+    return w
+
+def add_basic_simps_weights(w, h, start, stop):
+    h0 = h[start:stop:2]
+    h1 = h[start+1:stop+1:2]
+    hsum = h0 + h1
+    w[start:stop:2]     += hsum/6. * (2. - h1/h0)
+    w[start+1:stop+1:2] += hsum/6. * hsum*hsum/(h0*h1)
+    w[start+2:stop+2:2] += hsum/6. * (2. - h0/h1)
 
 #-----fft method from Anuradha-------
 def rfft_normalized(time_series, dt, n=None):
@@ -35,14 +35,17 @@ class Waveform(object):
             wf_symbs_string = None
             hfpc_np = None
             hfpc_sp = None
+            hfpc_derivs_np = None
         else:
             wf_symbs_string, hfpc_np, hfpc_sp = select_wf_model_quants(wf_model_name)
+            hfpc_derivs_np = select_wf_model_derivs_np(wf_model_name)
 
         self.wf_model_name = wf_model_name
         self.wf_other_var_dic = wf_other_var_dic
         self.wf_symbs_string = wf_symbs_string
         self.hfpc_np = hfpc_np
         self.hfpc_sp = hfpc_sp
+        self.hfpc_derivs_np = hfpc_derivs_np
 
 
     ###
@@ -63,6 +66,11 @@ class Waveform(object):
             if self.wf_other_var_dic is None: return self.hfpc_np(f,*inj_params)
             else:                             return self.hfpc_np(f,*inj_params,**self.wf_other_var_dic)
 
+    def eval_np_derivs(self,f,inj_params,deriv_symbs_string):
+        # polarizations and their analytic derivatives w.r.t. the waveform parameters in deriv_symbs_string
+        if self.wf_other_var_dic is None: return self.hfpc_derivs_np(f,**inj_params,deriv_symbs_string=deriv_symbs_string)
+        else:                             return self.hfpc_derivs_np(f,**inj_params,deriv_symbs_string=deriv_symbs_string,**self.wf_other_var_dic)
+
 
     ###
     #-----IO methods-----
@@ -92,3 +100,12 @@ def select_wf_model_quants(wf_model_name):
     else:              sp_tmp = sp_mod.hfpc
 
     return np_mod.wf_symbs_string, np_mod.hfpc, sp_tmp
+
+#-----Get the analytic derivatives of the polarizations based on the model name, None if the model has none-----
+def select_wf_model_derivs_np(wf_model_name):
+    if wf_model_name == 'tf2':
+        return tf2_np.hfpc_derivs
+    elif wf_model_name == 'tf2_tidal':
+        return tf2_tidal_np.hfpc_derivs
+    else:
+        return None
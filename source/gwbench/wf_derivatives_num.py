@@ -16,14 +16,21 @@
 
 
 '''This module contains two methods that calculate numerical derivatives.
+
+The finite differences are taken with a fixed step on a stencil of configurable method (central, forward, backward)
+and order. Each perturbed waveform is evaluated once and all outputs (e.g. amplitudes and phases of both
+polarizations) are differenced from that single evaluation. If the waveform function broadcasts over its parameters
+(stack_evals=1), all perturbed points are evaluated in one call with the parameters stacked along the first axis.
 '''
 
-import numdifftools as nd
+from math import factorial
+
+import numpy as np
 
 import gwbench.basic_functions as bfs
 import gwbench.wf_manipulations as wfm
 
-def part_deriv_hf_func(hf, symbols_list, deriv_symbs_list, f, params_dic, pl_cr=0, compl=1, label='hf', step=1e-9, method='central', order=2, n=1):
+def part_deriv_hf_func(hf, symbols_list, deriv_symbs_list, f, params_dic, pl_cr=0, compl=1, label='hf', step=1e-9, method='central', order=2, n=1, stack_evals=0):
 
     if 'f' in symbols_list:
         symbols_list.remove('f')
@@ -46,7 +53,7 @@ def part_deriv_hf_func(hf, symbols_list, deriv_symbs_list, f, params_dic, pl_cr=
 
         return hf(f,*tmp_list)
 
-    del_hf = part_deriv(hf_of_deriv_params, f, deriv_params_list, pl_cr, compl, step, method, order, n)
+    del_hf = part_deriv(hf_of_deriv_params, f, deriv_params_list, pl_cr, compl, step, method, order, n, stack_evals)
     if pl_cr:
         del_hf_dic = {}
 
@@ -80,18 +87,28 @@ def part_deriv_hf_func(hf, symbols_list, deriv_symbs_list, f, params_dic, pl_cr=
     return del_hf_dic
 
 
-def part_deriv(func, f, params_list, pl_cr=0, compl=None, step=1e-9, method='central', order=2, n=1):
+def part_deriv(func, f, params_list, pl_cr=0, compl=None, step=1e-9, method='central', order=2, n=1, stack_evals=0):
     if pl_cr:
         if compl:
-            def amp_pha_of_hfpc_compl(f, *params_list):
-                return wfm.pl_cr_to_amp_pha(*func(f, *params_list))
+            def outputs(hfpc):
+                return wfm.pl_cr_to_amp_pha(*hfpc)
+        else:
+            def outputs(hfpc):
+                return wfm.amp_pha_from_re_im(*hfpc)
+    else:
+        if compl:
+            def outputs(hf):
+                return wfm.amp_pha_from_z(hf)
+        else:
+            def outputs(hf):
+                return (hf,)
 
-            amp_pl, pha_pl, amp_cr, pha_cr = amp_pha_of_hfpc_compl(f, *params_list)
+    center, dels = part_deriv_fd(func, outputs, f, params_list, step, method, order, n, stack_evals)
 
-            del_amp_pl = part_deriv_ndGradient(amp_pha_of_hfpc_compl, f, params_list, 0, step, method, order, n)
-            del_pha_pl = part_deriv_ndGradient(amp_pha_of_hfpc_compl, f, params_list, 1, step, method, order, n)
-            del_amp_cr = part_deriv_ndGradient(amp_pha_of_hfpc_compl, f, params_list, 2, step, method, order, n)
-            del_pha_cr = part_deriv_ndGradient(amp_pha_of_hfpc_compl, f, params_list, 3, step, method, order, n)
+    if pl_cr:
+        if compl:
+            amp_pl, pha_pl, amp_cr, pha_cr = center
+            del_amp_pl, del_pha_pl, del_amp_cr, del_pha_cr = dels
 
             del_hfp = wfm.z_deriv_from_amp_pha(amp_pl, pha_pl, del_amp_pl, del_pha_pl)
             del_hfc = wfm.z_deriv_from_amp_pha(amp_cr, pha_cr, del_amp_cr, del_pha_cr)
@@ -99,38 +116,85 @@ def part_deriv(func, f, params_list, pl_cr=0, compl=None, step=1e-9, method='cen
             return del_hfp, del_hfc
 
         else:
-            def amp_pha_of_hfpc_real(f, *params_list):
-                return wfm.amp_pha_from_re_im(*func(f, *params_list))
-
-            amp, pha = amp_pha_of_hfpc_real(f, *params_list)
-            del_amp = part_deriv_ndGradient(amp_pha_of_hfpc_real, f, params_list, 0, step, method, order, n)
-            del_pha = part_deriv_ndGradient(amp_pha_of_hfpc_real, f, params_list, 1, step, method, order, n)
-
+            amp, pha = center
+            del_amp, del_pha = dels
             return wfm.re_im_from_z(wfm.z_deriv_from_amp_pha(amp, pha, del_amp, del_pha))
 
     else:
         if compl:
-            def amp_pha_of_hf(f, *params_list):
-                return wfm.amp_pha_from_z(func(f, *params_list))
-
-            amp, pha = amp_pha_of_hf(f, *params_list)
-            del_amp = part_deriv_ndGradient(amp_pha_of_hf, f, params_list, 0, step, method, order, n)
-            del_pha = part_deriv_ndGradient(amp_pha_of_hf, f, params_list, 1, step, method, order, n)
-
+            amp, pha = center
+            del_amp, del_pha = dels
             return wfm.z_deriv_from_amp_pha(amp, pha, del_amp, del_pha)
 
         else:
-            return part_deriv_ndGradient(func, f, params_list, None, step, method, order, n)
-
-
-def part_deriv_ndGradient(func, f, params_list=None, funcid=None, step=1e-9, method='central', order=2, n=1):
-    def wraps(x):
-        if funcid == None:
-            return func(f,*x)
-        else:
-            return func(f,*x)[funcid]
-
-    if params_list == None:
-        return nd.Gradient(wraps, step=step, method=method, order=order, n=n)
+            return dels[0]
+
+
+#-----finite difference engine-----
+def fd_stencil(method='central', order=2, n=1):
+    # offsets (in units of the step) and weights of the finite difference stencil for the n-th derivative with error O(step**order)
+    if method == 'central':
+        half_width = (n + order - 1) // 2
+        offsets = np.arange(-half_width, half_width + 1)
+    elif method == 'forward':
+        offsets = np.arange(0, n + order)
+    elif method == 'backward':
+        offsets = -np.arange(0, n + order)[::-1]
+    else:
+        raise ValueError(f'Finite difference method "{method}" not known, choose from "central", "forward", "backward".')
+
+    # solve the Vandermonde system sum_k w_k offsets_k**j = n! delta_jn for j = 0, ..., len(offsets)-1
+    vander = np.vander(offsets.astype(float), increasing=True).T
+    rhs = np.zeros(len(offsets))
+    rhs[n] = factorial(n)
+    weights = np.linalg.solve(vander, rhs)
+
+    # drop zero weights, e.g. the center of central first derivatives, up to round-off
+    ids = np.abs(weights) > 1e-12 * np.amax(np.abs(weights))
+    return offsets[ids], weights[ids]
+
+def part_deriv_fd(func, outputs, f, params_list, step=1e-9, method='central', order=2, n=1, stack_evals=0):
+    # returns the outputs at params_list and their derivatives w.r.t. each parameter,
+    # derivatives have shape (len(f), len(params_list)), or (len(f),) for a single parameter like numdifftools.Gradient
+    offsets, weights = fd_stencil(method, order, n)
+    params_list = [np.float64(param) for param in params_list]
+    num_params = len(params_list)
+
+    # the step actually taken, i.e. representable in floating point, for each parameter
+    steps = [(param + step) - param for param in params_list]
+    # perturbed parameter points: the center first, then the non-zero offsets for the first parameter, then the second, etc.
+    nonzero_offsets = offsets[offsets != 0]
+    points = [list(params_list)]
+    for i in range(num_params):
+        for offset in nonzero_offsets:
+            point = list(params_list)
+            point[i] = params_list[i] + offset * steps[i]
+            points.append(point)
+
+    if stack_evals:
+        # one call with parameters as column vectors, every output is stacked along the first axis
+        stacked = [np.array([point[i] for point in points])[:,np.newaxis] for i in range(num_params)]
+        evals = outputs(func(f, *stacked))
+        evals = [[out[k] for out in evals] for k in range(len(points))]
     else:
-        return nd.Gradient(wraps, step=step, method=method, order=order, n=n)(params_list)
+        evals = [outputs(func(f, *point)) for point in points]
+
+    center = evals[0]
+    num_nonzero = len(nonzero_offsets)
+    dels = []
+    for j in range(len(center)):
+        del_out = np.zeros((len(center[j]), num_params), dtype=np.result_type(center[j], np.float64))
+        for i in range(num_params):
+            k = 0
+            for offset, weight in zip(offsets, weights):
+                if offset == 0:
+                    del_out[:,i] += weight * center[j]
+                else:
+                    del_out[:,i] += weight * evals[1 + i*num_nonzero + k][j]
+                    k += 1
+            del_out[:,i] /= steps[i]**n
+        if num_params == 1:
+            del_out = del_out[:,0]
+        dels.append(del_out)
+
+    return center, dels
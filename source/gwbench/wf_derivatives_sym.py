@@ -24,16 +24,21 @@ of the the derivatives as well as of the function/expression itself.
          output['hf'] / output['hfp'], output['hfc']
          output['del_x_hf'] / output['del_x_hfp'], output['del_x_hfc']
            (x being the variable wrt which the derivative was taken)
+         or, with cse=1, a single function output['all_derivs'] that returns
+         the derivatives in the order of output['deriv_keys'] from common
+         subexpressions that are evaluated once per call
 
  Disclaimer: These methods can be used on any sympy functions/expressions
              that have one or two outputs only (labels are set with
              gravitational waveforms in mind.
 '''
 
-from sympy import symbols, lambdify, diff
+from sympy import symbols, lambdify, diff, numbered_symbols
+from sympy import cse as sympy_cse
+from sympy.printing.numpy import NumPyPrinter
 
 # hf is a sympy expression
-def part_deriv_hf_expr(hf, symbols_string, deriv_symbs_string=None, pl_cr=0, label='hf'):
+def part_deriv_hf_expr(hf, symbols_string, deriv_symbs_string=None, pl_cr=0, label='hf', cse=0):
     symb_dic = {}
 
     for name in symbols_string.split(' '):
@@ -46,23 +51,49 @@ def part_deriv_hf_expr(hf, symbols_string, deriv_symbs_string=None, pl_cr=0, lab
     else:
         deriv_symbs_list = deriv_symbs_string.split(' ')
 
+    expr_dic = {}
     if pl_cr:
-        lamdified_dic = {}
         for name in deriv_symbs_list:
             if name == 'f': continue
 
             key_string = 'del_'+name+'_'+label+'p'
-            lamdified_dic[key_string] = lambdify(symb_list, diff(hf[0],symb_dic[name]), modules='numpy')
+            expr_dic[key_string] = diff(hf[0],symb_dic[name])
 
             key_string = 'del_'+name+'_'+label+'c'
-            lamdified_dic[key_string] = lambdify(symb_list, diff(hf[1],symb_dic[name]), modules='numpy')
+            expr_dic[key_string] = diff(hf[1],symb_dic[name])
 
     else:
-        lamdified_dic = {}
         for name in deriv_symbs_list:
             if name == 'f': continue
 
             key_string = 'del_'+name+'_'+label
-            lamdified_dic[key_string] = lambdify(symb_list, diff(hf,symb_dic[name]), modules='numpy')
+            expr_dic[key_string] = diff(hf,symb_dic[name])
+
+    lamdified_dic = {}
+    if cse:
+        # the derivatives share the phase, amplitude, antenna patterns, and location phase factor,
+        # eliminate the common subexpressions across all of them and return them from one function
+        lamdified_dic['deriv_keys'] = list(expr_dic.keys())
+        lamdified_dic['all_derivs'] = lambdify_cse(symb_list, list(expr_dic.values()))
+    else:
+        for key_string in expr_dic:
+            lamdified_dic[key_string] = lambdify(symb_list, expr_dic[key_string], modules='numpy')
 
     return lamdified_dic
+
+# like lambdify(symb_list, exprs, modules='numpy', cse=True) of sympy 1.9 and later, but with sympy.cse directly since
+# lambdify has no cse option in sympy 1.8: each common subexpression is assigned once and the list of the reduced
+# expressions is returned
+def lambdify_cse(symb_list, exprs, funcname='all_derivs'):
+    replacements, reduced = sympy_cse(exprs, symbols=numbered_symbols('cse'))
+    printer = NumPyPrinter({'fully_qualified_modules': False, 'inline': True, 'allow_unknown_functions': True})
+
+    lines = [f'def {funcname}({", ".join(str(symb) for symb in symb_list)}):']
+    lines += [f'    {symb} = {printer.doprint(expr)}' for symb, expr in replacements]
+    lines.append(f'    return [{", ".join(printer.doprint(expr) for expr in reduced)}]')
+
+    # the numpy namespace of lambdify(modules='numpy'), dill only serialises the names that the function uses
+    namespace = {}
+    exec('from numpy import *', namespace)
+    exec('\n'.join(lines), namespace)
+    return namespace[funcname]
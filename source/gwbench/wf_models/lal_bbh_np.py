@@ -15,7 +15,12 @@
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
 
+from collections import OrderedDict
+from hashlib import sha1
+
+import lal
 import lalsimulation as lalsim
+import numpy as np
 from numpy import exp, pi
 
 from gwbench.basic_constants import Mpc, Msun
@@ -24,31 +29,52 @@ from gwbench.basic_relations import m1_m2_of_M_eta, M_of_Mc_eta
 wf_symbs_string = 'f Mc eta chi1x chi1y chi1z chi2x chi2y chi2z DL tc phic iota'
 
 def hfpc(f, Mc, eta, chi1x, chi1y, chi1z, chi2x, chi2y, chi2z, DL, tc, phic, iota, approximant, fRef=0., phiRef=0.):
-    f_min = f[0]
-    delta_f = f[1] - f[0]
-    f_max = f[-1] + delta_f
-
-    if not fRef: fRef = f_min
+    if not fRef: fRef = f[0]
 
     m1, m2 = m1_m2_of_M_eta(M_of_Mc_eta(Mc,eta),eta)
-    m1 *= Msun
-    m2 *= Msun
-    r = DL * Mpc
+    hPlus, hCross = hfpc_seq(f, m1, m2, chi1x, chi1y, chi1z, chi2x, chi2y, chi2z, iota, approximant, fRef, phiRef)
 
-    approx = lalsim.GetApproximantFromString(approximant)
+    # the waveform at 1 Mpc is rescaled to DL
+    pf = exp(1j*(2*f*pi*tc - phic)) / DL
 
-    hPlus, hCross = lalsim.SimInspiralChooseFDWaveform(m1=m1, m2=m2, 
-                                   S1x = chi1x, S1y = chi1y, S1z = chi1z,
-                                   S2x = chi2x, S2y = chi2y, S2z = chi2z,
-                                   distance = r, inclination = iota, phiRef = phiRef, 
-                                   longAscNodes=0., eccentricity=0., meanPerAno = 0.,
-                                   deltaF=delta_f, f_min=f_min, f_max=f_max, f_ref=fRef,
-                                   LALpars=None, approximant=approx)
+    hfp = pf * hPlus
+    hfc = pf * hCross
 
-    pf = exp(1j*(2*f*pi*tc - phic))
-    i0 = int(round((f_min-hPlus.f0) / delta_f))
+    return hfp, hfc
 
-    hfp = pf *  hPlus.data.data[i0:i0+len(f)]
-    hfc = pf * hCross.data.data[i0:i0+len(f)]
+#-----lalsimulation waveforms at the requested (possibly non-uniform) frequencies-----
+# the waveforms of the last evaluations, e.g. of the base point and the finite-difference stencil of one injection, are reused,
+# they are independent of tc and phic (applied in hfpc) and of DL (at 1 Mpc), so those stencil points are served from here,
+# dict((len(f),sha1 of f,approximant,fRef,phiRef,masses,spins,iota,tidal parameters)=(hPlus,hCross))
+hfpc_seq_cache = OrderedDict()
+hfpc_seq_cache_maxsize = 64
 
-    return hfp, hfc
+def hfpc_seq(f, m1, m2, chi1x, chi1y, chi1z, chi2x, chi2y, chi2z, iota, approximant, fRef, phiRef, lam1=None, lam2=None):
+    # m1 and m2 in solar masses, lam1 and lam2 are inserted if given
+    f = np.ascontiguousarray(f, dtype=float)
+    cache_key = (len(f), sha1(f).hexdigest(), approximant, float(fRef), float(phiRef), float(m1), float(m2),
+                 float(chi1x), float(chi1y), float(chi1z), float(chi2x), float(chi2y), float(chi2z), float(iota),
+                 None if lam1 is None else float(lam1), None if lam2 is None else float(lam2))
+    if cache_key in hfpc_seq_cache:
+        hfpc_seq_cache.move_to_end(cache_key)
+        return hfpc_seq_cache[cache_key]
+
+    if lam1 is None and lam2 is None:
+        LALpars = None
+    else:
+        LALpars = lal.CreateDict()
+        lalsim.SimInspiralWaveformParamsInsertTidalLambda1(LALpars, lam1)
+        lalsim.SimInspiralWaveformParamsInsertTidalLambda2(LALpars, lam2)
+
+    freqs = lal.CreateREAL8Vector(len(f))
+    freqs.data = f
+    hPlus, hCross = lalsim.SimInspiralChooseFDWaveformSequence(phiRef, m1*Msun, m2*Msun,
+                                   chi1x, chi1y, chi1z, chi2x, chi2y, chi2z,
+                                   fRef, Mpc, iota, LALpars, lalsim.GetApproximantFromString(approximant), freqs)
+
+    hpc = (np.array(hPlus.data.data), np.array(hCross.data.data))
+    for h in hpc:
+        h.flags.writeable = False
+    hfpc_seq_cache[cache_key] = hpc
+    if len(hfpc_seq_cache) > hfpc_seq_cache_maxsize: hfpc_seq_cache.popitem(last=False)
+    return hpc
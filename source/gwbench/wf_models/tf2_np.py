@@ -19,6 +19,7 @@ import numpy as np
 
 import gwbench.basic_relations as brs
 from gwbench.basic_constants import time_fac, strain_fac
+from gwbench.wf_models import tf2_tidal_np
 
 cos = np.cos
 sin = np.sin
@@ -89,3 +90,8 @@ def hfpc(f, Mc, eta, chi1z, chi2z, DL, tc, phic, iota):
     hc = -1j*cos(iota)*A*f**(-7./6.)*(cos(phase) - 1j*sin(phase))
 
     return hp, hc
+
+#-----analytic derivatives-----
+def hfpc_derivs(f, Mc, eta, chi1z, chi2z, DL, tc, phic, iota, deriv_symbs_string):
+    # the tidal phase vanishes for lam_t = delta_lam_t = 0
+    return tf2_tidal_np.hfpc_derivs(f, Mc, eta, chi1z, chi2z, DL, tc, phic, iota, 0., 0., deriv_symbs_string)
@@ -24,6 +24,7 @@ cos  = np.cos
 sin  = np.sin
 log  = np.log
 sqrt = np.sqrt
+exp  = np.exp
 PI = np.pi
 
 wf_symbs_string = 'f Mc eta chi1z chi2z DL tc phic iota lam_t delta_lam_t'
@@ -103,3 +104,107 @@ def hfpc(f, Mc, eta, chi1z, chi2z, DL, tc, phic, iota, lam_t, delta_lam_t, is_la
     hc = -1j*cos(iota)*A*f**(-7./6.)*(cos(phase) - 1j*sin(phase))
 
     return hp, hc
+
+#-----analytic derivatives-----
+# the phase is 3/(128 eta) * sum_n (a_n + b_n log(v)) v^n, the coefficients a_n and b_n do not depend on f
+phase_powers = np.array((-5., -3., -2., -1., 0., 1., 2., 5., 7.))
+phase_coeffs_symbs = ('eta', 'chi1z', 'chi2z', 'lam_t', 'delta_lam_t')
+
+def phase_coeffs(eta, chi1z, chi2z, lam_t, delta_lam_t, is_lam12=0):
+    # same phasing as hfpc, returns a_n and b_n (incl. 3/(128 eta)) stacked along the first axis in the order of phase_powers
+    chi_s = brs.chi_s(chi1z,chi2z)
+    chi_a = brs.chi_a(chi1z,chi2z)
+    delta = (1.-4.*eta)**0.5
+
+    if is_lam12:
+        lam1 = lam_t
+        lam2 = delta_lam_t
+        lam_t = 8./13. * ( (1. + 7. * eta - 31. * eta**2) * (lam1 + lam2) +
+                       delta * (1. + 9. * eta - 11. * eta**2) * (lam1 - lam2) )
+        delta_lam_t = 0.5 * ( delta * (1319. - 13272. * eta + 8944. * eta**2) / 1319. * (lam1 + lam2)+
+                       (1319. - 15910. * eta + 32850. * eta**2 + 3380. * eta**3) / 1319. * (lam1 - lam2) )
+
+    p0 = 1.
+    p2 = (3715./756. + (55.*eta)/9.)
+    p3 = (-16.*PI + (113.*delta*chi_a)/3. + (113./3. - (76.*eta)/3.)*chi_s)
+    p4 = (15293365./508032. + (27145.*eta)/504.+ (3085.*eta**2)/72. + (-405./8. + 200.*eta)*chi_a**2 - (405.*delta*chi_a*chi_s)/4. + (-405./8. + (5.*eta)/2.)*chi_s**2)
+    gamma = (732985./2268. - 24260.*eta/81. - 340.*eta**2/9.)*chi_s + (732985./2268. + 140.*eta/9.)*delta*chi_a
+    p5 = (38645.*PI/756. - 65.*PI*eta/9. - gamma)
+    p6 = (11583231236531./4694215680. - 640./3.*PI**2 - 6848./21.*GammaE + eta*(-15737765635./3048192. + 2255./12.*PI**2) + eta*eta*76055./1728. - eta*eta*eta*127825./1296. \
+         - (6848./21.)*log(4.) + PI*(2270.*delta*chi_a/3. + (2270./3. - 520.*eta)*chi_s) + (75515./144. - 8225.*eta/18.)*delta*chi_a*chi_s \
+         + (75515./288. - 263245.*eta/252. - 480.*eta**2)*chi_a**2 + (75515./288. - 232415.*eta/504. + 1255.*eta**2/9.)*chi_s**2)
+    p7 = (((77096675.*PI)/254016. + (378515.*PI*eta)/1512.- (74045.*PI*eta**2)/756. + (-25150083775./3048192. + (10566655595.*eta)/762048. - (1042165.*eta**2)/3024. + (5345.*eta**3)/36.
+         + (14585./8. - 7270.*eta + 80.*eta**2)*chi_a**2)*chi_s + (14585./24. - (475.*eta)/6. + (100.*eta**2)/3.)*chi_s**3 + delta*((-25150083775./3048192.
+         + (26804935.*eta)/6048. - (1985.*eta**2)/48.)*chi_a + (14585./24. - 2380.*eta)*chi_a**3 + (14585./8. - (215.*eta)/2.)*chi_a*chi_s**2)))
+
+    # log(v/vlso) with vlso = (PI*M*f_isco(M))**(1/3) = 6**(-1/2)
+    log_vlso = -0.5*log(6.)
+    zero = 0.*(eta + chi_s + chi_a + lam_t + delta_lam_t)
+    a = (p0, p2, p3, p4, p5*(1. - 3.*log_vlso), p6, p7, -39.*lam_t/2., -3115.*lam_t/64. + 6595.*delta*delta_lam_t/364.)
+    b = (0., 0., 0., 0., 3.*p5, -6848./21., 0., 0., 0.)
+    pref = 3./(128.*eta)
+    return np.stack([pref*(zero + el) for el in a]), np.stack([pref*(zero + el) for el in b])
+
+def phase_coeffs_derivs(name, eta, chi1z, chi2z, lam_t, delta_lam_t, is_lam12=0, h=1e-30):
+    # exact derivatives of a_n and b_n w.r.t. one of phase_coeffs_symbs by a complex step (forward-mode, no cancellation)
+    args = dict(eta=eta, chi1z=chi1z, chi2z=chi2z, lam_t=lam_t, delta_lam_t=delta_lam_t)
+    args[name] = args[name] + 1j*h
+    a, b = phase_coeffs(**args, is_lam12=is_lam12)
+    return a.imag/h, b.imag/h
+
+def hfpc_derivs(f, Mc, eta, chi1z, chi2z, DL, tc, phic, iota, lam_t, delta_lam_t, deriv_symbs_string, is_lam12=0):
+    '''
+    Mc ... in solar mass
+    DL ... in mega parsec
+
+    returns hp, hc and dict('del_x_hfp'=..., 'del_x_hfc'=...) for x in deriv_symbs_string (waveform parameters only),
+    all in one pass that shares v, the phase and the amplitude
+    '''
+    Mc_s = Mc * time_fac
+    DL_s = DL * time_fac/strain_fac
+
+    M = Mc_s/eta**(3./5.)
+    v = (PI*M*f)**(1./3.)
+    log_v = log(v)
+    # (power, ...) arrays against the phase coefficients of shape (power, ...)
+    v_n = v[np.newaxis]**phase_powers.reshape((-1,) + (1,)*np.ndim(v))
+
+    coeffs_args = (eta, chi1z, chi2z, lam_t, delta_lam_t)
+    a, b = phase_coeffs(*coeffs_args, is_lam12)
+    a, b = (el.reshape(el.shape + (1,)*(np.ndim(v_n)-np.ndim(el))) for el in (a, b))
+    psi = np.sum((a + b*log_v) * v_n, axis=0)
+    # v * d psi/dv
+    v_dpsi_dv = np.sum((phase_powers.reshape((-1,) + (1,)*np.ndim(v)) * (a + b*log_v) + b) * v_n, axis=0)
+
+    A = ((5./24.)**0.5/PI**(2./3.))*(Mc_s**(5./6.)/DL_s)
+    amp = A*f**(-7./6.)*exp(-1j*(2*f*PI*tc - phic - PI/4. + psi))
+    hp = 0.5*(1+(cos(iota))**2)*amp
+    hc = -1j*cos(iota)*amp
+
+    del_hfpc = {}
+    for name in deriv_symbs_string.split(' '):
+        if name == 'iota':
+            del_hfpc['del_iota_hfp'] = -cos(iota)*sin(iota)*amp
+            del_hfpc['del_iota_hfc'] = 1j*sin(iota)*amp
+            continue
+        elif name == 'Mc':
+            fac = 5./(6.*Mc) - 1j*v_dpsi_dv/(3.*Mc)
+        elif name in phase_coeffs_symbs:
+            da, db = phase_coeffs_derivs(name, *coeffs_args, is_lam12)
+            da, db = (el.reshape(el.shape + (1,)*(np.ndim(v_n)-np.ndim(el))) for el in (da, db))
+            dpsi = np.sum((da + db*log_v) * v_n, axis=0)
+            # v depends on eta through M
+            if name == 'eta': dpsi = dpsi - v_dpsi_dv/(5.*eta)
+            fac = -1j*dpsi
+        elif name == 'DL':
+            fac = -1./DL
+        elif name == 'tc':
+            fac = -2j*PI*f
+        elif name == 'phic':
+            fac = 1j
+        else:
+            continue
+        del_hfpc['del_'+name+'_hfp'] = fac*hp
+        del_hfpc['del_'+name+'_hfc'] = fac*hc
+
+    return hp, hc, del_hfpc
@@ -7,10 +7,13 @@ Usage:
     $ python3 merge_processed_injections_task_files.py
     or
     $ python3 merge_processed_injections_task_files.py 0
-    
+
     To merge and delete task files:
     $ python3 merge_processed_injections_task_files.py 1
 
+    To merge the results of work queues (see work_queue.py), checking that every chunk of the master injections files has results:
+    $ python3 merge_processed_injections_task_files.py 0 ./data_raw_injections/INJECTIONS_FILE.npy ...
+
 License:
     BSD 3-Clause License
 
@@ -44,11 +47,21 @@ License:
     OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 """
 
-from typing import List, Set, Dict, Tuple, Optional, Union
+from typing import List, Set, Dict, Tuple, Optional, Union, Iterator
 from numpy.typing import NDArray
 import numpy as np
 import glob
+import json
+from fnmatch import fnmatch
+import shutil
 import os, sys
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from useful_functions import parallel_map
+from filename_search_and_manipulation import task_files_index, task_id_gaps
+from results_store import RESULTS_STORE_VERSION, results_store_path, ResultsStore
+from work_queue import work_queue_file_name, work_queue_chunk_ids
 
 
 def file_tag_from_task_file(file: str, cut_num_injs: bool = False) -> str:
@@ -65,46 +78,222 @@ def file_tag_from_task_file(file: str, cut_num_injs: bool = False) -> str:
         return file_tag
 
 
+def npy_header(file: str) -> Tuple[Tuple[int, ...], bool, np.dtype]:
+    """Returns the shape, whether in Fortran order, and dtype of the array in a .npy file by reading only its header.
+
+    Args:
+        file: Filename of .npy file with path.
+    """
+    with open(file, "rb") as fp:
+        version = np.lib.format.read_magic(fp)
+        if version == (1, 0):
+            return np.lib.format.read_array_header_1_0(fp)
+        else:
+            return np.lib.format.read_array_header_2_0(fp)
+
+
+def prefetched_npy_loads(
+    input_files: List[str], num_threads: int = 4
+) -> Iterator[NDArray]:
+    """Yields the arrays of .npy files in order while a thread pool reads up to 2*num_threads of the following files ahead.
+
+    Reading is I/O-bound and releases the GIL, so the reads overlap with copying the yielded arrays. At most 2*num_threads+1 arrays are held in memory at once.
+
+    Args:
+        input_files: Filenames of input .npy files.
+        num_threads: Number of threads reading ahead.
+    """
+    with ThreadPoolExecutor(max_workers=num_threads) as executor:
+        futures = deque()
+        for file in input_files:
+            futures.append(executor.submit(np.load, file))
+            if len(futures) > 2 * num_threads:
+                yield futures.popleft().result()
+        while futures:
+            yield futures.popleft().result()
+
+
+def stream_npy_files(
+    output_filename: str, input_files: List[str], num_threads: int = 4
+) -> int:
+    """Streams .npy files into their slices of one preallocated .npy file, returning the number of rows written.
+
+    The headers of the input files are read first to size the output, which is a memory map from np.lib.format.open_memmap that is filled in the order of input_files. Peak memory is a few input arrays, not the size of the output. The output is written under a temporary name and renamed, and removed if anything fails.
+
+    Args:
+        output_filename: Filename of output .npy file with path.
+        input_files: Filenames of input .npy files, arrays with the same shape after the first dimension and the same dtype.
+        num_threads: Number of threads reading the input files ahead, see prefetched_npy_loads.
+
+    Raises:
+        ValueError: If there are no input files or their arrays don't have the same trailing shape and dtype.
+    """
+    if len(input_files) == 0:
+        raise ValueError(f"No input files to merge into {output_filename}.")
+    headers = [npy_header(input_file) for input_file in input_files]
+    trailing_shape, _, dtype = headers[0]
+    trailing_shape = trailing_shape[1:]
+    for input_file, (shape, _, input_dtype) in zip(input_files, headers):
+        if shape[1:] != trailing_shape or input_dtype != dtype:
+            raise ValueError(
+                f"Array in {input_file} with shape {shape} and dtype {input_dtype} doesn't match {trailing_shape} and {dtype} of {input_files[0]}."
+            )
+    num_rows = [shape[0] for shape, _, _ in headers]
+    starts = np.concatenate(([0], np.cumsum(num_rows)))
+
+    tmp_filename = f"{output_filename}.{os.getpid()}.tmp"
+    try:
+        merged_array = np.lib.format.open_memmap(
+            tmp_filename,
+            mode="w+",
+            dtype=dtype,
+            shape=(int(starts[-1]),) + trailing_shape,
+        )
+        for i, array in enumerate(prefetched_npy_loads(input_files, num_threads)):
+            if len(array) != num_rows[i]:
+                raise ValueError(
+                    f"Array in {input_files[i]} changed while merging, {len(array)} rows instead of {num_rows[i]}."
+                )
+            merged_array[starts[i] : starts[i + 1]] = array
+        merged_array.flush()
+        del merged_array
+        os.replace(tmp_filename, output_filename)
+    except Exception:
+        # keep the input files and don't leave a partial output behind, the cause is re-raised
+        if os.path.isfile(tmp_filename):
+            os.remove(tmp_filename)
+        raise
+    return int(starts[-1])
+
+
+def merge_results_stores(
+    output_store_path: str, input_store_paths: List[str], num_threads: int = 4
+) -> None:
+    """Merges the results stores of tasks into one store by streaming each column, see stream_npy_files.
+
+    The header of the merged store is that of the first input store with the number of rows and results file updated. The results file, injections file, and number of rows of each input are listed under "merged_from" (in the order of the rows) since "inj_index" refers to the injections file of each input.
+
+    Args:
+        output_store_path: Path of the merged store directory.
+        input_store_paths: Paths of the input store directories.
+        num_threads: Number of threads reading the input files ahead.
+
+    Raises:
+        ValueError: If the input stores have different columns or versions.
+    """
+    stores = [ResultsStore(store_path) for store_path in input_store_paths]
+    columns = stores[0].columns
+    for store in stores:
+        if store.columns != columns or store.header["version"] != RESULTS_STORE_VERSION:
+            raise ValueError(
+                f"Store {store.store_path} doesn't match the columns {columns} and version {RESULTS_STORE_VERSION} of {stores[0].store_path}."
+            )
+    injections_files = set(store.header["injections_file"] for store in stores)
+    header = dict(
+        stores[0].header,
+        results_file=os.path.basename(output_store_path).replace(".store", ".npy"),
+        injections_file=injections_files.pop() if len(injections_files) == 1 else None,
+        merged_from=[
+            dict(
+                results_file=store.header["results_file"],
+                injections_file=store.header["injections_file"],
+                num_rows=len(store),
+            )
+            for store in stores
+        ],
+    )
+
+    tmp_path = f"{output_store_path}.{os.getpid()}.tmp"
+    try:
+        if os.path.isdir(tmp_path):
+            shutil.rmtree(tmp_path)
+        os.makedirs(tmp_path)
+        for column in columns:
+            header["num_rows"] = stream_npy_files(
+                os.path.join(tmp_path, column + ".npy"),
+                [os.path.join(store.store_path, column + ".npy") for store in stores],
+                num_threads,
+            )
+        with open(os.path.join(tmp_path, "header.json"), "w") as file:
+            json.dump(header, file, indent=1)
+        if os.path.isdir(output_store_path):
+            shutil.rmtree(output_store_path)
+        os.replace(tmp_path, output_store_path)
+    except Exception:
+        if os.path.isdir(tmp_path):
+            shutil.rmtree(tmp_path)
+        raise
+
+
 def merge_npy_files(
     output_filename: str,
     input_files: Optional[List[str]] = None,
     pattern: Optional[str] = None,
     input_path: Optional[str] = None,
     delete_input_files: bool = False,
+    num_threads: int = 4,
 ) -> None:
-    """Merges input or found .npy files into one .npy file.
+    """Merges input or found .npy files into one .npy file, streaming them into a preallocated memory map.
+
+    If the input files have results stores next to them (see results_store.py), then the stores are merged into one next to the output file as well. Either every input file or none must have a store, so that the merged store covers the same tasks as the merged file.
 
     Args:
         output_filename: Filename of output collated .npy data file with path.
         input_files: Filenames of input .npy files.
         pattern: Pattern to search for input .npy files if input_files isn't given.
         input_path: Path to where to search for pattern if given and input_files isn't.
-        delete_input_files: Whether to delete the input files if no error raised.
+        delete_input_files: Whether to delete the input files (and their stores) if no error raised.
+        num_threads: Number of threads reading the input files ahead.
 
     Raises:
-        Exception: If something goes wrong when concatenating arrays, which could be due to memory allocation.
+        ValueError: If there are no input files, their arrays (or stores) don't match, or only some of them have stores.
+        OSError: If reading or writing a file fails, e.g. when out of disk space. The input files are not deleted.
     """
-    # https://stackoverflow.com/questions/44164917/concatenating-numpy-arrays-from-a-directory
     if input_files is None:
         input_files = sorted(
             glob.glob(input_path + pattern)
         )  # sorted to make debugging printout easier to read
-    arrays = []
-    for input_file in input_files:
-        arrays.append(np.load(input_file))
-    # try to merge and if fails then don't delete input files
-    try:
-        # concatenate works with empty data arrays as long as they have shape=(0, 7) which is the case for without_rows_w_nan
-        merged_array = np.concatenate(arrays)
-        np.save(output_filename, merged_array)
-    except:
-        raise Exception(
-            "Something went wrong when concatenating arrays, check memory allocation."
+    input_store_paths = [results_store_path(input_file) for input_file in input_files]
+    # checked before writing anything, e.g. a task was run without full_results or its store was deleted
+    without_stores = [
+        input_file
+        for input_file, store_path in zip(input_files, input_store_paths)
+        if not os.path.isdir(store_path)
+    ]
+    merge_stores = len(without_stores) == 0
+    if 0 < len(without_stores) < len(input_files):
+        raise ValueError(
+            f"Only {len(input_files) - len(without_stores)} of {len(input_files)} input files to {output_filename} have results stores, these don't: "
+            + ", ".join(os.path.basename(input_file) for input_file in without_stores)
         )
-    else:
-        if delete_input_files:
-            for input_file in input_files:
-                os.remove(input_file)
+    # empty data arrays are fine as long as they have shape=(0, 7) which is the case for without_rows_w_nan
+    stream_npy_files(output_filename, input_files, num_threads)
+    if merge_stores:
+        merge_results_stores(
+            results_store_path(output_filename), input_store_paths, num_threads
+        )
+    if delete_input_files:
+        for input_file in input_files:
+            os.remove(input_file)
+        if merge_stores:
+            for store_path in input_store_paths:
+                shutil.rmtree(store_path)
+
+
+def merge_npy_files_for_tag(args: Tuple[str, List[str], bool, int]) -> Tuple[str, int]:
+    """Returns the output filename and number of input files after merging them, as merge_npy_files given a tuple of its arguments for parallel_map.
+
+    Args:
+        args: Output filename, input files, whether to delete the input files, and number of threads.
+    """
+    output_filename, input_files, delete_input_files, num_threads = args
+    merge_npy_files(
+        output_filename,
+        input_files=input_files,
+        delete_input_files=delete_input_files,
+        num_threads=num_threads,
+    )
+    return output_filename, len(input_files)
 
 
 def merge_all_task_npy_files(
@@ -112,33 +301,89 @@ def merge_all_task_npy_files(
     pattern: str = "results_NET_*_SCI-CASE_*_WF_*_INJS-PER-ZBIN_*_TASK_*.npy",
     output_path: str = "./data_processed_injections/",
     delete_input_files: bool = False,
+    num_processes: int = 4,
+    num_threads: int = 4,
+    display_progress_bar: bool = False,
+    inj_data_path: Optional[str] = None,
+    injections_files: Optional[List[str]] = None,
+    raise_error_if_gaps: bool = False,
 ) -> None:
     """Merges all processed .npy data files from slurm tasks into one .npy file per network and science case combination.
 
+    The task files are grouped using task_files_index and merged in order of task ID, and missing task IDs are printed as gaps before merging. Each combination (tag) is merged in a separate process, with a thread pool per process reading its task files ahead, so that merging is limited by I/O rather than memory.
+
     Args:
         input_path: Path to processed .npy data files from slurm tasks.
         pattern: Pattern to match input task files.
         output_path: Path to save merged .npy data files.
         delete_input_files: Whether to delete the input task files after successful merging.
+        num_processes: Number of tags to merge in parallel, 1 merges them one after another.
+        num_threads: Number of threads reading task files ahead in each process.
+        display_progress_bar: Whether to display a progress bar over the tags.
+        inj_data_path: Path to the injections task files to expect the task IDs of for each science case, e.g. "./data_raw_injections/task_files/".
+        injections_files: Master injections files processed by work queues (see work_queue.py) to expect the chunk IDs of for each science case, read from the queues in input_path. Without this or inj_data_path, all task IDs from the least to the greatest of each tag are expected, which misses the chunks at the end of a queue.
+        raise_error_if_gaps: Whether to raise an error instead of merging if task IDs are missing.
+
+    Raises:
+        ValueError: If raise_error_if_gaps and task IDs are missing, or if only some task files of a tag have results stores.
+        FileNotFoundError: If the work queue of one of injections_files isn't in input_path.
     """
-    task_files = sorted(
-        glob.glob(input_path + pattern)
-    )  # sorted to make debugging printout easier to read
-    # split into separate network+sc+wf combinations
-    # dict(tag1=[net1-task1, net1-task2], tag2=[net2-task1, net2-task2], ...)
+    # split into separate network+sc+wf combinations in one pass over the (manifest of the) directory
+    # dict(tag1=[net1-task1, net1-task2], tag2=[net2-task1, net2-task2], ...) in order of task ID
+    # the number of injections is not in the tag to capture tasks which contain different numbers of injections
     dict_tag_task_files: Dict[str, List[str]] = dict()
-    for file in task_files:
-        # remove num_injs from file_tag to capture the last injection task which contains more injections since 1024 doesn't divide the injections remaining after initial filtering
-        file_tag_net_sc_wf = file_tag_from_task_file(file, cut_num_injs=True)
-        # if it is not already in the dict, then find all matches and add them
-        if not file_tag_net_sc_wf in dict_tag_task_files.keys():
-            dict_tag_task_files[file_tag_net_sc_wf] = [
-                file
-                for file in task_files
-                if file_tag_net_sc_wf
-                == file_tag_from_task_file(file, cut_num_injs=True)
+    dict_tag_task_ids: Dict[str, List[int]] = dict()
+    for tag, entries in task_files_index(input_path).items():
+        entries = [
+            (task_id, file_name)
+            for task_id, file_name in entries
+            if fnmatch(file_name, pattern)
+        ]
+        if len(entries) == 0:
+            continue
+        file_tag_net_sc_wf = file_tag_from_task_file(entries[0][1], cut_num_injs=True)
+        dict_tag_task_ids[file_tag_net_sc_wf] = [task_id for task_id, _ in entries]
+        dict_tag_task_files[file_tag_net_sc_wf] = [
+            input_path + file_name for _, file_name in entries
+        ]
+
+    # report missing tasks, e.g. that failed or timed out, before merging
+    # dict(science_case=[task_id1, task_id2, ...]) of the expected task IDs
+    expected_task_ids_by_science_case: Dict[str, List[int]] = dict()
+    if inj_data_path is not None:
+        for inj_tag, entries in task_files_index(inj_data_path).items():
+            expected_task_ids_by_science_case[inj_tag.split("_SCI-CASE_")[1]] = [
+                task_id for task_id, _ in entries
             ]
+    if injections_files is not None:
+        for injections_file in injections_files:
+            science_case = (
+                os.path.basename(injections_file)
+                .split("_SCI-CASE_")[1]
+                .split("_INJS-PER-ZBIN_")[0]
+            )
+            expected_task_ids_by_science_case[science_case] = work_queue_chunk_ids(
+                work_queue_file_name(injections_file, input_path)
+            )
+    gaps_found = False
+    for file_tag_net_sc_wf, task_ids in dict_tag_task_ids.items():
+        science_case = file_tag_net_sc_wf.split("_SCI-CASE_")[1].split("_WF_")[0]
+        gaps = task_id_gaps(
+            task_ids, expected_task_ids_by_science_case.get(science_case)
+        )
+        if gaps:
+            gaps_found = True
+            print(
+                f"Missing task IDs for {file_tag_net_sc_wf}:",
+                ", ".join(
+                    str(start) if start == stop else f"{start}-{stop}"
+                    for start, stop in gaps
+                ),
+            )
+    if gaps_found and raise_error_if_gaps:
+        raise ValueError(f"Task files missing from {input_path}, see above.")
 
+    merge_jobs = []
     for file_tag_net_sc_wf, task_files_same_tag in dict_tag_task_files.items():
         # calculate total number of injections if all injections had well-conditioned FIMs, no longer assuming that all have the same initial number of injections. replace '.npy' to deal with non-task files
         #         total_num_injs_per_zbin = sum(
@@ -162,17 +407,27 @@ def merge_all_task_npy_files(
             output_path
             + f"results_{file_tag_net_sc_wf}_INJS-PER-ZBIN_{input_num_injs}.npy"
         )
-        merge_npy_files(
-            output_filename,
-            input_files=task_files_same_tag,
-            delete_input_files=delete_input_files,
+        merge_jobs.append(
+            (output_filename, task_files_same_tag, delete_input_files, num_threads)
         )
 
+    parallel_map(
+        merge_npy_files_for_tag,
+        merge_jobs,
+        display_progress_bar=display_progress_bar,
+        unordered=True,
+        num_cpus=min(num_processes, max(len(merge_jobs), 1)),
+        parallel=num_processes > 1 and len(merge_jobs) > 1,
+    )
+
 
 if __name__ == "__main__":
-    # TODO: add progress bar, parallelise merging
-    if len(sys.argv[1:]) == 1:
+    if len(sys.argv[1:]) >= 1:
         delete_input_files = int(sys.argv[1])
     else:
         delete_input_files = 0
-    merge_all_task_npy_files(delete_input_files=bool(delete_input_files))
+    merge_all_task_npy_files(
+        delete_input_files=bool(delete_input_files),
+        display_progress_bar=True,
+        injections_files=sys.argv[2:] if len(sys.argv[1:]) > 1 else None,
+    )
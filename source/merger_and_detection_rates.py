@@ -37,17 +37,19 @@ License:
 """
 
 from typing import List, Set, Dict, Tuple, Optional, Union, Callable, Any
+from numpy.typing import NDArray
+from functools import lru_cache, partial
+import numpy as np
 from constants import (
-    PI,
     GWTC3_MERGER_RATE_BNS,
     GWTC3_MERGER_RATE_BBH,
     GWTC2_MERGER_RATE_BNS,
     GWTC2_MERGER_RATE_BBH,
 )
 
-from scipy.integrate import quad
+from scipy.integrate import quad, cumulative_trapezoid
 from astropy.cosmology import Planck18
-from gwbench import injections
+from gwbench import injections, cosmology
 
 
 def merger_rate_normalisations_from_gwtc_norm_tag(
@@ -69,20 +71,44 @@ def merger_rate_normalisations_from_gwtc_norm_tag(
         raise ValueError("Normalisation not recognised.")
 
 
-def differential_comoving_volume(z: float) -> float:
-    """Returns the differential comoving volume at a given redshift.
+def differential_comoving_volume(
+    z: Union[float, NDArray[np.float64]]
+) -> Union[float, NDArray[np.float64]]:
+    """Returns the differential comoving volume at a given redshift or array of redshifts.
 
-    Uses the Planck18 cosmology.
-    Follows the formula: $\frac{\text{d}V}{\text{d}z}(z)$ in B&S2022; 4*pi to convert from Mpc^3 sr^-1 (sr is steradian) to Mpc^3.
+    Uses the Planck18 cosmology, looked up in the spline table of gwbench.cosmology instead of integrated by astropy for every redshift.
+    Follows the formula: $\frac{\text{d}V}{\text{d}z}(z)$ in B&S2022; over the whole sky, i.e. 4*pi times the Mpc^3 sr^-1 (sr is steradian) of astropy, in Mpc^3.
 
     Args:
         z: Redshift.
     """
-    return 4.0 * PI * Planck18.differential_comoving_volume(z).value
+    return cosmology.differential_comoving_volume(z, Planck18)
 
 
-def merger_rate_bns(z: float, normalisation: float = GWTC3_MERGER_RATE_BNS) -> float:
-    """Returns the binary neutron-star merger rate at a given redshift.
+@lru_cache(maxsize=None)
+def merger_rate_prefactor(science_case: str, normalisation: float) -> float:
+    """Returns the factor that scales the merger rate density of injections.py to the normalisation at z = 0 in Mpc^-3 yr^-1, computed once per science case and normalisation.
+
+    Args:
+        science_case: Science case, i.e. "BNS" or "BBH".
+        normalisation: Merger rate normalisation from merger_rate_normalisations_from_gwtc_norm_tag.
+
+    Raises:
+        ValueError: If the science case is not recognised.
+    """
+    # 1e-9 converts Gpc^-3 to Mpc^-3 to match Planck18
+    if science_case == "BNS":
+        return normalisation / injections.bns_md_merger_rate(0) * 1e-9
+    elif science_case == "BBH":
+        return normalisation / injections.mdbn_merger_rate(0) * 1e-9
+    else:
+        raise ValueError("Science case not recognised.")
+
+
+def merger_rate_bns(
+    z: Union[float, NDArray[np.float64]], normalisation: float = GWTC3_MERGER_RATE_BNS
+) -> Union[float, NDArray[np.float64]]:
+    """Returns the binary neutron-star merger rate at a given redshift or array of redshifts.
 
     Formula: $R(z)$ in B&S2022; normalisation of merger rate density $\dot{n}(z)$ in the source frame to GWTC3_MERGER_RATE_BNS in https://arxiv.org/pdf/2111.03606v2.pdf.
     1e-9 converts Gpc^-3 to Mpc^-3 to match Planck18, in Fig 2 of Ngetal2021: the ndot_F rate is in Gpc^-3 yr^-1, injections.py cites v1 of an arXiv .pdf
@@ -92,16 +118,16 @@ def merger_rate_bns(z: float, normalisation: float = GWTC3_MERGER_RATE_BNS) -> f
         normalisation: Merger rate normalisation from merger_rate_normalisations_from_gwtc_norm_tag.
     """
     return (
-        normalisation
-        / injections.bns_md_merger_rate(0)
-        * 1e-9
+        merger_rate_prefactor("BNS", normalisation)
         * injections.bns_md_merger_rate(z)
         * differential_comoving_volume(z)
     )
 
 
-def merger_rate_bbh(z: float, normalisation: float = GWTC3_MERGER_RATE_BBH) -> float:
-    """Returns the binary black-hole merger rate at a given redshift.
+def merger_rate_bbh(
+    z: Union[float, NDArray[np.float64]], normalisation: float = GWTC3_MERGER_RATE_BBH
+) -> Union[float, NDArray[np.float64]]:
+    """Returns the binary black-hole merger rate at a given redshift or array of redshifts.
 
     Formula: $R(z)$ in B&S2022; normalisation of merger rate density $\dot{n}(z)$ in the source frame to GWTC3_MERGER_RATE_BBH in https://arxiv.org/pdf/2111.03606v2.pdf.
     1e-9 converts Gpc^-3 to Mpc^-3 to match Planck18, in Fig 2 of Ngetal2021: the ndot_F rate is in Gpc^-3 yr^-1, injections.py cites v1 of an arXiv .pdf
@@ -111,14 +137,33 @@ def merger_rate_bbh(z: float, normalisation: float = GWTC3_MERGER_RATE_BBH) -> f
         normalisation: Merger rate normalisation from merger_rate_normalisations_from_gwtc_norm_tag.
     """
     return (
-        normalisation
-        / injections.mdbn_merger_rate(0)
-        * 1e-9
+        merger_rate_prefactor("BBH", normalisation)
         * injections.mdbn_merger_rate(z)
         * differential_comoving_volume(z)
     )
 
 
+def merger_rate_for_science_case(
+    science_case: str, norm_tag: str = "GWTC3"
+) -> Callable[[Union[float, NDArray[np.float64]]], Union[float, NDArray[np.float64]]]:
+    """Returns the merger rate function of a science case normalised to a survey, e.g. merger_rate_bns with the normalisation of norm_tag.
+
+    Args:
+        science_case: Science case, i.e. "BNS" or "BBH".
+        norm_tag: Tag of the survey to normalise merger rates to, e.g. "GWTC3" or "GWTC2".
+
+    Raises:
+        ValueError: If the science case or survey tag is not recognised.
+    """
+    normalisations = merger_rate_normalisations_from_gwtc_norm_tag(norm_tag)
+    if science_case == "BNS":
+        return partial(merger_rate_bns, normalisation=normalisations[0])
+    elif science_case == "BBH":
+        return partial(merger_rate_bbh, normalisation=normalisations[1])
+    else:
+        raise ValueError("Science case not recognised.")
+
+
 def merger_rate_in_obs_frame(
     merger_rate: Callable[..., float], z: float, **kwargs: Any
 ) -> float:
@@ -134,6 +179,36 @@ def merger_rate_in_obs_frame(
     return merger_rate(z, **kwargs) / (1 + z)
 
 
+@lru_cache(maxsize=256)
+def total_merger_count(
+    science_case: str,
+    zmin: float,
+    zmax: float,
+    norm_tag: str = "GWTC3",
+    observation_time_in_years: float = 10,
+) -> float:
+    """Returns the expected number of mergers between two redshifts over an observation time, integrating the merger rate in the observer's frame.
+
+    Memoised since every plotting task (e.g. cosmological_redshift_sample) asks for the same few counts.
+
+    Args:
+        science_case: Science case, i.e. "BNS" or "BBH".
+        zmin: Minimum redshift.
+        zmax: Maximum redshift.
+        norm_tag: Tag of the survey to normalise merger rates to.
+        observation_time_in_years: Observation time in years.
+
+    Raises:
+        ValueError: If the science case or survey tag is not recognised.
+    """
+    merger_rate = merger_rate_for_science_case(science_case, norm_tag)
+    # quad returns (value, error), [0] to get value
+    return (
+        observation_time_in_years
+        * quad(lambda z: merger_rate_in_obs_frame(merger_rate, z), zmin, zmax)[0]
+    )
+
+
 def detection_rate(
     merger_rate: Callable[..., float],
     detection_efficiency: Callable[[float, float], float],
@@ -175,3 +250,56 @@ def detection_rate_limit(
     """
     # snr threshold of 0 is arbitrary since the efficiency is constant
     return detection_rate(merger_rate, lambda _, __: 1, z0, 0, **kwargs)
+
+
+def cumulative_detection_rate(
+    merger_rate: Callable[..., NDArray[np.float64]],
+    detection_efficiency: Optional[
+        Callable[[NDArray[np.float64]], NDArray[np.float64]]
+    ] = None,
+    zmin: float = 1e-6,
+    zmax: float = 1e3,
+    num_zs: int = 30001,
+    **kwargs: Any
+) -> Callable[[Union[float, NDArray[np.float64]]], Union[float, NDArray[np.float64]]]:
+    """Returns the detection rate as a function of the maximum redshift, tabulated once instead of integrated for every maximum redshift.
+
+    The integrand of detection_rate (or of detection_rate_limit if detection_efficiency is None) is evaluated on a dense grid in log(z) from zmin to zmax and integrated cumulatively with the trapezoidal rule in log(z). The detection rate out to z0 is then interpolated from the cumulative integral, e.g. for a whole curve in one call. Below zmin, the detection rate is extrapolated as z0^3 since dV/dz ~ z^2 and the efficiency is constant there. Beyond zmax, the detection rate is taken as that out to zmax.
+
+    Args:
+        merger_rate: Merger rate function of the form merger_rate(z, **kwargs), e.g. merger_rate_bns, that takes arrays of redshifts.
+        detection_efficiency: Detection efficiency function of the form detection_efficiency(z) for a given SNR threshold that takes arrays of redshifts, e.g. a sigmoid fit. Defaults to perfect efficiency.
+        zmin: Least redshift of the grid.
+        zmax: Greatest redshift of the grid.
+        num_zs: Number of redshifts in the grid.
+        **kwargs: Options passed to merger_rate.
+    """
+    log_zs = np.linspace(np.log(zmin), np.log(zmax), num_zs)
+    zs = np.exp(log_zs)
+    integrand = merger_rate(zs, **kwargs) / (1 + zs)
+    if detection_efficiency is not None:
+        # sigmoid fits overflow to zero efficiency at high redshift
+        with np.errstate(over="ignore"):
+            integrand = integrand * detection_efficiency(zs)
+    # dz = z dlog(z), the integral from 0 to zmin is integrand(zmin)*zmin/3 for integrand ~ z^2
+    cumulative = integrand[0] * zmin / 3 + cumulative_trapezoid(
+        integrand * zs, log_zs, initial=0
+    )
+
+    def det_rate(
+        z0: Union[float, NDArray[np.float64]]
+    ) -> Union[float, NDArray[np.float64]]:
+        """Returns the detection rate from zero out to the given redshift(s).
+
+        Args:
+            z0: Maximum redshift to integrate detection rate from zero out to, or an array of them.
+        """
+        z0 = np.asarray(z0, dtype=float)
+        res = np.asarray(np.interp(np.log(np.maximum(z0, zmin)), log_zs, cumulative))
+        below = z0 < zmin
+        res[below] = cumulative[0] * (np.maximum(z0[below], 0) / zmin) ** 3
+        if res.ndim == 0:
+            return float(res)
+        return res
+
+    return det_rate
@@ -40,7 +40,7 @@ from typing import List, Set, Dict, Tuple, Optional, Union, Type
 from numpy.typing import NDArray
 
 from results_class import InjectionResults
-from useful_functions import HiddenPrints, parallel_map
+from useful_functions import HiddenPrints
 from constants import SNR_THRESHOLD_LO, SNR_THRESHOLD_HI
 from networks import DICT_NETSPEC_TO_COLOUR
 from filename_search_and_manipulation import (
@@ -76,7 +76,7 @@ def collate_eff_detrate_vs_redshift(
         zaxis_plot: Redshift axis to plot over.
         colours: Colours for the detection efficiency and rate plots. Defaults to using the same colour for each plot.
         label: Legend label for the results.
-        parallel: Whether to parallelize the computation.
+        parallel: Unused, kept for compatibility since the detection rates are interpolated on the whole redshift axis at once.
     """
     if colours is None:
         colours = [None, None]  # list is mutable, None is not
@@ -116,23 +116,15 @@ def collate_eff_detrate_vs_redshift(
 
     # detection rate vs redshift
     # merger rate depends on star formation rate and the delay between formation and merger
-    # use display_progress_bar in parallel_map to restore old p_map usage
+    # the detection rates are interpolated on the whole axis at once
     axs[1].loglog(
         zaxis_plot,
-        parallel_map(
-            lambda z: results.det_rate(z, snr_threshold=10),
-            zaxis_plot,
-            parallel=parallel,
-        ),
+        results.det_rate(zaxis_plot, snr_threshold=10),
         color=line_lo.get_color(),
     )
     axs[1].loglog(
         zaxis_plot,
-        parallel_map(
-            lambda z: results.det_rate(z, snr_threshold=100),
-            zaxis_plot,
-            parallel=parallel,
-        ),
+        results.det_rate(zaxis_plot, snr_threshold=100),
         color=line_hi.get_color(),
         linestyle="--",
     )
@@ -167,7 +159,7 @@ def compare_detection_rate_of_networks_from_saved_results(
         specific_wf: If specified, then filters to only show the given waveform.
         print_progress: Whether to print progress statements.
         data_path: Path to processed injections data files.
-        parallel: Whether to parallelize the computation.
+        parallel: Unused, kept for compatibility, see collate_eff_detrate_vs_redshift.
         debug: Whether to print debug statements.
         norm_tag: Survey to normalise cosmological merger rates to.
     """
@@ -223,7 +215,7 @@ def compare_detection_rate_of_networks_from_saved_results(
         if i == 0:
             axs[1].loglog(
                 zaxis_plot,
-                parallel_map(results.det_rate_limit, zaxis_plot, parallel=parallel),
+                results.det_rate_limit(zaxis_plot),
                 color="black",
                 linewidth=3,
                 label=f"{results.science_case} merger rate",
@@ -41,18 +41,24 @@ License:
 from typing import List, Set, Dict, Tuple, Optional, Union, Callable
 from numpy.typing import NDArray
 from merger_and_detection_rates import *  # also loads Plank18
-from useful_functions import without_rows_w_nan, sigmoid_3parameter, parallel_map
+from useful_functions import without_rows_w_nan, sigmoid_3parameter
 from constants import SNR_THRESHOLD_LO, SNR_THRESHOLD_HI
 from filename_search_and_manipulation import (
     network_spec_to_net_label,
     net_label_styler,
     filename_to_netspec_sc_wf_injs,
+    find_task_file,
 )
 from useful_plotting_functions import force_log_grid
 from network_subclass import set_file_tags
+from results_store import (
+    ResultsStore,
+    results_store_path,
+    LEGACY_RESULTS_COLUMNS,
+)
 
 import numpy as np
-import glob
+import os
 import matplotlib.pyplot as plt
 from scipy.stats import gmean
 from scipy.optimize import curve_fit
@@ -64,12 +70,14 @@ class InjectionResults(object):
     """Class for results processing, besides the results array it has common things like the science case, network, and label.
 
     Information is stored in the filename of the data file, this is extracted for later reference. The columns of the data file are also labelled for readability. The detection efficiency and rate can also be calculated.
+    The data file is memory-mapped, so columns are only read when used. If there is a results store next to it (see results_store.py), or the store is given instead of the .npy file, then its memory-mapped columns are available through the store attribute, e.g. results.store["inj_params"], and the covariance and Fisher matrices through covariance_matrices and fisher_matrices.
 
     Attributes:
         file_name (str): File name for processed results .npy data file without path (slightly more flexible than this).
         data_path (str): Path to the data file.
         file_name_with_path (str): File name for processed results .npy data file with path.
-        results (NDArray[NDArray[np.float64]]): Loaded .npy data file, rows are different injections, columns are different variables.
+        results (NDArray[NDArray[np.float64]]): Memory-mapped .npy data file, rows are different injections, columns are different variables.
+        store (Optional[ResultsStore]): Results store with the injection index and parameters, detector SNRs, condition numbers, and packed covariance and Fisher matrices, None if there isn't one.
         redshift (NDArray[np.float64]): Redshift of injections.
         snr (NDArray[np.float64]): Signal-to-noise ratio of injections.
         err_logMc (NDArray[np.float64]): Fractional measurement error of chirp mass of injections.
@@ -98,8 +106,8 @@ class InjectionResults(object):
         zmax_plot (float): Maximum redshift for plotting.
         zavg_efflo_effhi (NDArray[NDArray[np.float64]]): Detection efficiency across the redshift range, for each redshift sub-bin contains the geometric mean and the proportion of sources above the low and high SNR thresholds.
         det_eff_fits (List[Callable[[float], float]]): 3-parameter sigmoid fits to the low and high SNR threshold detection efficiency curves.
-        det_rate_limit (Callable[[float], float]): Maximum possible detection rate, i.e. actual number of sources merger rate, at a given redshift.
-        det_rate (Callable[[float, float], float]): Detection rate at a given redshift for a given SNR threshold (low or high).
+        det_rate_limit (Callable[[float], float]): Maximum possible detection rate, i.e. actual number of sources merger rate, at a given redshift or array of redshifts.
+        det_rate (Callable[[float, float], float]): Detection rate at a given redshift or array of redshifts for a given SNR threshold (low or high). Both are interpolated from cumulative integrals tabulated once, see cumulative_detection_rate.
     """
 
     def __init__(
@@ -108,7 +116,7 @@ class InjectionResults(object):
         """Initialises InjectionResults with all non--detection rate attributes.
 
         Args:
-            file_name: Filename of .npy processed injections data file with or without path depending on whether data_path is given.
+            file_name: Filename of .npy processed injections data file, or of its .store results store, with or without path depending on whether data_path is given.
             data_path: Path to the data file.
             norm_tag: Survey to normalise cosmological merger rates to.
         """
@@ -126,7 +134,20 @@ class InjectionResults(object):
 
         self.file_name, self.data_path = file_name, data_path
         self.file_name_with_path = self.data_path + self.file_name
-        self.results = np.load(self.file_name_with_path)
+        if self.file_name.endswith(".store"):
+            self.store = ResultsStore(self.file_name_with_path)
+            self.results = np.column_stack(
+                [self.store[key] for key in LEGACY_RESULTS_COLUMNS]
+            ).reshape(-1, len(LEGACY_RESULTS_COLUMNS))
+            # the metadata in the file name of the .npy data file that the store was saved with
+            results_file_name = self.store.header["results_file"]
+        else:
+            self.results = np.load(self.file_name_with_path, mmap_mode="r")
+            if os.path.isdir(results_store_path(self.file_name_with_path)):
+                self.store = ResultsStore(results_store_path(self.file_name_with_path))
+            else:
+                self.store = None
+            results_file_name = self.file_name
         (
             self.redshift,
             self.snr,
@@ -142,22 +163,45 @@ class InjectionResults(object):
             self.wf_model_name,
             self.wf_other_var_dic,
             self.num_injs,
-        ) = filename_to_netspec_sc_wf_injs(self.file_name)
+        ) = filename_to_netspec_sc_wf_injs(results_file_name)
         self.remaining_num_injs = self.results.shape[0]
         self.label = network_spec_to_net_label(self.network_spec)
         set_file_tags(self)
         self.norm_tag = norm_tag
-        if "_TASK_" in self.file_name:
+        if "_TASK_" in results_file_name:
             self.task_id = int(
-                self.file_name.replace(".npy", "_TASK_").split("_TASK_")[1]
+                results_file_name.replace(".npy", "_TASK_").split("_TASK_")[1]
+            )
+            # looked up in the manifest of the injections task files instead of globbing the directory for every task
+            self.injections_task_file_name = find_task_file(
+                "./data_raw_injections/task_files/",
+                self.task_id,
+                tag=f"injections_SCI-CASE_{self.science_case}",
             )
-            self.injections_task_file_name = glob.glob(
-                f"./data_raw_injections/task_files/*TASK_{self.task_id}.npy"
-            )[0]
             self.initial_task_num_injs = np.load(self.injections_task_file_name).shape[
                 0
             ]
 
+    def covariance_matrices(self) -> NDArray[NDArray[NDArray[np.float64]]]:
+        """Returns the (injection, parameter, parameter) covariance matrices from the results store, the parameters are ordered as in self.store.header["deriv_variables"].
+
+        Raises:
+            ValueError: If there is no results store.
+        """
+        if self.store is None:
+            raise ValueError(f"No results store for {self.file_name_with_path}.")
+        return self.store.matrices("cov")
+
+    def fisher_matrices(self) -> NDArray[NDArray[NDArray[np.float64]]]:
+        """Returns the (injection, parameter, parameter) Fisher matrices from the results store, the parameters are ordered as in self.store.header["deriv_variables"].
+
+        Raises:
+            ValueError: If there is no results store.
+        """
+        if self.store is None:
+            raise ValueError(f"No results store for {self.file_name_with_path}.")
+        return self.store.matrices("fisher")
+
     def calculate_and_set_detection_rate(self, print_reach: bool = False) -> None:
         """Calculates detection rate and auxiliary quantities and sets them as attributes.
 
@@ -283,34 +327,47 @@ class InjectionResults(object):
                 if reach == reach_initial_guess:
                     print("! Reach converged to initial guess, examine local slope.")
 
-        normalisations = merger_rate_normalisations_from_gwtc_norm_tag(self.norm_tag)
-        if self.science_case == "BNS":
-            merger_rate = lambda z: merger_rate_bns(z, normalisation=normalisations[0])
-        elif self.science_case == "BBH":
-            merger_rate = lambda z: merger_rate_bbh(z, normalisation=normalisations[1])
-        else:
-            raise ValueError("Science case not recognised.")
+        merger_rate = merger_rate_for_science_case(self.science_case, self.norm_tag)
+
+        # tabulate the cumulative detection rates once, every det_rate(z0) is then interpolated, e.g. a whole curve in one call
+        cumulative_det_rate_limit = cumulative_detection_rate(merger_rate)
+        cumulative_det_rates = dict(
+            (snr_threshold, cumulative_detection_rate(merger_rate, det_eff_fit))
+            for snr_threshold, det_eff_fit in zip((10.0, 100.0), self.det_eff_fits)
+        )
 
-        def det_rate_limit(z0: float) -> float:
+        def det_rate_limit(
+            z0: Union[float, NDArray[np.float64]]
+        ) -> Union[float, NDArray[np.float64]]:
             """Returns the maximum possible detection rate, i.e. the total number of sources.
 
             Formula: $D_R(z, \rho_\ast)|_{\varepsilon=1}$ in B&S2022;i.e. "merger rate" in Fig 2, not R(z) but int R(z)/(1+z), i.e. if perfect efficiency.
 
             Args:
-                z0: Maximum redshift to integrate detection rate from zero out to.
+                z0: Maximum redshift to integrate detection rate from zero out to, or an array of them.
             """
-            return detection_rate_limit(merger_rate, z0)
+            return cumulative_det_rate_limit(z0)
 
-        def det_rate(z0: float, snr_threshold: float) -> float:
+        def det_rate(
+            z0: Union[float, NDArray[np.float64]], snr_threshold: float
+        ) -> Union[float, NDArray[np.float64]]:
             """Returns the detection rate above a given threshold.
 
             Formula: $D_R(z, \rho_\ast)$ in B&S2022.
 
             Args:
-                z0: Maximum redshift to integrate detection rate from zero out to.
+                z0: Maximum redshift to integrate detection rate from zero out to, or an array of them.
                 snr_threshold: Signal-to-noise ratio detection threshold.
+
+            Raises:
+                ValueError: If the SNR threshold is not recognised.
             """
-            return detection_rate(merger_rate, _det_eff, z0, snr_threshold)
+            if snr_threshold not in cumulative_det_rates:
+                # TODO: add this feature
+                raise ValueError(
+                    "SNR thresholds other than 10 or 100 are not yet supported"
+                )
+            return cumulative_det_rates[snr_threshold](z0)
 
         # TODO: do this using global?
         self.det_rate_limit = det_rate_limit
@@ -333,7 +390,7 @@ class InjectionResults(object):
             save_fig: Whether to save the plot, uses a generated filename.
             file_extension: File extension to save plot as.
             print_progress: Whether to print progress statements.
-            parallel: Whether to parallelize the computation.
+            parallel: Unused, kept for compatibility since the detection rates are interpolated on the whole redshift axis at once.
         """
         # checking that detection rate exists and calculating it if it doesn't; pythonic way of try/except AttributeError is an uglier solution
         if any(
@@ -410,30 +467,22 @@ class InjectionResults(object):
 
         # detection rate vs redshift
         # merger rate depends on star formation rate and the delay between formation and merger
-        # use display_progress_bar in parallel_map to restore old p_map usage
+        # the detection rates are interpolated on the whole axis at once
         axs[2].loglog(
             zaxis_plot,
-            parallel_map(self.det_rate_limit, zaxis_plot, parallel=parallel),
+            self.det_rate_limit(zaxis_plot),
             color="black",
             linewidth=1,
         )
         axs[2].loglog(
             zaxis_plot,
-            parallel_map(
-                lambda z: self.det_rate(z, snr_threshold=10),
-                zaxis_plot,
-                parallel=parallel,
-            ),
+            self.det_rate(zaxis_plot, snr_threshold=10),
             "-",
             color=colour,
         )
         axs[2].loglog(
             zaxis_plot,
-            parallel_map(
-                lambda z: self.det_rate(z, snr_threshold=100),
-                zaxis_plot,
-                parallel=parallel,
-            ),
+            self.det_rate(zaxis_plot, snr_threshold=100),
             "--",
             color=colour,
         )
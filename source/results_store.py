@@ -0,0 +1,228 @@
+"""Self-describing, memory-mappable store of the processed results of a network, including the injections and their full covariance matrices.
+
+Alongside each bare (N, 7) results .npy file, the injection index and parameters, the SNR of each detector, the condition number, and the packed upper triangles of the covariance and Fisher matrices are saved as columns in a directory with a metadata header. New derived quantities can then be calculated from the stored covariances without reprocessing the injections.
+
+License:
+    BSD 3-Clause License
+
+    Copyright (c) 2022, James Gardner.
+    All rights reserved except for those for the gwbench code which remain reserved
+    by S. Borhanian; the gwbench code is included in this repository for convenience.
+
+    Redistribution and use in source and binary forms, with or without
+    modification, are permitted provided that the following conditions are met:
+
+    1. Redistributions of source code must retain the above copyright notice, this
+       list of conditions and the following disclaimer.
+
+    2. Redistributions in binary form must reproduce the above copyright notice,
+       this list of conditions and the following disclaimer in the documentation
+       and/or other materials provided with the distribution.
+
+    3. Neither the name of the copyright holder nor the names of its
+       contributors may be used to endorse or promote products derived from
+       this software without specific prior written permission.
+
+    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+    AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+    IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+    DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+    FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+    DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+    SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+    CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+    OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+    OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+from typing import List, Set, Dict, Tuple, Optional, Union, Any
+from numpy.typing import NDArray
+import os
+import json
+import shutil
+import numpy as np
+
+# version of the layout of the stores, increment if the columns change
+RESULTS_STORE_VERSION = 1
+# the columns of the bare (N, 7) results .npy files, the first columns of a row of results
+LEGACY_RESULTS_COLUMNS = (
+    "redshift",
+    "snr",
+    "err_logMc",
+    "err_logDL",
+    "err_eta",
+    "err_iota",
+    "sky_area_90",
+)
+
+
+def num_packed(num_params: int) -> int:
+    """Returns the length of the packed upper triangle (including the diagonal) of a square matrix.
+
+    Args:
+        num_params: Number of rows (and columns) of the matrix, e.g. derivative variables of a Fisher matrix.
+    """
+    return num_params * (num_params + 1) // 2
+
+
+def pack_upper_triangle(matrices: NDArray[np.float64]) -> NDArray[np.float64]:
+    """Returns the row-major upper triangles of symmetric matrices with shape (..., n, n) packed into shape (..., n(n+1)/2).
+
+    Args:
+        matrices: Symmetric matrices, e.g. a stack of Fisher matrices.
+    """
+    inds = np.triu_indices(matrices.shape[-1])
+    return matrices[..., inds[0], inds[1]]
+
+
+def unpack_upper_triangle(packed: NDArray[np.float64]) -> NDArray[np.float64]:
+    """Returns the symmetric matrices with shape (..., n, n) from their packed upper triangles with shape (..., n(n+1)/2), the inverse of pack_upper_triangle.
+
+    Args:
+        packed: Packed upper triangles, e.g. the "cov" column of a store.
+    """
+    num_params = int(round((np.sqrt(8 * packed.shape[-1] + 1) - 1) / 2))
+    inds = np.triu_indices(num_params)
+    matrices = np.empty(packed.shape[:-1] + (num_params, num_params))
+    matrices[..., inds[0], inds[1]] = packed
+    matrices[..., inds[1], inds[0]] = packed
+    return matrices
+
+
+def results_row_slices(num_dets: int, num_params: int) -> Dict[str, slice]:
+    """Returns the slice of each column in a full row of results of a network, as from multi_network_results_for_injection with misc_settings_dict["full_results"].
+
+    A full row is the seven legacy columns, the condition number of the Fisher matrix, the SNR of each detector, and the packed upper triangles of the covariance and Fisher matrices.
+
+    Args:
+        num_dets: Number of detectors in the network.
+        num_params: Number of derivative variables.
+    """
+    slices = dict(
+        (key, slice(i, i + 1)) for i, key in enumerate(LEGACY_RESULTS_COLUMNS)
+    )
+    lengths = (
+        ("cond_num", 1),
+        ("det_snr", num_dets),
+        ("cov", num_packed(num_params)),
+        ("fisher", num_packed(num_params)),
+    )
+    start = len(LEGACY_RESULTS_COLUMNS)
+    for key, length in lengths:
+        slices[key] = slice(start, start + length)
+        start += length
+    return slices
+
+
+def results_row_length(num_dets: int, num_params: int) -> int:
+    """Returns the length of a full row of results of a network, see results_row_slices.
+
+    Args:
+        num_dets: Number of detectors in the network.
+        num_params: Number of derivative variables.
+    """
+    return len(LEGACY_RESULTS_COLUMNS) + 1 + num_dets + 2 * num_packed(num_params)
+
+
+def results_store_path(results_file_name_with_path: str) -> str:
+    """Returns the path of the store (a directory) next to a bare results .npy file.
+
+    Args:
+        results_file_name_with_path: Results .npy filename with path.
+    """
+    return results_file_name_with_path.replace(".npy", ".store")
+
+
+def save_results_store(
+    store_path: str, columns: Dict[str, NDArray], header: Dict[str, Any]
+) -> None:
+    """Saves the columns of results as .npy files in a directory with a header.json of metadata, replacing any existing store.
+
+    The directory is written under a temporary name and renamed, so that a store is never partially written.
+
+    Args:
+        store_path: Path of the store directory, e.g. from results_store_path.
+        columns: Arrays with the same first dimension (rows are injections) keyed by column name.
+        header: Metadata, e.g. the network and waveform, must be serialisable to JSON. The number of rows, the columns' shapes and dtypes, and the version are added.
+    """
+    num_rows = len(next(iter(columns.values()))) if columns else 0
+    header = dict(
+        header,
+        version=RESULTS_STORE_VERSION,
+        num_rows=num_rows,
+        columns=dict(
+            (key, dict(shape=list(value.shape[1:]), dtype=value.dtype.str))
+            for key, value in columns.items()
+        ),
+    )
+    tmp_path = f"{store_path}.{os.getpid()}.tmp"
+    if os.path.isdir(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+    for key, value in columns.items():
+        np.save(os.path.join(tmp_path, key + ".npy"), value)
+    with open(os.path.join(tmp_path, "header.json"), "w") as file:
+        json.dump(header, file, indent=1)
+    if os.path.isdir(store_path):
+        shutil.rmtree(store_path)
+    os.replace(tmp_path, store_path)
+
+
+class ResultsStore(object):
+    """Self-describing, memory-mapped columns of the results of a network for a set of injections.
+
+    The store is a directory of one .npy file per column and a header.json of metadata. Columns are only read when accessed, through memory maps, e.g. store["cov"][:10] only reads the first ten covariance matrices.
+
+    Attributes:
+        store_path (str): Path of the store directory.
+        header (Dict[str, Any]): Metadata, e.g. "network_spec", "science_case", "wf_model_name", "wf_other_var_dic", "num_injs_per_redshift_bin", "deriv_variables" (the order of the rows and columns of the covariance and Fisher matrices), "injections_file", and "columns".
+        columns (List[str]): Names of the columns, e.g. "inj_index" (row of the injection in "injections_file"), "inj_params", the LEGACY_RESULTS_COLUMNS, "cond_num", "det_snr" (in the order of "network_spec"), and "cov" and "fisher" (packed upper triangles, see unpack_upper_triangle).
+    """
+
+    def __init__(self, store_path: str):
+        """Initialises ResultsStore by reading the header.
+
+        Args:
+            store_path: Path of the store directory.
+        """
+        self.store_path = store_path
+        with open(os.path.join(store_path, "header.json"), "r") as file:
+            self.header = json.load(file)
+        self.columns = list(self.header["columns"])
+        self.memmaps: Dict[str, NDArray] = dict()
+
+    def __len__(self) -> int:
+        """Returns the number of rows, i.e. injections."""
+        return self.header["num_rows"]
+
+    def __contains__(self, column: str) -> bool:
+        """Returns whether the store has the column.
+
+        Args:
+            column: Name of the column.
+        """
+        return column in self.columns
+
+    def __getitem__(self, column: str) -> NDArray:
+        """Returns the read-only memory map of a column.
+
+        Args:
+            column: Name of the column.
+
+        Raises:
+            KeyError: If the column is not in the store.
+        """
+        if column not in self.columns:
+            raise KeyError(f"Column {column} not in the store {self.store_path}.")
+        if column not in self.memmaps:
+            self.memmaps[column] = np.load(
+                os.path.join(self.store_path, column + ".npy"), mmap_mode="r"
+            )
+        return self.memmaps[column]
+
+    def matrices(self, column: str) -> NDArray[np.float64]:
+        """Returns the full (row, parameter, parameter) matrices of a packed column, i.e. "cov" or "fisher".
+
+        Args:
+            column: Name of the packed column.
+        """
+        return unpack_upper_triangle(self[column])
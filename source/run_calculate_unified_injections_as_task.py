@@ -6,6 +6,8 @@ Using a specified task index, finds the corresponding injection parameters data
 Usage:
     Called in a job array by a slurm bash script, e.g.
     $ python3 run_calculate_unified_injections_as_task.py TASK_ID
+    Alternatively, as one of any number of workers that claim chunks of a master injections file from a work queue (see work_queue.py), e.g.
+    $ python3 run_calculate_unified_injections_as_task.py --queue ./data_raw_injections/INJECTIONS_FILE.npy
 
 License:
     BSD 3-Clause License
@@ -41,14 +43,20 @@ License:
 """
 # TODO: update Tuple to tuple when upgraded to Python 3.9+, similarly throughout codebase
 from typing import List, Set, Dict, Tuple, Optional, Union
+import os
 import sys
 import glob
 
 from lal import GreenwichMeanSiderealTime
+from gwbench.detector_response_derivatives import preload_det_responses_derivs_sym
 
 from networks import NET_LIST, BS2022_SIX
 from generate_symbolic_derivatives import generate_symbolic_derivatives
-from calculate_unified_injections import multi_network_results_for_injections_file
+from calculate_unified_injections import (
+    multi_network_results_for_injections_file,
+    analytic_derivs_used,
+)
+from work_queue import run_work_queue_worker
 
 
 def settings_from_task_id(
@@ -72,7 +80,20 @@ def settings_from_task_id(
             f"Number of matches in data_raw_injections/ path is not one: {len(matches)}"
         )
     # includes absolute path
-    file = matches[0]
+    return settings_from_injections_file(matches[0])
+
+
+def settings_from_injections_file(
+    file: str,
+) -> Tuple[str, Dict[str, Union[str, Optional[Dict[str, str]], bool, int]], int]:
+    """Returns injection file (with path), waveform parameters in a dictionary, and number of injections for the given injections file.
+
+    Args:
+        file: Injections file with path, either a task file or a master injections file.
+
+    Raises:
+        ValueError: If the science case is not recognised to set the waveform parameters.
+    """
     science_case, num_injs_per_redshift_bin_str = (
         file.replace("_INJS-PER-ZBIN_", "_SCI-CASE_")
         .replace("_TASK_", "_SCI-CASE_")
@@ -105,21 +126,50 @@ def settings_from_task_id(
 
 
 # --- user inputs
-task_id = int(sys.argv[1])
+# either a task ID of the job array or --queue and a master injections file to claim chunks of
+queue_mode = sys.argv[1] == "--queue"
 # ignore single detector network that is ill-conditioned (sky localisation really poor?) for BNS --> more relevant now that injections are rejected uniformly
 # TODO: update mprof if more networks used
 # network_specs = [net_spec for net_spec in NET_LIST if net_spec != ['CE2-40-CBO_C']]
 network_specs = BS2022_SIX["nets"]
-# 1464 is the maximum injs_per_task except for the last task, how many of those (counting from the start of the file) do we use?
+# the number of injections varies between tasks to balance their predicted wall time (see chop_injections_data_for_processing), how many of those (counting from the start of the file) do we use?
 process_injs_per_task = None  # defaults to maximum available
 # process_injs_per_task = 10
 debug = False
+# checkpoint the results every so many injections to resume from if the task is pre-empted, and stop cleanly before Slurm's time limit (04:00:00) with a margin for start-up and saving, in seconds
+checkpoint_every = 64
+wall_time_budget = 3.5 * 3600
+# number of injections in each chunk of the work queue and seconds until the lease of a chunk expires if its worker stops renewing it, e.g. if it dies
+chunk_size = 64
+lease_duration = 600
 # ---
 
-results_file_name = f"SLURM_TASK_{task_id}"
-injection_file_name, wf_dict, num_injs_per_redshift_bin = settings_from_task_id(task_id)
+if queue_mode:
+    injection_file_name, wf_dict, num_injs_per_redshift_bin = (
+        settings_from_injections_file(sys.argv[2])
+    )
+else:
+    task_id = int(sys.argv[1])
+    results_file_name = f"SLURM_TASK_{task_id}"
+    injection_file_name, wf_dict, num_injs_per_redshift_bin = settings_from_task_id(
+        task_id
+    )
 # settings: whether to account for the rotation of the earth, whether to only calculate results for the whole network, whether the masses are already redshifted by the injections module, whether to parallelize and if so on how many cores
-misc_settings_dict = dict(use_rot=True, only_net=True, redshifted=True, num_cores=None)
+# injs_per_batch stacks up to that many injections with the same frequency grid, None processes them one at a time
+# num_loc_cores evaluates the locations of each injection with a pool created once per task instead (only one of num_cores and num_loc_cores)
+# full_results also saves the injections, detector SNRs, condition numbers, and covariance and Fisher matrices in a results store next to each results file (see results_store.py)
+# grid_rtol benchmarks the injections of the waveform models in NON_UNIFORM_GRID_WF_MODELS on a non-uniform frequency grid with that target accuracy of power-law proxies of the integrals (tightened to 1e-3 for lal_bbh, see GRID_RTOL_FACTORS), None uses the uniform grid
+# with lal_bbh, the SNRs deviate from a fine uniform grid by 0.02% (0.2%) in the median (90th percentile) and the measurement errors by 0.2-0.3% (1-4%), but a few injections are off by up to a factor of two, see frequency_grid_for_injection in calculate_unified_injections.py
+misc_settings_dict = dict(
+    use_rot=True,
+    only_net=True,
+    redshifted=True,
+    num_cores=None,
+    num_loc_cores=None,
+    injs_per_batch=16,
+    grid_rtol=1e-2,
+    full_results=True,
+)
 tecs, locs = zip(
     *[
         det_spec.split("_")
@@ -152,9 +202,15 @@ deriv_dict: Dict[
     unique_locs=unique_locs,
 )
 deriv_dict["numerical_over_symbolic_derivs"] = wf_dict["numerical_over_symbolic_derivs"]
-if not deriv_dict["numerical_over_symbolic_derivs"]:
+# tf2 and tf2_tidal have analytic derivatives and don't need the lambdified functions, set False to use them anyway
+deriv_dict["analytic_derivs"] = True
+# otherwise, differentiate the polarizations once per injection and combine them with the antenna patterns of each location by the product rule, e.g. lalsimulation is then called for one set of perturbed parameters instead of one per location
+deriv_dict["factorised_derivs"] = True
+if analytic_derivs_used(wf_dict, deriv_dict):
     deriv_dict["numerical_deriv_settings"] = None
-    # TODO: Slurm gets upset when multiple tasks try to create the derivatives if there aren't any there already, so run in series using `$ python3 generate_symbolic_derivatives.py`. Presently, this just performs a check that they exist but hopefully won't regenerate them in parallel.
+elif not deriv_dict["numerical_over_symbolic_derivs"]:
+    deriv_dict["numerical_deriv_settings"] = None
+    # only missing or outdated derivatives are generated, and concurrent tasks wait on a lock for the one that is writing them instead of regenerating them
     generate_symbolic_derivatives(
         wf_dict["wf_model_name"],
         wf_dict["wf_other_var_dic"],
@@ -163,6 +219,12 @@ if not deriv_dict["numerical_over_symbolic_derivs"]:
         misc_settings_dict["use_rot"],
         print_progress=False,
     )
+    # deserialise the lambdified functions once, forked worker processes inherit the cache
+    preload_det_responses_derivs_sym(
+        deriv_dict["unique_locs"],
+        wf_dict["wf_model_name"],
+        deriv_dict["deriv_symbs_string"],
+    )
 else:
     deriv_dict["numerical_deriv_settings"] = dict(
         step=1e-9, method="central", order=2, n=1
@@ -181,7 +243,7 @@ if wf_dict["science_case"] == "bns" or "tidal" in wf_dict["wf_model_name"]:
 
 if debug:
     print(
-        results_file_name,
+        sys.argv[1:],
         network_specs,
         injection_file_name,
         num_injs_per_redshift_bin,
@@ -192,15 +254,36 @@ if debug:
         misc_settings_dict,
     )
 
-multi_network_results_for_injections_file(
-    results_file_name,
-    network_specs,
-    injection_file_name,
-    num_injs_per_redshift_bin,
-    process_injs_per_task,
-    base_params,
-    wf_dict,
-    deriv_dict,
-    misc_settings_dict,
-    debug=debug,
-)
+if queue_mode:
+    completed = run_work_queue_worker(
+        injection_file_name,
+        network_specs,
+        num_injs_per_redshift_bin,
+        base_params,
+        wf_dict,
+        deriv_dict,
+        misc_settings_dict,
+        chunk_size=chunk_size,
+        lease_duration=lease_duration,
+        debug=debug,
+        checkpoint_every=checkpoint_every,
+        wall_time_budget=wall_time_budget,
+    )
+else:
+    completed = multi_network_results_for_injections_file(
+        results_file_name,
+        network_specs,
+        injection_file_name,
+        num_injs_per_redshift_bin,
+        process_injs_per_task,
+        base_params,
+        wf_dict,
+        deriv_dict,
+        misc_settings_dict,
+        debug=debug,
+        checkpoint_every=checkpoint_every,
+        wall_time_budget=wall_time_budget,
+    )
+# running out of the wall time budget exits with its own status (75, EX_TEMPFAIL) to tell it apart from finishing (0, e.g. the queue is drained) and crashing (1), e.g. to requeue the task or submit more workers
+if not completed:
+    sys.exit(os.EX_TEMPFAIL)
@@ -51,4 +51,5 @@
 let "ONE_INDEXED_TASK_ID = ${SLURM_ARRAY_TASK_ID} + 1"
 
 # argument/s: task_id (handle everything else inside python)
+# exits with status 75 if the time limit was reached before all injections were processed, resubmitting the task resumes from its checkpoints
 srun python3 ./run_calculate_unified_injections_as_task.py ${ONE_INDEXED_TASK_ID}
@@ -0,0 +1,52 @@
+#!/bin/bash
+#
+#SBATCH --job-name=jobUnifiedInjsQueue
+#SBATCH --output=slurm_output_files/stdout_job_unified_injections_work_queue_JOB-ID_%A_TASK-ID_%a.txt
+#SBATCH --error=slurm_output_files/stderr_job_unified_injections_work_queue_JOB-ID_%A_TASK-ID_%a.txt
+#
+#SBATCH --ntasks=1
+#SBATCH --time=04:00:00 # HH:MM:SS
+#SBATCH --mem-per-cpu=250 # MB, determined from mprof (3.5 hr, 160 MB is likely enough)
+#
+#SBATCH --array=0-255 # any number of workers, each claims chunks of injections until none are left
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+# Slurm script to process a master injections file with a job array of work queue workers.
+# Usage: $ sbatch job_calculate_unified_injections_work_queue.sh ./data_raw_injections/INJECTIONS_FILE.npy
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+# 
+# License:
+#     BSD 3-Clause License
+# 
+#     Copyright (c) 2022, James Gardner.
+#     All rights reserved except for those for the gwbench code which remain reserved
+#     by S. Borhanian; the gwbench code is included in this repository for convenience.
+# 
+#     Redistribution and use in source and binary forms, with or without
+#     modification, are permitted provided that the following conditions are met:
+# 
+#     1. Redistributions of source code must retain the above copyright notice, this
+#        list of conditions and the following disclaimer.
+# 
+#     2. Redistributions in binary form must reproduce the above copyright notice,
+#        this list of conditions and the following disclaimer in the documentation
+#        and/or other materials provided with the distribution.
+# 
+#     3. Neither the name of the copyright holder nor the names of its
+#        contributors may be used to endorse or promote products derived from
+#        this software without specific prior written permission.
+# 
+#     THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+#     AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+#     IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+#     DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+#     FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+#     DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#     SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+#     CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+#     OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+#     OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# argument/s: master injections file, the first worker creates the work queue (see work_queue.py)
+# exits with status 75 if the time limit was reached before the queue was drained, e.g. to submit more workers
+srun python3 ./run_calculate_unified_injections_as_task.py --queue $1
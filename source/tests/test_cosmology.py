@@ -0,0 +1,78 @@
+"""Tests that the spline tables of gwbench.cosmology agree with astropy, and that the tables are cached on disk.
+
+License:
+    BSD 3-Clause License
+
+    Copyright (c) 2022, James Gardner.
+    All rights reserved except for those for the gwbench code which remain reserved
+    by S. Borhanian; the gwbench code is included in this repository for convenience.
+
+    Redistribution and use in source and binary forms, with or without
+    modification, are permitted provided that the following conditions are met:
+
+    1. Redistributions of source code must retain the above copyright notice, this
+       list of conditions and the following disclaimer.
+
+    2. Redistributions in binary form must reproduce the above copyright notice,
+       this list of conditions and the following disclaimer in the documentation
+       and/or other materials provided with the distribution.
+
+    3. Neither the name of the copyright holder nor the names of its
+       contributors may be used to endorse or promote products derived from
+       this software without specific prior written permission.
+
+    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+    AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+    IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+    DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+    FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+    DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+    SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+    CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+    OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+    OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+import os
+
+import astropy.cosmology as apcosm
+import numpy as np
+import pytest
+
+from gwbench import cosmology
+
+RTOL = 1e-5
+
+
+@pytest.fixture
+def empty_cosmology_caches(tmp_path, monkeypatch):
+    """Tabulates the cosmologies afresh into a temporary directory instead of the shared cache."""
+    monkeypatch.setattr(cosmology, "cosmology_tables_cache_path", str(tmp_path))
+    cosmology.clear_cosmology_caches()
+    yield tmp_path
+    cosmology.clear_cosmology_caches()
+
+
+@pytest.mark.parametrize(
+    "cosmo",
+    [
+        apcosm.Planck18,
+        cosmology.get_cosmology(H0=70, Om0=0.3, Ode0=0.7),
+        cosmology.get_cosmology(H0=70, Om0=0.3, Ode0=0.6),
+    ],
+    ids=["Planck18", "flat", "non-flat"],
+)
+def test_tables_agree_with_astropy(cosmo, empty_cosmology_caches) -> None:
+    """Checks the lookups and the round trips through the inverses at off-grid redshifts."""
+    for key, err in cosmology.max_rel_errors(cosmo, seed=0).items():
+        assert err < RTOL, f"{key} is not within {RTOL} of astropy"
+
+
+def test_table_is_read_from_disk(empty_cosmology_caches) -> None:
+    """Checks that a later process reads the table that an earlier one wrote, unchanged."""
+    zs = np.geomspace(1e-3, 50, 101)
+    DL = cosmology.luminosity_distance(zs)
+    assert len(os.listdir(empty_cosmology_caches)) == 1
+
+    cosmology.clear_cosmology_caches()
+    np.testing.assert_array_equal(cosmology.luminosity_distance(zs), DL)
@@ -0,0 +1,459 @@
+"""File-system-backed work queue to benchmark the injections of one master injections file with any number of workers.
+
+Workers claim small chunks of injection indices with leases in a SQLite database next to the results, renewing them while they work. If a worker dies, then its lease expires and the chunk is reclaimed by another worker. A chunk that raises an error is returned to the queue and marked as failed after a few attempts. This is an alternative to the fixed task files of the Slurm job array that lets the slow chunks be shared among whichever workers are free.
+
+Usage:
+    See run_calculate_unified_injections_as_task.py, e.g. to test locally with four workers:
+    $ for i in 1 2 3 4; do python3 run_calculate_unified_injections_as_task.py --queue INJECTIONS_FILE & done
+
+License:
+    BSD 3-Clause License
+
+    Copyright (c) 2022, James Gardner.
+    All rights reserved except for those for the gwbench code which remain reserved
+    by S. Borhanian; the gwbench code is included in this repository for convenience.
+
+    Redistribution and use in source and binary forms, with or without
+    modification, are permitted provided that the following conditions are met:
+
+    1. Redistributions of source code must retain the above copyright notice, this
+       list of conditions and the following disclaimer.
+
+    2. Redistributions in binary form must reproduce the above copyright notice,
+       this list of conditions and the following disclaimer in the documentation
+       and/or other materials provided with the distribution.
+
+    3. Neither the name of the copyright holder nor the names of its
+       contributors may be used to endorse or promote products derived from
+       this software without specific prior written permission.
+
+    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+    AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+    IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+    DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+    FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+    DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+    SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+    CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+    OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+    OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+from typing import List, Set, Dict, Tuple, Optional, Union, Iterator
+from contextlib import closing, contextmanager
+import os
+import socket
+import sqlite3
+import threading
+import time
+import traceback
+import numpy as np
+
+from calculate_unified_injections import (
+    multi_network_results_for_injections_file,
+    final_results_exist,
+)
+from network_subclass import NetworkExtended
+
+
+def work_queue_file_name(injections_file: str, data_path: str) -> str:
+    """Returns the filename (with path) of the work queue of an injections file, next to the results it produces.
+
+    Args:
+        injections_file: Master injections filename with path.
+        data_path: Path to the output processed data files.
+    """
+    return os.path.join(
+        data_path, os.path.basename(injections_file).replace(".npy", "_QUEUE.sqlite")
+    )
+
+
+def connect_to_work_queue(queue_file: str) -> sqlite3.Connection:
+    """Returns a connection to the SQLite database of a work queue, transactions are begun explicitly.
+
+    Args:
+        queue_file: Work queue filename with path.
+    """
+    # waits on the lock of the database instead of failing if another worker is writing
+    return sqlite3.connect(queue_file, timeout=600, isolation_level=None)
+
+
+def create_work_queue(
+    queue_file: str,
+    injections_file: str,
+    chunk_size: int = 64,
+) -> int:
+    """Creates the work queue of an injections file, split into chunks of chunk_size consecutive injections, if it doesn't already exist.
+
+    Every worker can call this, only the first creates the chunks and later calls keep the existing queue (and its chunk size).
+
+    Args:
+        queue_file: Work queue filename with path.
+        injections_file: Master injections filename with path.
+        chunk_size: Number of injections claimed by a worker at a time.
+
+    Returns:
+        int: Number of chunks in the queue.
+    """
+    num_injs = len(np.load(injections_file, mmap_mode="r"))
+    with closing(connect_to_work_queue(queue_file)) as connection:
+        connection.execute("BEGIN IMMEDIATE")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS chunks (chunk_id INTEGER PRIMARY KEY, start INTEGER, stop INTEGER, status TEXT, worker TEXT, lease_expires REAL, num_claims INTEGER, num_failures INTEGER, last_error TEXT)"
+        )
+        if connection.execute("SELECT COUNT(*) FROM chunks").fetchone()[0] == 0:
+            # chunk_id starts from 1 like the task IDs of the job array
+            connection.executemany(
+                "INSERT INTO chunks VALUES (?, ?, ?, 'pending', NULL, NULL, 0, 0, NULL)",
+                [
+                    (i + 1, start, min(start + chunk_size, num_injs))
+                    for i, start in enumerate(range(0, num_injs, chunk_size))
+                ],
+            )
+        num_chunks = connection.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+        connection.execute("COMMIT")
+    return num_chunks
+
+
+def claim_chunk(
+    queue_file: str, worker_id: str, lease_duration: float
+) -> Optional[Tuple[int, int, int]]:
+    """Returns a chunk of injections leased to the worker, either pending or with an expired lease (e.g. its worker died), or None if there are none left to claim.
+
+    Args:
+        queue_file: Work queue filename with path.
+        worker_id: Unique name of the worker.
+        lease_duration: Seconds until the lease expires unless renewed.
+
+    Returns:
+        Optional[Tuple[int, int, int]]: (chunk_id, start, stop) of the rows of the injections file in the chunk.
+    """
+    with closing(connect_to_work_queue(queue_file)) as connection:
+        # the transaction holds the write lock between finding and leasing the chunk, so no two workers claim the same chunk
+        connection.execute("BEGIN IMMEDIATE")
+        now = time.time()
+        chunk = connection.execute(
+            "SELECT chunk_id, start, stop FROM chunks WHERE status = 'pending' OR (status = 'leased' AND lease_expires < ?) ORDER BY chunk_id LIMIT 1",
+            (now,),
+        ).fetchone()
+        if chunk is not None:
+            connection.execute(
+                "UPDATE chunks SET status = 'leased', worker = ?, lease_expires = ?, num_claims = num_claims + 1 WHERE chunk_id = ?",
+                (worker_id, now + lease_duration, chunk[0]),
+            )
+        connection.execute("COMMIT")
+    return chunk
+
+
+def renew_lease(
+    queue_file: str, chunk_id: int, worker_id: str, lease_duration: float
+) -> bool:
+    """Extends the lease of a chunk by lease_duration from now and returns whether the worker still holds it.
+
+    Args:
+        queue_file: Work queue filename with path.
+        chunk_id: ID of the chunk.
+        worker_id: Unique name of the worker.
+        lease_duration: Seconds until the lease expires unless renewed again.
+    """
+    with closing(connect_to_work_queue(queue_file)) as connection:
+        return (
+            connection.execute(
+                "UPDATE chunks SET lease_expires = ? WHERE chunk_id = ? AND worker = ? AND status = 'leased'",
+                (time.time() + lease_duration, chunk_id, worker_id),
+            ).rowcount
+            == 1
+        )
+
+
+def release_chunk(queue_file: str, chunk_id: int, worker_id: str, done: bool) -> bool:
+    """Marks a chunk held by the worker as done, or otherwise returns it to the queue to be claimed again, and returns whether the worker still held it.
+
+    A chunk whose lease was lost, e.g. reclaimed by another worker after this one was suspended, is left to its new worker.
+
+    Args:
+        queue_file: Work queue filename with path.
+        chunk_id: ID of the chunk.
+        worker_id: Unique name of the worker.
+        done: Whether the results of the chunk are saved.
+    """
+    with closing(connect_to_work_queue(queue_file)) as connection:
+        if done:
+            cursor = connection.execute(
+                "UPDATE chunks SET status = 'done', lease_expires = NULL WHERE chunk_id = ? AND worker = ? AND status = 'leased'",
+                (chunk_id, worker_id),
+            )
+        else:
+            cursor = connection.execute(
+                "UPDATE chunks SET status = 'pending', worker = NULL, lease_expires = NULL WHERE chunk_id = ? AND worker = ? AND status = 'leased'",
+                (chunk_id, worker_id),
+            )
+        return cursor.rowcount == 1
+
+
+def fail_chunk(
+    queue_file: str, chunk_id: int, worker_id: str, error: str, max_failures: int = 3
+) -> bool:
+    """Records an error raised while benchmarking a chunk held by the worker and returns it to the queue, or marks it as "failed" after max_failures errors. Returns whether it was marked as failed.
+
+    Args:
+        queue_file: Work queue filename with path.
+        chunk_id: ID of the chunk.
+        worker_id: Unique name of the worker.
+        error: Description of the error, kept in the queue to inspect the failed chunks.
+        max_failures: Number of errors after which the chunk isn't claimed again.
+    """
+    with closing(connect_to_work_queue(queue_file)) as connection:
+        connection.execute("BEGIN IMMEDIATE")
+        connection.execute(
+            "UPDATE chunks SET status = CASE WHEN num_failures + 1 >= ? THEN 'failed' ELSE 'pending' END, worker = NULL, lease_expires = NULL, num_failures = num_failures + 1, last_error = ? WHERE chunk_id = ? AND worker = ? AND status = 'leased'",
+            (max_failures, error, chunk_id, worker_id),
+        )
+        failed = (
+            connection.execute(
+                "SELECT status FROM chunks WHERE chunk_id = ?", (chunk_id,)
+            ).fetchone()[0]
+            == "failed"
+        )
+        connection.execute("COMMIT")
+    return failed
+
+
+def work_queue_progress(queue_file: str) -> Dict[str, int]:
+    """Returns the number of chunks of a work queue with each status, i.e. "pending", "leased" (including expired leases), "done", and "failed".
+
+    Args:
+        queue_file: Work queue filename with path.
+    """
+    with closing(connect_to_work_queue(queue_file)) as connection:
+        progress = dict(pending=0, leased=0, done=0, failed=0)
+        progress.update(
+            connection.execute(
+                "SELECT status, COUNT(*) FROM chunks GROUP BY status"
+            ).fetchall()
+        )
+    return progress
+
+
+def work_queue_chunk_ids(queue_file: str) -> List[int]:
+    """Returns the IDs of all chunks of a work queue in order, i.e. the task IDs of the results files that it produces.
+
+    Args:
+        queue_file: Work queue filename with path.
+
+    Raises:
+        FileNotFoundError: If the work queue doesn't exist.
+    """
+    # connecting would create an empty database
+    if not os.path.isfile(queue_file):
+        raise FileNotFoundError(f"Work queue {queue_file} not found.")
+    with closing(connect_to_work_queue(queue_file)) as connection:
+        return [
+            chunk_id
+            for (chunk_id,) in connection.execute(
+                "SELECT chunk_id FROM chunks ORDER BY chunk_id"
+            )
+        ]
+
+
+@contextmanager
+def lease_heartbeat(
+    queue_file: str, chunk_id: int, worker_id: str, lease_duration: float
+) -> Iterator[threading.Event]:
+    """Renews the lease of a chunk in a background thread while the context is open.
+
+    A worker that dies stops renewing, so its lease expires after at most lease_duration and the chunk is reclaimed by another worker.
+
+    Args:
+        queue_file: Work queue filename with path.
+        chunk_id: ID of the chunk.
+        worker_id: Unique name of the worker.
+        lease_duration: Seconds until the lease expires unless renewed, it is renewed every quarter of this.
+
+    Yields:
+        threading.Event: Set if the lease was lost, e.g. the worker was suspended for longer than lease_duration.
+    """
+    stopped, lease_lost = threading.Event(), threading.Event()
+
+    def renew_until_stopped() -> None:
+        while not stopped.wait(lease_duration / 4):
+            if not renew_lease(queue_file, chunk_id, worker_id, lease_duration):
+                lease_lost.set()
+                return
+
+    heartbeat = threading.Thread(target=renew_until_stopped, daemon=True)
+    heartbeat.start()
+    try:
+        yield lease_lost
+    finally:
+        stopped.set()
+        heartbeat.join()
+
+
+def chunk_results_exist(
+    chunk_id: int,
+    network_specs: List[List[str]],
+    wf_dict: Dict[str, Union[str, Optional[Dict[str, str]], bool, int]],
+    num_injs_per_redshift_bin: int,
+    misc_settings_dict: Dict[str, Optional[int]],
+    data_path: str,
+) -> bool:
+    """Returns whether the results of every network are saved for a chunk, e.g. by a worker that died before marking it done.
+
+    With misc_settings_dict["full_results"], the results of a network only count as saved once its results store is too (see final_results_exist in calculate_unified_injections.py), so a chunk whose worker died between writing the two is processed again.
+
+    Args:
+        chunk_id: ID of the chunk.
+        network_specs: Set of networks to analyse.
+        wf_dict: Waveform dictionary of model name and options, also contains the science case string.
+        num_injs_per_redshift_bin: Total number of injections from the injections file (used for labelling).
+        misc_settings_dict: Options for gwbench, e.g. whether results stores are saved.
+        data_path: Path to the output processed data files.
+    """
+    return all(
+        final_results_exist(
+            NetworkExtended(
+                network_spec,
+                wf_dict["science_case"],
+                wf_dict["wf_model_name"],
+                wf_dict["wf_other_var_dic"],
+                num_injs_per_redshift_bin,
+                file_name=f"SLURM_TASK_{chunk_id}",
+                data_path=data_path,
+            ).file_name_with_path,
+            misc_settings_dict,
+        )
+        for network_spec in network_specs
+    )
+
+
+def run_work_queue_worker(
+    injections_file: str,
+    network_specs: List[List[str]],
+    num_injs_per_redshift_bin: int,
+    base_params: Dict[str, Union[int, float]],
+    wf_dict: Dict[str, Union[str, Optional[Dict[str, str]], bool, int]],
+    deriv_dict: Dict[
+        str,
+        Union[
+            str,
+            Tuple[str, ...],
+            List[Set[str]],
+            bool,
+            Optional[Dict[str, Union[float, str, int]]],
+        ],
+    ],
+    misc_settings_dict: Dict[str, Optional[int]],
+    data_path: str = "./data_processed_injections/task_files/",
+    chunk_size: int = 64,
+    lease_duration: float = 600.0,
+    worker_id: Optional[str] = None,
+    debug: bool = False,
+    checkpoint_every: Optional[int] = None,
+    wall_time_budget: Optional[float] = None,
+    max_failures: int = 3,
+) -> bool:
+    """Claims chunks of injections from the work queue of an injections file and benchmarks them until the queue is empty or the wall time budget is spent.
+
+    Any number of workers, e.g. on different nodes or as separate processes on one machine, can run this on the same injections file and data_path (which needs working file locks for SQLite). The queue is created by the first worker. The results of each chunk are saved by multi_network_results_for_injections_file as if from a task with the chunk's ID, so they are merged like those of the job array. A chunk whose worker died is reclaimed once its lease expires and resumes from the worker's checkpoints.
+
+    If the worker loses the lease of its chunk, e.g. it was suspended for longer than lease_duration and another worker reclaimed the chunk, then it stops at the next checkpoint and abandons the chunk to the other worker. If benchmarking a chunk raises an exception, then the traceback is printed and the chunk is returned to the queue, or marked as failed after max_failures attempts, and the worker moves on to the next chunk.
+
+    Args:
+        injections_file: Master injections filename with path, e.g. not chopped into task files.
+        network_specs: Set of networks to analyse.
+        num_injs_per_redshift_bin: Total number of injections from the injections file (used for labelling).
+        base_params: Common parameters among injections, e.g. time of coalesence.
+        wf_dict: Waveform dictionary of model name and options, also contains the science case string.
+        deriv_dict: Derivative options dictionary.
+        misc_settings_dict: Options for gwbench, e.g. whether to account for Earth's rotation about its axis.
+        data_path: Path to the output processed data files and the work queue.
+        chunk_size: Number of injections claimed at a time, only used by the worker that creates the queue.
+        lease_duration: Seconds until the lease of a chunk expires without the worker renewing it.
+        worker_id: Unique name of the worker. Defaults to the hostname and process ID.
+        debug: Whether to debug.
+        checkpoint_every: Number of injections between checkpoints within a chunk, see multi_network_results_for_injections_file.
+        wall_time_budget: Seconds since the call after which no new checkpoint is started, e.g. a margin below Slurm's time limit. No limit if None.
+        max_failures: Number of attempts at a chunk that raise an exception after which it is marked as failed and not claimed again.
+
+    Returns:
+        bool: Whether the worker stopped because no chunks were left to claim, False if it ran out of the wall time budget.
+    """
+    start_time = time.monotonic()
+    if worker_id is None:
+        worker_id = f"{socket.gethostname()}_{os.getpid()}"
+    queue_file = work_queue_file_name(injections_file, data_path)
+    create_work_queue(queue_file, injections_file, chunk_size)
+
+    while True:
+        chunk = claim_chunk(queue_file, worker_id, lease_duration)
+        if chunk is None:
+            return True
+        chunk_id, start, stop = chunk
+        if chunk_results_exist(
+            chunk_id,
+            network_specs,
+            wf_dict,
+            num_injs_per_redshift_bin,
+            misc_settings_dict,
+            data_path,
+        ):
+            release_chunk(queue_file, chunk_id, worker_id, done=True)
+            continue
+        with lease_heartbeat(
+            queue_file, chunk_id, worker_id, lease_duration
+        ) as lease_lost:
+            try:
+                completed = multi_network_results_for_injections_file(
+                    f"SLURM_TASK_{chunk_id}",
+                    network_specs,
+                    injections_file,
+                    num_injs_per_redshift_bin,
+                    None,
+                    base_params,
+                    wf_dict,
+                    deriv_dict,
+                    misc_settings_dict,
+                    data_path=data_path,
+                    debug=debug,
+                    checkpoint_every=checkpoint_every,
+                    wall_time_budget=(
+                        None
+                        if wall_time_budget is None
+                        else wall_time_budget - (time.monotonic() - start_time)
+                    ),
+                    inj_range=(start, stop),
+                    stop_event=lease_lost,
+                )
+            except Exception:
+                traceback.print_exc()
+                failed = fail_chunk(
+                    queue_file,
+                    chunk_id,
+                    worker_id,
+                    traceback.format_exc(),
+                    max_failures=max_failures,
+                )
+                print(
+                    f"{worker_id} raised an error in chunk {chunk_id} of injections {start} to {stop}, "
+                    + (
+                        f"marked as failed after {max_failures} attempts."
+                        if failed
+                        else "returned to the queue."
+                    )
+                )
+                continue
+        # the other worker that reclaimed the chunk resumes from the checkpoints and marks it done
+        if lease_lost.is_set() or not release_chunk(
+            queue_file, chunk_id, worker_id, done=completed
+        ):
+            print(
+                f"{worker_id} lost the lease of chunk {chunk_id} of injections {start} to {stop}, abandoning it."
+            )
+            continue
+        if not completed:
+            # out of time, the chunk is claimed again by another worker which resumes from the checkpoints
+            return False
+        if debug:
+            print(
+                f"{worker_id} completed chunk {chunk_id} of injections {start} to {stop}, progress: {work_queue_progress(queue_file)}"
+            )